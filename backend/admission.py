@@ -0,0 +1,162 @@
+"""
+Admission control for /chat.
+
+At most ``max_concurrent`` answers are generated at once; further requests
+wait in a bounded queue and are rejected with 429 once it holds
+``max_queue`` requests, so a burst queues up to a known depth instead of
+slowing every stream down at once. The slot or queue position is reserved
+when the request arrives (``try_admit``, synchronously in the endpoint), not
+when its response starts streaming, so a burst can't get past the limit in
+between; the stream then holds the reservation (``slot``).
+
+The queue is fair across sessions: waiting requests are grouped by session
+and sessions take turns, so one client firing many requests can't push the
+others back. When a request starts while at least ``shed_depth`` others are
+still queued, it is marked to skip the follow-up question rewrite (an extra
+LLM call) and retrieves on the raw question instead.
+"""
+
+import asyncio
+import math
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Deque, Dict, NamedTuple, Optional
+
+# Initial guess of a request's duration, until one has been measured
+DEFAULT_SERVICE_SECONDS = 5.0
+# Weight of the latest request in the service time average
+SERVICE_SMOOTHING = 0.2
+MAX_RETRY_AFTER_SECONDS = 60
+
+class Slot(NamedTuple):
+    """A granted generation slot"""
+    arrived: float  # perf_counter() when the request arrived
+    wait_seconds: float  # Time spent queued
+    shed_contextualize: bool  # Skip the follow-up rewrite, the queue is long
+
+class Reservation:
+    """A request's slot, or its place in the queue until a slot is handed over"""
+
+    def __init__(self, controller: "AdmissionController", session_id: str, waiter: Optional[asyncio.Future]):
+        self.controller = controller
+        self.session_id = session_id
+        self.waiter = waiter  # None when a free slot was taken at once (or there's no limit)
+        self.arrived = time.perf_counter()
+        self.released = False
+
+    def release(self) -> None:
+        """Give back the slot, or the queue position; only the first call counts"""
+        if not self.released:
+            self.released = True
+            self.controller._give_back(self)
+
+class AdmissionController:
+    """Concurrency limit with a bounded, per-session round-robin queue"""
+
+    def __init__(self, max_concurrent: int, max_queue: int, shed_depth: int = 0):
+        self.max_concurrent = max_concurrent  # 0 = unlimited (no admission control)
+        self.max_queue = max_queue
+        self.shed_depth = shed_depth  # 0 = never shed
+        self.active = 0
+        self.queued = 0
+        # Waiters by session, in the order sessions get their next turn
+        self._queues: "OrderedDict[str, Deque[asyncio.Future]]" = OrderedDict()
+        self._service_seconds = DEFAULT_SERVICE_SECONDS
+        self.admitted = 0
+        self.waited = 0
+        self.rejected = 0
+        self.shed = 0
+
+    def try_admit(self, session_id: str) -> Optional[Reservation]:
+        """Take a free slot or a queue position right away; None if the queue is full"""
+        if self.max_concurrent <= 0:
+            return Reservation(self, session_id, None)
+        if self.active < self.max_concurrent and not self.queued:
+            self.active += 1
+            return Reservation(self, session_id, None)
+        if self.queued >= self.max_queue:
+            return None
+        waiter = asyncio.get_running_loop().create_future()
+        self._queues.setdefault(session_id, deque()).append(waiter)
+        self.queued += 1
+        self.waited += 1
+        return Reservation(self, session_id, waiter)
+
+    def reject(self) -> int:
+        """Count a rejection; returns the Retry-After seconds to send"""
+        self.rejected += 1
+        return self.retry_after()
+
+    def retry_after(self) -> int:
+        """Estimated seconds until the current queue has drained"""
+        seconds = (self.queued + 1) / max(self.max_concurrent, 1) * self._service_seconds
+        return min(max(math.ceil(seconds), 1), MAX_RETRY_AFTER_SECONDS)
+
+    @asynccontextmanager
+    async def slot(self, reservation: Reservation) -> AsyncIterator[Slot]:
+        """Wait for the reserved slot (if queued) and hold it; releases the reservation"""
+        started = None
+        try:
+            if self.max_concurrent <= 0:
+                yield Slot(reservation.arrived, 0.0, False)
+                return
+            if reservation.waiter is not None:
+                await reservation.waiter
+            started = time.perf_counter()
+            shed = 0 < self.shed_depth <= self.queued
+            self.admitted += 1
+            self.shed += shed
+            yield Slot(reservation.arrived, started - reservation.arrived, shed)
+        finally:
+            if started is not None:
+                self._service_seconds += SERVICE_SMOOTHING * (
+                    time.perf_counter() - started - self._service_seconds
+                )
+            reservation.release()
+
+    def _give_back(self, reservation: Reservation) -> None:
+        if self.max_concurrent <= 0:
+            return
+        waiter = reservation.waiter
+        if waiter is None or (waiter.done() and not waiter.cancelled()):
+            self._release()
+            return
+        # Still queued (the client left before its turn): drop the position
+        waiter.cancel()
+        waiters = self._queues.get(reservation.session_id)
+        if waiters is not None and waiter in waiters:
+            waiters.remove(waiter)
+            self.queued -= 1
+            if not waiters:
+                del self._queues[reservation.session_id]
+
+    def _release(self) -> None:
+        self.active -= 1
+        while self.active < self.max_concurrent and self._queues:
+            session_id, waiters = next(iter(self._queues.items()))
+            waiter = waiters.popleft()
+            self.queued -= 1
+            if waiters:
+                # The session's next request waits for the other sessions' turns
+                self._queues.move_to_end(session_id)
+            else:
+                del self._queues[session_id]
+            if not waiter.done():
+                waiter.set_result(None)
+                self.active += 1
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "max_concurrent": self.max_concurrent,
+            "max_queue": self.max_queue,
+            "active": self.active,
+            "queued": self.queued,
+            "queued_sessions": len(self._queues),
+            "admitted": self.admitted,
+            "waited": self.waited,
+            "rejected": self.rejected,
+            "shed_contextualize": self.shed,
+            "avg_service_seconds": round(self._service_seconds, 3),
+            "retry_after_seconds": self.retry_after(),
+        }
@@ -144,7 +144,7 @@ async def run_benchmark():
     print("\n" + "=" * 60)
     print("✅ Benchmark Complete!")
     print("\n💡 Tips:")
-    print("  • First request is slower (cold start)")
+    print("  • First request is slower (cold start) unless WARMUP_ON_STARTUP is enabled")
     print("  • Subsequent requests benefit from caching")
     print("  • Concurrent performance shows connection pool efficiency")
     print("=" * 60)
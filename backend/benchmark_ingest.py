@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+"""
+Ingestion micro-benchmark: time and memory per pipeline stage.
+
+Runs the same steps as ingest.py, one stage at a time over all inputs, in
+this process:
+
+- load: PyPDFLoader text extraction
+- clean: UTF-8 cleanup and source metadata (ingest.clean_pages)
+- split: RecursiveCharacterTextSplitter
+- embed: EmbeddingBatcher with the fake embedder (or Gemini with --embedder gemini)
+- insert: PGVector.add_embeddings into a scratch ``bench_ingest`` collection
+
+Each stage reports seconds, pages/s or chunks/s, RSS after the stage and the
+process's peak RSS so far (plus the Python allocation peak with
+--tracemalloc). ingest.py parses in a process pool, so these are per-core
+costs; divide by INGEST_WORKERS to estimate the parse stages of a reindex.
+
+    python benchmark_ingest.py                              # data/pdfs/thesis.pdf
+    python benchmark_ingest.py --synthetic-pages 500 --synthetic-files 4 --no-insert
+    python benchmark_ingest.py --profile ingest.prof        # cProfile, view with snakeviz/pstats
+    py-spy record -o ingest.svg -- python benchmark_ingest.py --synthetic-pages 1000
+"""
+
+import argparse
+import cProfile
+import json
+import os
+import pstats
+import resource
+import tempfile
+import time
+import tracemalloc
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional
+from langchain_community.document_loaders import PyPDFLoader
+from langchain_core.documents import Document
+from langchain_postgres import PGVector
+from config import get_settings
+from fakes import FakeEmbeddings, write_synthetic_pdf
+from ingest import assign_chunk_ids, clean_pages, get_embedding_batcher, get_embeddings, get_text_splitter
+
+settings = get_settings()
+
+COLLECTION_NAME = "bench_ingest"
+
+def rss_mb() -> Optional[float]:
+    """Current resident set size (Linux /proc; None elsewhere)"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / (1 << 20)
+    except (OSError, ValueError):
+        return None
+
+def peak_rss_mb() -> float:
+    """Process high-water RSS (ru_maxrss is KB on Linux, bytes on macOS)"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1 << 20) if os.uname().sysname == "Darwin" else peak / 1024
+
+class StageTimer:
+    """Collects seconds, throughput and memory for each stage"""
+
+    def __init__(self, trace_allocations: bool = False):
+        self.trace_allocations = trace_allocations
+        self.stages: Dict[str, Dict[str, Any]] = {}
+
+    @contextmanager
+    def stage(self, name: str, unit: str) -> Iterator[Dict[str, Any]]:
+        """Time a block; the block sets result["items"] to the pages/chunks it handled"""
+        result: Dict[str, Any] = {"items": 0, "unit": unit}
+        if self.trace_allocations:
+            tracemalloc.reset_peak()
+        started = time.perf_counter()
+        yield result
+        seconds = time.perf_counter() - started
+        result["seconds"] = round(seconds, 3)
+        result[f"{unit}_per_s"] = round(result["items"] / seconds, 1) if seconds else None
+        result["rss_mb"] = round(rss_mb(), 1) if rss_mb() is not None else None
+        result["peak_rss_mb"] = round(peak_rss_mb(), 1)
+        if self.trace_allocations:
+            result["python_peak_mb"] = round(tracemalloc.get_traced_memory()[1] / (1 << 20), 1)
+        self.stages[name] = result
+        print(f"  {name:<7} {result['seconds']:>8.2f}s  {result['items']:>7} {unit:<6} "
+              f"{result[f'{unit}_per_s'] or 0:>9.1f}/s  rss {result['rss_mb']}MB  peak {result['peak_rss_mb']}MB")
+
+def input_files(args: argparse.Namespace, workdir: str) -> List[str]:
+    files = [path for path in args.pdf if os.path.exists(path)]
+    for missing in sorted(set(args.pdf) - set(files)):
+        print(f"  ✗ {missing} not found, skipped")
+    for i in range(args.synthetic_files if args.synthetic_pages else 0):
+        path = os.path.join(workdir, f"synthetic-{i}.pdf")
+        files.append(write_synthetic_pdf(path, args.synthetic_pages, seed=args.seed + i))
+    return files
+
+def run(args: argparse.Namespace) -> Dict[str, Any]:
+    timer = StageTimer(trace_allocations=args.tracemalloc)
+    if args.tracemalloc:
+        tracemalloc.start()
+    started = time.perf_counter()
+
+    with tempfile.TemporaryDirectory(prefix="bench-ingest-") as workdir:
+        files = input_files(args, workdir)
+        if not files:
+            raise SystemExit("No input PDFs (pass --pdf or --synthetic-pages)")
+        print(f"Benchmarking ingestion of {len(files)} files, rss {rss_mb():.1f}MB")
+
+        raw_pages: List[List[Document]] = []
+        with timer.stage("load", "pages") as result:
+            for path in files:
+                raw_pages.append(PyPDFLoader(path).load())
+            result["items"] = sum(len(pages) for pages in raw_pages)
+
+        with timer.stage("clean", "pages") as result:
+            pages = [clean_pages(path, docs) for path, docs in zip(files, raw_pages)]
+            result["items"] = sum(len(docs) for docs in pages)
+        del raw_pages
+
+        chunks: List[Document] = []
+        with timer.stage("split", "chunks") as result:
+            splitter = get_text_splitter()
+            for path, docs in zip(files, pages):
+                file_chunks = splitter.split_documents(docs)
+                assign_chunk_ids(os.path.basename(path), file_chunks)
+                chunks.extend(file_chunks)
+            result["items"] = len(chunks)
+
+        embeddings = (
+            get_embeddings() if args.embedder == "gemini"
+            else FakeEmbeddings(dims=args.dims, latency=args.embedding_ms / 1000)
+        )
+        batcher = get_embedding_batcher(embeddings)
+        texts = [chunk.page_content for chunk in chunks]
+        with timer.stage("embed", "chunks") as result:
+            vectors = batcher.embed(texts)
+            result["items"] = len(vectors)
+
+        if args.insert:
+            store = PGVector(
+                embeddings=embeddings,
+                collection_name=COLLECTION_NAME,
+                connection=settings.DATABASE_URL,
+                use_jsonb=True,
+                pre_delete_collection=True,
+            )
+            with timer.stage("insert", "chunks") as result:
+                for start in range(0, len(chunks), settings.INGEST_BATCH_SIZE):
+                    batch = chunks[start:start + settings.INGEST_BATCH_SIZE]
+                    store.add_embeddings(
+                        texts[start:start + len(batch)],
+                        vectors[start:start + len(batch)],
+                        metadatas=[chunk.metadata for chunk in batch],
+                        # Chunk ids are deterministic, keep them apart from thesis_docs rows
+                        ids=[f"{COLLECTION_NAME}-{chunk.id}" for chunk in batch],
+                    )
+                result["items"] = len(chunks)
+            store.delete_collection()
+
+    seconds = time.perf_counter() - started
+    total_pages = timer.stages["load"]["items"]
+    return {
+        "files": len(files),
+        "pages": total_pages,
+        "chunks": len(chunks),
+        "seconds": round(seconds, 3),
+        "pages_per_s": round(total_pages / seconds, 1),
+        "chunks_per_s": round(len(chunks) / seconds, 1),
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+        "embedding_requests": batcher.requests,
+        "stages": timer.stages,
+        "args": {key: value for key, value in vars(args).items() if key not in ("output", "profile")},
+    }
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Time and memory per ingestion stage")
+    parser.add_argument("--pdf", nargs="*", default=["data/pdfs/thesis.pdf"], help="Real PDFs to include")
+    parser.add_argument("--synthetic-pages", type=int, default=0, help="Pages per synthetic PDF (0 = none)")
+    parser.add_argument("--synthetic-files", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--embedder", choices=["fake", "gemini"], default="fake")
+    parser.add_argument("--dims", type=int, default=768, help="Fake embedding dimensions")
+    parser.add_argument("--embedding-ms", type=float, default=0.0, help="Fake latency per embedding request")
+    parser.add_argument("--no-insert", dest="insert", action="store_false", help="Skip the Postgres stage")
+    parser.add_argument("--tracemalloc", action="store_true", help="Also report Python allocation peaks (slower)")
+    parser.add_argument("--profile", help="Write cProfile stats for the whole run to this file")
+    parser.add_argument("--output", help="Write the results as JSON")
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = parse_args()
+    profiler = cProfile.Profile() if args.profile else None
+    if profiler:
+        profiler.enable()
+    results = run(args)
+    if profiler:
+        profiler.disable()
+        profiler.dump_stats(args.profile)
+        print(f"\n✓ cProfile stats written to {args.profile}, top functions by cumulative time:")
+        pstats.Stats(profiler).sort_stats("cumulative").print_stats(15)
+
+    print(f"\n✓ {results['pages']} pages, {results['chunks']} chunks in {results['seconds']:.2f}s: "
+          f"{results['pages_per_s']} pages/s, {results['chunks_per_s']} chunks/s, "
+          f"peak RSS {results['peak_rss_mb']}MB")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+            f.write("\n")
+        print(f"✓ Results written to {args.output}")
@@ -0,0 +1,531 @@
+#!/usr/bin/env python3
+"""
+Offline, reproducible benchmark of the /chat pipeline.
+
+Runs the FastAPI app in-process (direct ASGI calls, no server or network),
+with fakes.py standing in for Gemini and the embedding model, against the
+local Postgres/pgvector database. Synthetic corpora are loaded into their
+own ``bench_*`` collections and benchmark sessions use ``bench-`` ids, so
+the real thesis_docs collection and chat history are left alone.
+
+Load is open-loop: requests arrive on a seeded Poisson schedule at --rate
+per second whether or not earlier ones have finished, and latencies are
+measured from the scheduled arrival, so queueing shows up in the numbers
+instead of slowing the load generator down.
+
+Scenarios:
+- cold_start: startup plus first request, with and without WARMUP_ON_STARTUP
+- steady: first-turn questions against the base corpus
+- long_history: follow-up questions on sessions with long stored histories
+- large_corpus: the steady load against a much larger collection
+- high_concurrency: the base corpus at --concurrency-rate requests/s
+
+Results are written as JSON (stable key order, so runs diff cleanly);
+--baseline compares against a saved run and exits with status 1 when a
+latency percentile regresses by more than --tolerance.
+
+    python benchmark_offline.py --output bench.json
+    python benchmark_offline.py --baseline bench.json --output bench-new.json
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import platform
+import random
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Optional, Sequence
+import psycopg
+from psycopg import sql
+from langchain_core.messages import AIMessage, HumanMessage
+from config import get_settings
+from fakes import FakeChatModel, FakeEmbeddings, synthetic_chunks, synthetic_questions, synthetic_text
+import db
+import main
+import metrics
+import rag_chain
+from admission import AdmissionController
+from history_store import PooledChatMessageHistory
+from single_flight import SingleFlight
+from vector_index import ensure_partition_index, ensure_text_search_index
+from vector_search import AsyncVectorSearch
+
+settings = get_settings()
+
+SCENARIOS = ("cold_start", "steady", "long_history", "large_corpus", "high_concurrency")
+
+SESSION_PREFIX = "bench-"
+
+# Chunks written per add_documents call when seeding a collection
+SEED_BATCH_SIZE = 500
+
+# Follow-ups that reference earlier turns, so contextualization runs
+FOLLOW_UPS = (
+    "E quanto a isso?",
+    "Can you explain that in more detail?",
+    "Como isso se compara com o anterior?",
+    "What are its limitations?",
+)
+
+PERCENTILES = (50, 90, 95, 99)
+
+# Settings that change what the benchmark measures, recorded with the results
+RECORDED_SETTINGS = (
+    "DB_POOL_SIZE", "VECTOR_SEARCH_K", "RETRIEVAL_TOP_K", "RETRIEVAL_MODE", "HYBRID_SEARCH",
+    "RERANKER", "CONTEXT_TOKEN_BUDGET", "HISTORY_WINDOW", "CONTEXTUALIZE_MODE",
+    "VECTOR_INDEX_TYPE", "HNSW_EF_SEARCH", "IVFFLAT_PROBES",
+    "VECTOR_QUANTIZATION", "VECTOR_RESCORE_CANDIDATES",
+    "CHAT_MAX_CONCURRENT", "CHAT_MAX_QUEUE", "CHAT_SHED_CONTEXTUALIZE_QUEUE",
+)
+
+def percentiles(values: Sequence[float]) -> Dict[str, float]:
+    """p50/p90/p95/p99 (linear interpolation), mean and max"""
+    if not values:
+        return {}
+    ordered = sorted(values)
+    summary = {}
+    for p in PERCENTILES:
+        position = (len(ordered) - 1) * p / 100
+        lower = math.floor(position)
+        upper = min(lower + 1, len(ordered) - 1)
+        value = ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+        summary[f"p{p}"] = round(value, 1)
+    summary["mean"] = round(sum(ordered) / len(ordered), 1)
+    summary["max"] = round(ordered[-1], 1)
+    return summary
+
+# ---------------------------------------------------------------------------
+# App setup
+
+def install_fakes(args: argparse.Namespace) -> None:
+    """Point the chain at the fake LLM and embeddings before it is built"""
+    llm = FakeChatModel(
+        first_token_delay=args.first_token_ms / 1000,
+        tokens_per_second=args.tokens_per_second,
+        answer_tokens=args.answer_tokens,
+    )
+    embeddings = FakeEmbeddings(dims=args.dims, latency=args.embedding_ms / 1000)
+    rag_chain.get_llm = lambda: llm
+    rag_chain.get_summary_llm = lambda: llm
+    rag_chain.get_embeddings = lambda: embeddings
+    # Synthetic answers must not end up in the shared semantic cache table
+    settings.SEMANTIC_CACHE_ENABLED = False
+    settings.VECTOR_INDEX_ON_STARTUP = False
+
+async def reset_app(collection: str) -> None:
+    """Drop every process-wide singleton so the next startup is a cold one"""
+    await db.close_connection_pool()
+    rag_chain.get_rag_chain.cache_clear()
+    rag_chain.get_chat_chain.cache_clear()
+    rag_chain._async_vector_search = AsyncVectorSearch(rag_chain.get_embeddings(), collection_name=collection)
+    rag_chain._reranker = None
+    rag_chain._contextualizer = None
+    main._single_flight = SingleFlight()
+    main._admission = AdmissionController(
+        settings.CHAT_MAX_CONCURRENT, settings.CHAT_MAX_QUEUE, settings.CHAT_SHED_CONTEXTUALIZE_QUEUE
+    )
+    main._ready = False
+    metrics.reset()
+
+async def start_app(collection: str) -> float:
+    """Cold start of the app against a collection; returns the startup time in ms"""
+    await reset_app(collection)
+    started = time.perf_counter()
+    await main.startup_event()
+    return (time.perf_counter() - started) * 1000
+
+def collection_size(name: str) -> int:
+    with psycopg.connect(settings.ASYNC_DATABASE_URL) as conn:
+        row = conn.execute(
+            "SELECT count(*) FROM langchain_pg_embedding e "
+            "JOIN langchain_pg_collection c ON e.collection_id = c.uuid WHERE c.name = %s",
+            (name,),
+        ).fetchone()
+    return row[0]
+
+def seed_corpus(size: int, dims: int, seed: int) -> str:
+    """Load a synthetic corpus into its own collection (reused when already there)"""
+    name = f"bench_{size}_{dims}_{seed}"
+    try:
+        if collection_size(name) == size:
+            print(f"✓ Reusing collection {name}")
+            return name
+    except psycopg.errors.UndefinedTable:
+        pass
+
+    # Only needed for seeding; keeps SQLAlchemy out of benchmark_startup.py's workers
+    from langchain_postgres import PGVector
+    
+    print(f"Seeding {name} with {size} synthetic chunks...")
+    started = time.perf_counter()
+    store = PGVector(
+        embeddings=FakeEmbeddings(dims=dims),
+        collection_name=name,
+        connection=settings.DATABASE_URL,
+        use_jsonb=True,
+        pre_delete_collection=True,
+    )
+    docs = synthetic_chunks(size, seed=seed, id_prefix=name)
+    for start in range(0, size, SEED_BATCH_SIZE):
+        batch = docs[start:start + SEED_BATCH_SIZE]
+        store.add_documents(batch, ids=[doc.id for doc in batch])
+    ensure_partition_index()
+    ensure_text_search_index()
+    print(f"✓ Seeded {name} in {time.perf_counter() - started:.1f}s")
+    return name
+
+async def seed_histories(prefix: str, sessions: int, messages: int, seed: int) -> List[str]:
+    """Sessions with `messages` stored messages each"""
+    rng = random.Random(seed)
+    session_ids = []
+    for i in range(sessions):
+        history = PooledChatMessageHistory("chat_history", f"{SESSION_PREFIX}{prefix}-{i}")
+        await history.aclear()
+        turns = []
+        for turn in range(messages):
+            if turn % 2 == 0:
+                turns.append(HumanMessage(content=synthetic_text(rng, rng.randint(5, 12))[:-1] + "?"))
+            else:
+                turns.append(AIMessage(content=synthetic_text(rng, rng.randint(60, 120))))
+        await history.aadd_messages(turns)
+        session_ids.append(history.session_id)
+    return session_ids
+
+async def delete_bench_sessions() -> None:
+    async with db.lease_connection() as conn:
+        for table in ("chat_history", "chat_history_summary"):
+            await conn.execute(
+                sql.SQL("DELETE FROM {table} WHERE session_id LIKE %s").format(
+                    table=sql.Identifier(table)
+                ),
+                (SESSION_PREFIX + "%",),
+            )
+
+# ---------------------------------------------------------------------------
+# Load generation
+
+async def asgi_post(path: str, payload: Dict[str, Any]) -> Dict[str, Any]:
+    """POST to the app in-process, timing the first body byte and the end of the stream"""
+    body = json.dumps(payload).encode("utf-8")
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0", "spec_version": "2.3"},
+        "http_version": "1.1",
+        "method": "POST",
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode("ascii"),
+        "root_path": "",
+        "query_string": b"",
+        "headers": [
+            (b"host", b"bench"),
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(body)).encode("ascii")),
+        ],
+        "client": ("127.0.0.1", 0),
+        "server": ("bench", 80),
+    }
+    request_sent = False
+    finished = asyncio.Event()
+    result: Dict[str, Any] = {"status": None, "first_byte": None, "bytes": 0}
+
+    async def receive() -> Dict[str, Any]:
+        nonlocal request_sent
+        if not request_sent:
+            request_sent = True
+            return {"type": "http.request", "body": body, "more_body": False}
+        await finished.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message: Dict[str, Any]) -> None:
+        if message["type"] == "http.response.start":
+            result["status"] = message["status"]
+        elif message["type"] == "http.response.body":
+            chunk = message.get("body", b"")
+            if chunk and result["first_byte"] is None:
+                result["first_byte"] = time.perf_counter()
+            result["bytes"] += len(chunk)
+
+    try:
+        await main.app(scope, receive, send)
+    finally:
+        finished.set()
+    result["end"] = time.perf_counter()
+    return result
+
+async def timed_chat(message: str, session_id: str, scheduled: float) -> Dict[str, Any]:
+    """One /chat request; latencies are measured from `scheduled`"""
+    began = time.perf_counter()
+    try:
+        response = await asgi_post("/chat", {"message": message, "session_id": session_id})
+    except Exception as e:
+        return {"error": f"{type(e).__name__}: {e}"}
+    sample = {
+        "start_lag_ms": (began - scheduled) * 1000,
+        "ttft_ms": ((response["first_byte"] or response["end"]) - scheduled) * 1000,
+        "total_ms": (response["end"] - scheduled) * 1000,
+    }
+    if response["status"] == 429:
+        sample["rejected"] = True
+    elif response["status"] != 200 or not response["bytes"]:
+        sample["error"] = f"HTTP {response['status']}, {response['bytes']} bytes"
+    return sample
+
+async def open_loop(requests: List[Dict[str, str]], rate: float, seed: int) -> Dict[str, Any]:
+    """Send requests on a Poisson schedule at `rate`/s and summarize latencies"""
+    rng = random.Random(seed)
+    offsets, offset = [], 0.0
+    for _ in requests:
+        offset += rng.expovariate(rate)
+        offsets.append(offset)
+
+    metrics.reset()
+    started = time.perf_counter()
+
+    async def arrive(offset: float, request: Dict[str, str]) -> Dict[str, Any]:
+        scheduled = started + offset
+        await asyncio.sleep(max(scheduled - time.perf_counter(), 0))
+        return await timed_chat(request["message"], request["session_id"], scheduled)
+
+    samples = await asyncio.gather(*(arrive(o, r) for o, r in zip(offsets, requests)))
+    elapsed = time.perf_counter() - started
+
+    ok = [sample for sample in samples if "error" not in sample and "rejected" not in sample]
+    errors = [sample["error"] for sample in samples if "error" in sample]
+    for error in sorted(set(errors))[:5]:
+        print(f"  ✗ {error}")
+    return {
+        "requests": len(samples),
+        "errors": len(errors),
+        # Turned away with 429 by admission control
+        "rejected": sum(1 for sample in samples if "rejected" in sample),
+        "target_rate": rate,
+        "throughput_rps": round(len(ok) / elapsed, 2),
+        "ttft_ms": percentiles([sample["ttft_ms"] for sample in ok]),
+        "total_ms": percentiles([sample["total_ms"] for sample in ok]),
+        "start_lag_ms": percentiles([sample["start_lag_ms"] for sample in ok]),
+        "stages": metrics.latency_snapshot(),
+        "pool": db.get_pool_stats(),
+        "admission": main._admission.stats(),
+    }
+
+def first_turns(scenario: str, count: int, seed: int) -> List[Dict[str, str]]:
+    return [
+        {"message": question, "session_id": f"{SESSION_PREFIX}{scenario}-{i}"}
+        for i, question in enumerate(synthetic_questions(count, seed=seed))
+    ]
+
+# ---------------------------------------------------------------------------
+# Scenarios
+
+async def cold_start(args: argparse.Namespace, collection: str) -> Dict[str, Any]:
+    """Startup time and first-request latency, with and without the warm-up"""
+    configured = settings.WARMUP_ON_STARTUP
+    questions = synthetic_questions(args.cold_runs * 2, seed=args.seed + 1)
+    results = {}
+    try:
+        for warmup in (False, True):
+            settings.WARMUP_ON_STARTUP = warmup
+            startup, first_ttft, first_total, warm_ttft = [], [], [], []
+            for run in range(args.cold_runs):
+                startup.append(await start_app(collection))
+                session_id = f"{SESSION_PREFIX}cold-{int(warmup)}-{run}"
+                first = await timed_chat(questions[run * 2], session_id, time.perf_counter())
+                warm = await timed_chat(questions[run * 2 + 1], session_id + "-warm", time.perf_counter())
+                if "error" in first or "error" in warm:
+                    print(f"  ✗ {first.get('error') or warm.get('error')}")
+                    continue
+                first_ttft.append(first["ttft_ms"])
+                first_total.append(first["total_ms"])
+                warm_ttft.append(warm["ttft_ms"])
+            results["warmup" if warmup else "no_warmup"] = {
+                "runs": args.cold_runs,
+                "startup_ms": percentiles(startup),
+                "first_ttft_ms": percentiles(first_ttft),
+                "first_total_ms": percentiles(first_total),
+                "warm_ttft_ms": percentiles(warm_ttft),
+            }
+    finally:
+        settings.WARMUP_ON_STARTUP = configured
+    return results
+
+async def steady(args: argparse.Namespace, collection: str) -> Dict[str, Any]:
+    await start_app(collection)
+    count = max(int(args.rate * args.duration), 1)
+    return await open_loop(first_turns("steady", count, args.seed), args.rate, args.seed)
+
+async def long_history(args: argparse.Namespace, collection: str) -> Dict[str, Any]:
+    await start_app(collection)
+    session_ids = await seed_histories("history", args.history_sessions, args.history_messages, args.seed)
+    count = max(int(args.rate * args.duration), 1)
+    requests = [
+        {"message": FOLLOW_UPS[i % len(FOLLOW_UPS)], "session_id": session_ids[i % len(session_ids)]}
+        for i in range(count)
+    ]
+    result = await open_loop(requests, args.rate, args.seed)
+    result["history_messages"] = args.history_messages
+    return result
+
+async def large_corpus(args: argparse.Namespace, collection: str) -> Dict[str, Any]:
+    large = await asyncio.to_thread(seed_corpus, args.large_corpus, args.dims, args.seed)
+    await start_app(large)
+    count = max(int(args.rate * args.duration), 1)
+    result = await open_loop(first_turns("large", count, args.seed), args.rate, args.seed)
+    result["corpus_size"] = args.large_corpus
+    return result
+
+async def high_concurrency(args: argparse.Namespace, collection: str) -> Dict[str, Any]:
+    await start_app(collection)
+    count = max(int(args.concurrency_rate * args.duration), 1)
+    return await open_loop(
+        first_turns("concurrency", count, args.seed), args.concurrency_rate, args.seed
+    )
+
+SCENARIO_FUNCTIONS: Dict[str, Callable] = {
+    "cold_start": cold_start,
+    "steady": steady,
+    "long_history": long_history,
+    "large_corpus": large_corpus,
+    "high_concurrency": high_concurrency,
+}
+
+def report_line(name: str, result: Dict[str, Any]) -> str:
+    if "ttft_ms" not in result:
+        return f"✓ {name}: " + ", ".join(
+            f"{mode} startup p50 {values['startup_ms'].get('p50')}ms, "
+            f"first TTFT p50 {values['first_ttft_ms'].get('p50')}ms"
+            for mode, values in result.items()
+        )
+    return (
+        f"✓ {name}: {result['requests']} requests ({result['errors']} errors, "
+        f"{result['rejected']} rejected) at "
+        f"{result['throughput_rps']}/s, TTFT p50 {result['ttft_ms'].get('p50')}ms "
+        f"p95 {result['ttft_ms'].get('p95')}ms, total p95 {result['total_ms'].get('p95')}ms"
+    )
+
+# ---------------------------------------------------------------------------
+# Baseline comparison
+
+def latency_percentiles(result: Any, path: str = "") -> Dict[str, float]:
+    """Flatten the end-to-end latency percentiles of a scenario result"""
+    flat = {}
+    if not isinstance(result, dict):
+        return flat
+    for key, value in result.items():
+        if key in ("stages", "pool", "start_lag_ms") or not isinstance(value, dict):
+            continue
+        name = f"{path}.{key}" if path else key
+        if key.endswith("_ms"):
+            for p in ("p50", "p95", "p99"):
+                if p in value:
+                    flat[f"{name}.{p}"] = value[p]
+        else:
+            flat.update(latency_percentiles(value, name))
+    return flat
+
+def compare(current: Dict, baseline: Dict, tolerance: float, min_delta_ms: float) -> List[str]:
+    """Print percentile changes against the baseline; returns the regressions"""
+    regressions = []
+    print(f"\nComparison with baseline ({baseline['meta'].get('created', '?')}):")
+    for scenario, result in current["scenarios"].items():
+        previous = baseline.get("scenarios", {}).get(scenario)
+        if previous is None:
+            print(f"  {scenario}: not in baseline")
+            continue
+        before = latency_percentiles(previous)
+        for name, value in latency_percentiles(result).items():
+            if name not in before:
+                continue
+            old = before[name]
+            change = (value - old) / old if old else 0.0
+            regressed = value - old > min_delta_ms and change > tolerance
+            marker = "✗" if regressed else " "
+            print(f"  {marker} {scenario + '.' + name:<40} {old:>9.1f} → {value:>9.1f} ms ({change:+.1%})")
+            if regressed:
+                regressions.append(f"{scenario}.{name}")
+    return regressions
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+async def run(args: argparse.Namespace) -> Dict[str, Any]:
+    install_fakes(args)
+    collection = await asyncio.to_thread(seed_corpus, args.corpus, args.dims, args.seed)
+    results: Dict[str, Any] = {
+        "meta": {
+            "created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "args": {key: value for key, value in vars(args).items() if key not in ("output", "baseline")},
+            "settings": {name: getattr(settings, name) for name in RECORDED_SETTINGS},
+        },
+        "scenarios": {},
+    }
+    try:
+        for name in args.scenarios:
+            print(f"\n📊 {name}")
+            result = await SCENARIO_FUNCTIONS[name](args, collection)
+            results["scenarios"][name] = result
+            print(report_line(name, result))
+    finally:
+        if db._connection_pool is None:
+            await db.get_connection_pool()
+        # Write queued history first, or it would land after the cleanup
+        await rag_chain.get_history_writer().close()
+        await delete_bench_sessions()
+        await main.shutdown_event()
+    return results
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Offline /chat benchmark with fake Gemini and embeddings")
+    parser.add_argument("--scenarios", type=lambda value: value.split(","), default=list(SCENARIOS),
+                        help=f"Comma-separated subset of {','.join(SCENARIOS)}")
+    parser.add_argument("--rate", type=float, default=5.0, help="Arrivals per second (open loop)")
+    parser.add_argument("--duration", type=float, default=20.0, help="Seconds of arrivals per scenario")
+    parser.add_argument("--concurrency-rate", type=float, default=25.0, help="Arrival rate of high_concurrency")
+    parser.add_argument("--corpus", type=int, default=2000, help="Chunks in the base collection")
+    parser.add_argument("--large-corpus", type=int, default=20000, help="Chunks in the large_corpus collection")
+    parser.add_argument("--dims", type=int, default=768, help="Fake embedding dimensions")
+    parser.add_argument("--history-sessions", type=int, default=20)
+    parser.add_argument("--history-messages", type=int, default=200, help="Stored messages per long_history session")
+    parser.add_argument("--cold-runs", type=int, default=3)
+    parser.add_argument("--first-token-ms", type=float, default=300.0, help="Fake LLM delay before the first token")
+    parser.add_argument("--tokens-per-second", type=float, default=80.0, help="Fake LLM token rate")
+    parser.add_argument("--answer-tokens", type=int, default=120)
+    parser.add_argument("--embedding-ms", type=float, default=40.0, help="Fake embedding call latency")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="benchmark_results.json")
+    parser.add_argument("--baseline", help="Previous results to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.10, help="Allowed relative slowdown per percentile")
+    parser.add_argument("--min-delta-ms", type=float, default=5.0, help="Ignore changes smaller than this")
+    args = parser.parse_args(argv)
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+    return args
+
+if __name__ == "__main__":
+    args = parse_args()
+    results = asyncio.run(run(args))
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2, sort_keys=True, ensure_ascii=False)
+        f.write("\n")
+    print(f"\n✓ Results written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance, args.min_delta_ms)
+        if regressions:
+            print(f"\n✗ {len(regressions)} percentiles regressed more than {args.tolerance:.0%}")
+            sys.exit(1)
+        print("\n✓ No regressions")
@@ -0,0 +1,261 @@
+#!/usr/bin/env python3
+"""
+Cold-start benchmark: how long a new server process takes to serve.
+
+- import: ``import main`` in a fresh interpreter, and which heavy modules
+  (LangChain's runnable stack, provider SDKs, SQLAlchemy) it loads. These
+  should load on first use or in preload(), not with the app.
+- lazy / preload: a worker forked the way gunicorn forks one, timed from
+  the fork until its startup event (pool, warm-up) has finished, then one
+  /chat request and a second, warm one. In lazy mode the worker imports the
+  app after the fork (uvicorn, or gunicorn without preload_app); in preload
+  mode the parent imported it and ran rag_chain.preload() first, as
+  gunicorn.conf.py does. Also reports the worker's private memory, which
+  preloading moves into pages shared with the parent.
+
+Every run is a fresh interpreter. As in benchmark_offline.py, fakes.py
+stands in for Gemini against a synthetic ``bench_*`` collection; the fake
+getters still import langchain_google_genai where the real ones would, so
+its cost is counted.
+
+    python benchmark_startup.py --runs 5 --output startup.json
+"""
+
+import argparse
+import asyncio
+import gc
+import importlib
+import json
+import os
+import subprocess
+import sys
+import time
+from typing import Any, Dict, List
+
+# Modules `import main` should leave to first use (or to preload())
+HEAVY_MODULES = (
+    "langchain_core.runnables.base",
+    "langsmith.run_trees",
+    "langchain_google_genai",
+    "langchain_postgres",
+    "sqlalchemy",
+)
+WORKER_MODES = ("lazy", "preload")
+# Marks the child's result line among the app's own output
+RESULT_PREFIX = "startup-result: "
+WORKER_METRICS = (
+    "import_ms", "startup_ms", "ready_ms", "first_ttft_ms", "first_total_ms",
+    "warm_ttft_ms", "rss_mb", "private_mb",
+)
+
+def memory_mb() -> Dict[str, float]:
+    """Resident and private (not shared with other processes) memory; Linux only"""
+    fields = {}
+    try:
+        with open("/proc/self/smaps_rollup") as f:
+            for line in f:
+                name, _, value = line.partition(":")
+                if value.strip().endswith("kB"):
+                    fields[name] = int(value.split()[0]) / 1024
+    except OSError:
+        return {}
+    return {
+        "rss_mb": round(fields.get("Rss", 0.0), 1),
+        "private_mb": round(fields.get("Private_Clean", 0.0) + fields.get("Private_Dirty", 0.0), 1),
+    }
+
+# ---------------------------------------------------------------------------
+# Child processes
+
+def measure_import() -> Dict[str, Any]:
+    started = time.perf_counter()
+    import main  # noqa: F401
+    return {
+        "import_ms": (time.perf_counter() - started) * 1000,
+        "heavy_modules": [name for name in HEAVY_MODULES if name in sys.modules],
+    }
+
+def load_app(args: argparse.Namespace) -> None:
+    """Import the app and point it at the fakes and the benchmark collection"""
+    import benchmark_offline
+    import rag_chain
+
+    benchmark_offline.install_fakes(benchmark_offline.parse_args(["--dims", str(args.dims)]))
+    fake_llm, fake_embeddings = rag_chain.get_llm, rag_chain.get_embeddings
+
+    # Same imports as the real getters, so the provider SDK's cost is paid where it would be
+    def get_llm():
+        importlib.import_module("langchain_google_genai")
+        return fake_llm()
+
+    def get_embeddings():
+        importlib.import_module("langchain_google_genai")
+        return fake_embeddings()
+
+    rag_chain.get_llm = rag_chain.get_summary_llm = get_llm
+    rag_chain.get_embeddings = get_embeddings
+
+async def serve(args: argparse.Namespace, forked: float, imported: float) -> Dict[str, Any]:
+    """Startup event, then a first and a warm /chat request"""
+    import benchmark_offline
+    import main
+    import rag_chain
+    from fakes import synthetic_questions
+    from vector_search import AsyncVectorSearch
+
+    rag_chain._async_vector_search = AsyncVectorSearch(rag_chain.get_embeddings(), collection_name=args.collection)
+    await main.startup_event()
+    ready = time.perf_counter()
+    first_question, warm_question = synthetic_questions(2, seed=os.getpid())
+    session_id = f"{benchmark_offline.SESSION_PREFIX}startup-{args.child}-{os.getpid()}"
+    first = await benchmark_offline.timed_chat(first_question, session_id, time.perf_counter())
+    warm = await benchmark_offline.timed_chat(warm_question, session_id + "-warm", time.perf_counter())
+    result = {
+        "import_ms": (imported - forked) * 1000,
+        "startup_ms": (ready - imported) * 1000,
+        "ready_ms": (ready - forked) * 1000,
+        **memory_mb(),
+    }
+    if "error" in first or "error" in warm:
+        result["error"] = first.get("error") or warm.get("error")
+    else:
+        result.update(first_ttft_ms=first["ttft_ms"], first_total_ms=first["total_ms"], warm_ttft_ms=warm["ttft_ms"])
+    await main.shutdown_event()
+    return result
+
+def run_worker(args: argparse.Namespace) -> Dict[str, Any]:
+    """Fork a worker (after preloading, in preload mode) and return its timings"""
+    preload_timings = None
+    if args.child == "preload":
+        import rag_chain
+        load_app(args)
+        preload_timings = rag_chain.preload()
+        gc.freeze()
+
+    read_fd, write_fd = os.pipe()
+    forked = time.perf_counter()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read_fd)
+        try:
+            if args.child == "lazy":
+                load_app(args)
+            result = asyncio.run(serve(args, forked, time.perf_counter()))
+        except Exception as e:
+            result = {"error": f"{type(e).__name__}: {e}"}
+        with os.fdopen(write_fd, "w") as f:
+            json.dump(result, f)
+        os._exit(0)
+
+    os.close(write_fd)
+    with os.fdopen(read_fd) as f:
+        output = f.read()
+    os.waitpid(pid, 0)
+    result = json.loads(output) if output else {"error": "worker exited without a result"}
+    if preload_timings is not None:
+        result["preload"] = preload_timings
+    return result
+
+# ---------------------------------------------------------------------------
+# Parent
+
+def spawn(args: argparse.Namespace, child: str, collection: str = "") -> Dict[str, Any]:
+    """Run this script as a fresh interpreter in `child` mode"""
+    command = [sys.executable, __file__, "--child", child, "--collection", collection, "--dims", str(args.dims)]
+    completed = subprocess.run(command, capture_output=True, text=True)
+    for line in reversed(completed.stdout.splitlines()):
+        if line.startswith(RESULT_PREFIX):
+            return json.loads(line[len(RESULT_PREFIX):])
+    output = (completed.stdout + completed.stderr).strip().splitlines()
+    return {"error": f"exit status {completed.returncode}: {' | '.join(output[-3:])}"}
+
+def summarize(samples: List[Dict[str, Any]]) -> Dict[str, Any]:
+    from benchmark_offline import percentiles
+
+    errors = [sample["error"] for sample in samples if "error" in sample]
+    ok = [sample for sample in samples if "error" not in sample]
+    summary: Dict[str, Any] = {"runs": len(samples), "errors": len(errors)}
+    for name in WORKER_METRICS:
+        values = [sample[name] for sample in ok if name in sample]
+        if values:
+            summary[name] = percentiles(values)
+    preloads = [sample["preload"]["total_ms"] for sample in ok if "preload" in sample]
+    if preloads:
+        summary["preload_ms"] = percentiles(preloads)
+    for error in sorted(set(errors)):
+        print(f"  ✗ {error}")
+    return summary
+
+def report_line(name: str, summary: Dict[str, Any]) -> str:
+    def p50(metric: str) -> str:
+        value = summary.get(metric, {}).get("p50")
+        return "-" if value is None else f"{value:.0f}"
+    if name == "import":
+        return f"  import main p50 {p50('import_ms')}ms, heavy modules loaded: {summary['heavy_modules'] or 'none'}"
+    return (
+        f"  {name}: ready p50 {p50('ready_ms')}ms after fork (import {p50('import_ms')}ms, "
+        f"startup {p50('startup_ms')}ms), first TTFT p50 {p50('first_ttft_ms')}ms, "
+        f"warm TTFT p50 {p50('warm_ttft_ms')}ms, private {p50('private_mb')}MB"
+    )
+
+def run(args: argparse.Namespace) -> Dict[str, Any]:
+    import benchmark_offline
+    import db
+    from config import get_settings
+
+    settings = get_settings()
+    results: Dict[str, Any] = {
+        "meta": {
+            "commit": benchmark_offline.git_commit(),
+            "python": sys.version.split()[0],
+            "args": {key: value for key, value in vars(args).items() if key not in ("output", "child", "collection")},
+            "settings": {"WARMUP_ON_STARTUP": settings.WARMUP_ON_STARTUP, "DB_POOL_SIZE": settings.DB_POOL_SIZE},
+        },
+    }
+
+    print(f"\n📊 import ({args.runs} runs)")
+    samples = [spawn(args, "import") for _ in range(args.runs)]
+    summary = summarize(samples)
+    summary["heavy_modules"] = sorted({name for sample in samples for name in sample.get("heavy_modules", [])})
+    results["import"] = summary
+    print(report_line("import", summary))
+
+    collection = benchmark_offline.seed_corpus(args.corpus, args.dims, args.seed)
+    for mode in WORKER_MODES:
+        print(f"\n📊 {mode} worker ({args.runs} runs)")
+        results[mode] = summarize([spawn(args, mode, collection) for _ in range(args.runs)])
+        print(report_line(mode, results[mode]))
+
+    async def cleanup():
+        await benchmark_offline.delete_bench_sessions()
+        await db.close_connection_pool()
+    asyncio.run(cleanup())
+    return results
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Cold-start time of the app and of lazy vs preloaded workers")
+    parser.add_argument("--runs", type=int, default=5, help="Fresh processes per measurement")
+    parser.add_argument("--corpus", type=int, default=2000, help="Chunks in the benchmark collection")
+    parser.add_argument("--dims", type=int, default=768, help="Fake embedding dimensions")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write the results as JSON")
+    # Internal: what a child process measures
+    parser.add_argument("--child", choices=("import",) + WORKER_MODES, help=argparse.SUPPRESS)
+    parser.add_argument("--collection", default="", help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.child == "import":
+        print(RESULT_PREFIX + json.dumps(measure_import()))
+        sys.exit(0)
+    if args.child is not None:
+        print(RESULT_PREFIX + json.dumps(run_worker(args)))
+        sys.exit(0)
+
+    results = run(args)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+            f.write("\n")
+        print(f"\n✓ Results written to {args.output}")
@@ -0,0 +1,131 @@
+"""
+Bulk loader for the PGVector collection: binary COPY into a staging table.
+
+Chunks (id, text, JSONB metadata, embedding) are streamed with psycopg's
+binary ``COPY`` into an unlogged, unindexed staging table, batch by batch,
+so nothing but the current batch is held in memory. The staged rows then
+reach langchain_pg_embedding in one transaction:
+
+- ``swap`` (full rebuild): the collection is recreated under a new uuid
+  holding exactly the staged rows. Readers keep seeing the old rows until
+  the commit and the new ones right after, so /chat never sees an empty or
+  half-written collection. The new uuid matches no partial ANN index, so
+  rows are not inserted into an HNSW graph one by one; the caller builds the
+  index afterwards (vector_index.ensure_index) and searches use exact scans
+  until it is ready.
+- ``merge`` (append): staged rows are upserted into the existing
+  collection, optionally deleting stale ids in the same transaction.
+"""
+
+import uuid
+from typing import Any, Dict, Optional, Sequence
+import numpy as np
+import psycopg
+from psycopg import sql
+from psycopg.types.json import Json, Jsonb
+from pgvector.psycopg import register_vector
+
+class BulkLoader:
+    """Stage chunks with binary COPY, then swap or merge them into a collection"""
+
+    def __init__(self, conn: psycopg.Connection, collection_name: str):
+        self.conn = conn
+        self.collection_name = collection_name
+        self.staging_table = f"{collection_name}_staging_{uuid.uuid4().hex[:8]}"
+        self.staged = 0
+        register_vector(conn)
+
+    def __enter__(self) -> "BulkLoader":
+        self.conn.execute(
+            sql.SQL(
+                "CREATE UNLOGGED TABLE {table} ("
+                "id VARCHAR NOT NULL, document VARCHAR, cmetadata JSONB, embedding vector)"
+            ).format(table=sql.Identifier(self.staging_table))
+        )
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.conn.execute(
+            sql.SQL("DROP TABLE IF EXISTS {table}").format(table=sql.Identifier(self.staging_table))
+        )
+
+    def copy(
+        self,
+        ids: Sequence[str],
+        texts: Sequence[str],
+        metadatas: Sequence[Dict[str, Any]],
+        embeddings: Sequence[Sequence[float]],
+    ) -> int:
+        """Append rows to the staging table; returns how many were written"""
+        statement = sql.SQL(
+            "COPY {table} (id, document, cmetadata, embedding) FROM STDIN (FORMAT BINARY)"
+        ).format(table=sql.Identifier(self.staging_table))
+        with self.conn.cursor() as cursor:
+            with cursor.copy(statement) as copy:
+                copy.set_types(["varchar", "varchar", "jsonb", "vector"])
+                for row in zip(ids, texts, metadatas, embeddings):
+                    copy.write_row((row[0], row[1], Jsonb(row[2]), np.asarray(row[3], dtype=np.float32)))
+        self.staged += len(ids)
+        return len(ids)
+
+    def _collection_uuid(self) -> Optional[uuid.UUID]:
+        row = self.conn.execute(
+            "SELECT uuid FROM langchain_pg_collection WHERE name = %s FOR UPDATE",
+            (self.collection_name,),
+        ).fetchone()
+        return row[0] if row else None
+
+    def _insert_staged(self, collection_uuid: uuid.UUID, upsert: bool) -> int:
+        statement = sql.SQL(
+            "INSERT INTO langchain_pg_embedding (id, collection_id, embedding, document, cmetadata) "
+            "SELECT id, %s, embedding, document, cmetadata FROM {table}"
+        ).format(table=sql.Identifier(self.staging_table))
+        if upsert:
+            statement += sql.SQL(
+                " ON CONFLICT (id) DO UPDATE SET collection_id = EXCLUDED.collection_id, "
+                "embedding = EXCLUDED.embedding, document = EXCLUDED.document, "
+                "cmetadata = EXCLUDED.cmetadata"
+            )
+        cursor = self.conn.execute(statement, (collection_uuid,))
+        self.conn.execute(
+            sql.SQL("TRUNCATE {table}").format(table=sql.Identifier(self.staging_table))
+        )
+        self.staged = 0
+        return cursor.rowcount
+
+    def swap(self) -> int:
+        """Replace the collection with the staged rows in one transaction"""
+        with self.conn.transaction():
+            old_uuid = self._collection_uuid()
+            metadata = None
+            if old_uuid is not None:
+                metadata = self.conn.execute(
+                    "SELECT cmetadata FROM langchain_pg_collection WHERE uuid = %s", (old_uuid,)
+                ).fetchone()[0]
+                # Cascades to the old rows; concurrent readers still see them until commit
+                self.conn.execute("DELETE FROM langchain_pg_collection WHERE uuid = %s", (old_uuid,))
+            new_uuid = uuid.uuid4()
+            self.conn.execute(
+                "INSERT INTO langchain_pg_collection (uuid, name, cmetadata) VALUES (%s, %s, %s)",
+                (new_uuid, self.collection_name, Json(metadata) if metadata is not None else None),
+            )
+            return self._insert_staged(new_uuid, upsert=False)
+
+    def merge(self, delete_ids: Sequence[str] = ()) -> int:
+        """Upsert the staged rows and delete `delete_ids` in one transaction"""
+        with self.conn.transaction():
+            collection_uuid = self._collection_uuid()
+            if collection_uuid is None:
+                collection_uuid = uuid.uuid4()
+                self.conn.execute(
+                    "INSERT INTO langchain_pg_collection (uuid, name) VALUES (%s, %s)",
+                    (collection_uuid, self.collection_name),
+                )
+            if delete_ids:
+                self.conn.execute(
+                    "DELETE FROM langchain_pg_embedding WHERE collection_id = %s AND id = ANY(%s)",
+                    (collection_uuid, list(delete_ids)),
+                )
+            if not self.staged:
+                return 0
+            return self._insert_staged(collection_uuid, upsert=True)
@@ -12,9 +12,76 @@ class Settings(BaseSettings):
     
     # Performance settings
     DB_POOL_SIZE: int = 10
-    DB_MAX_OVERFLOW: int = 20
+    DB_MAX_OVERFLOW: int = 20  # Extra connections opened under load; pool max = DB_POOL_SIZE + this
+    DB_ACQUIRE_TIMEOUT: float = 5.0  # Seconds to wait for a pooled connection
+    DB_MAX_WAITING: int = 0  # Max clients queued for a connection (0 = unbounded)
+    STREAM_COALESCE_CHARS: int = 64  # SSE/NDJSON: characters batched per token event
+    STREAM_COALESCE_MS: int = 50  # SSE/NDJSON: max delay before a partial batch is sent
+    CHAT_MAX_CONCURRENT: int = 16  # Answers generated at once (0 = no admission control)
+    CHAT_MAX_QUEUE: int = 64  # Requests waiting for a slot before /chat answers 429
+    CHAT_SHED_CONTEXTUALIZE_QUEUE: int = 16  # Skip follow-up rewrites while this many requests wait (0 = never)
+    WARMUP_ON_STARTUP: bool = True  # Open the pool, build the chain, run one embedding + vector query
     VECTOR_SEARCH_K: int = 20  # Total documents to retrieve from vector store
     RETRIEVAL_TOP_K: int = 10  # Final number of docs to use (thesis prioritized)
+    RETRIEVAL_MODE: str = "quota"  # "quota" (per-source searches in SQL) or "overfetch" (VECTOR_SEARCH_K, split in Python)
+    THESIS_QUOTA: float = 0.7  # Share of RETRIEVAL_TOP_K reserved for thesis chunks
+    HYBRID_SEARCH: bool = True  # Fuse full-text (document_tsv) and vector results
+    RRF_K: int = 60  # Reciprocal-rank fusion constant, higher flattens rank differences
+    
+    # Reranking and context packing (see reranker.py)
+    RERANKER: str = "lexical"  # "none", "lexical" (BM25) or "cross-encoder" (needs sentence-transformers)
+    RERANKER_MODEL: str = "cross-encoder/mmarco-mMiniLMv2-L12-H384-v1"  # Multilingual, runs on CPU
+    CONTEXT_TOKEN_BUDGET: int = 2000  # Estimated prompt tokens for retrieved context (0 = no limit)
+    RERANK_DUPLICATE_THRESHOLD: float = 0.8  # Shingle Jaccard above which a chunk is a duplicate
+    HISTORY_WINDOW: int = 10  # Messages loaded per turn (0 = whole session)
+    HISTORY_SUMMARY: bool = False  # Summarize turns older than the window with the LLM
+    HISTORY_PAGE_SIZE: int = 50  # Default page size for /chat/history
+    HISTORY_WRITE_BEHIND: bool = True  # Queue history writes and insert them in batches (history_writer.py)
+    HISTORY_FLUSH_ROWS: int = 256  # Write-behind: rows per batch, a full batch is written at once
+    HISTORY_FLUSH_MS: int = 200  # Write-behind: max time a message waits before it's written
+    CONTEXTUALIZE_MODE: str = "speculative"  # "always" (LLM rewrite), "heuristic" (skip self-contained questions) or "speculative" (+ retrieve on the raw question during the rewrite)
+    REWRITE_CACHE_SIZE: int = 1024  # Cached question rewrites, keyed by recent history + question
+    
+    # Retrieval backend
+    VECTOR_BACKEND: str = "pgvector"  # "pgvector" or "local" (memory-mapped .npy exported by ingest.py, see local_index.py)
+    LOCAL_INDEX_DIR: str = "data/vector_index"  # Where the local backend's files live
+    
+    # ANN index on the embedding table (see vector_index.py)
+    VECTOR_INDEX_TYPE: str = "none"  # "none" (exact scan), "hnsw" or "ivfflat"
+    VECTOR_INDEX_ON_STARTUP: bool = False  # Build the index in the background at startup if missing
+    HNSW_M: int = 16
+    HNSW_EF_CONSTRUCTION: int = 64
+    HNSW_EF_SEARCH: int = 80  # Per-query candidate list, keep >= VECTOR_SEARCH_K
+    HNSW_ITERATIVE_SCAN: str = ""  # "relaxed_order" for filtered searches (pgvector >= 0.8)
+    IVFFLAT_LISTS: int = 0  # 0 = rows / 1000 (sqrt(rows) above 1M rows)
+    IVFFLAT_PROBES: int = 10
+    VECTOR_QUANTIZATION: str = "none"  # Index layout: "none", "halfvec", "binary" (pgvector >= 0.7) or "truncate"
+    VECTOR_TRUNCATE_DIMS: int = 256  # Leading dimensions indexed with VECTOR_QUANTIZATION=truncate
+    VECTOR_RESCORE_CANDIDATES: int = 200  # Compact-index candidates rescored on the full vectors
+    
+    # Ingestion pipeline
+    INGEST_WORKERS: int = 0  # Processes parsing/splitting PDFs (0 = one per CPU, 1 = in-process)
+    INGEST_BATCH_SIZE: int = 128  # Chunks embedded and written per batch
+    INGEST_LOADER: str = "copy"  # "copy" (binary COPY via a staging table, zero-downtime full rebuilds) or "pgvector" (PGVector.add_embeddings)
+    EMBED_BATCH_SIZE: int = 32  # Texts per embedding request
+    EMBED_CONCURRENCY: int = 4  # Embedding requests in flight
+    EMBED_REQUESTS_PER_MINUTE: float = 0  # Token-bucket request rate (0 = unlimited)
+    EMBED_MAX_RETRIES: int = 6  # Retries on 429/5xx with exponential backoff
+    
+    # Embedding cache: in-memory LRU plus optional persistent tier
+    EMBEDDING_CACHE_SIZE: int = 4096  # Entries kept in memory (0 = no LRU)
+    EMBEDDING_CACHE_BACKEND: str = "none"  # "none", "sqlite" or "postgres"
+    EMBEDDING_CACHE_PATH: str = "data/embedding_cache.sqlite3"  # Used by the sqlite backend
+    
+    # Semantic answer cache (first-turn questions only)
+    SEMANTIC_CACHE_ENABLED: bool = True
+    SEMANTIC_CACHE_THRESHOLD: float = 0.95  # Min cosine similarity for a hit
+    SEMANTIC_CACHE_TTL_SECONDS: int = 86400
+    SEMANTIC_CACHE_MAX_ENTRIES: int = 1000  # Least recently hit entries evicted first
+    SEMANTIC_CACHE_CHUNK_SIZE: int = 40  # Characters per streamed chunk on a hit
+    
+    # Identical first-turn questions in flight share one generation (single_flight.py)
+    SINGLE_FLIGHT_ENABLED: bool = True
     
     @property
     def DATABASE_URL(self) -> str:
@@ -31,6 +98,11 @@ class Settings(BaseSettings):
             return ["*"]
         return [origin.strip() for origin in self.CORS_ORIGINS.split(",")]
 
+    @property
+    def db_pool_max_size(self) -> int:
+        """Most connections the pool opens: DB_POOL_SIZE plus DB_MAX_OVERFLOW"""
+        return self.DB_POOL_SIZE + self.DB_MAX_OVERFLOW
+
     class Config:
         env_file = ".env"
 
@@ -0,0 +1,114 @@
+"""
+Fast path for the question-contextualization step.
+
+Follow-up turns normally wait for an LLM call that rewrites the question
+into a standalone one before retrieval starts. This module avoids that
+round-trip where it can:
+
+- a heuristic classifier skips the rewrite for questions that are already
+  self-contained (no pronouns or follow-up phrasing referring back)
+- rewrites are cached by the recent history plus the question
+- the caller can retrieve speculatively on the raw question while the
+  rewrite runs, keeping that result when the rewrite doesn't change it
+"""
+
+import hashlib
+import re
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional, Sequence
+from langchain_core.messages import BaseMessage
+from embedding_cache import normalize_text
+
+# Words that refer back to earlier turns (English and Portuguese)
+REFERENCE_WORDS = {
+    "it", "its", "this", "that", "these", "those", "they", "them", "their",
+    "he", "she", "him", "her", "his", "there", "above", "previous", "former",
+    "latter", "same", "again", "also", "else", "more", "further",
+    "isso", "isto", "aquilo", "disso", "disto", "nisso", "nisto", "daquilo",
+    "esse", "essa", "esses", "essas", "este", "esta", "estes", "estas",
+    "desse", "dessa", "deste", "desta", "nesse", "nessa", "neste", "nesta",
+    "ele", "ela", "eles", "elas", "dele", "dela", "deles", "delas",
+    "anterior", "mesmo", "mesma", "acima", "também", "tambem", "mais", "ainda",
+}
+
+# Openings of elliptical follow-ups ("and VQE?", "e quanto ao QAOA?")
+CONTINUATION_STARTS = (
+    "and", "but", "so", "or", "what about", "how about",
+    "e", "mas", "então", "entao", "ou", "e quanto",
+)
+
+# Questions shorter than this rarely stand on their own
+MIN_SELF_CONTAINED_WORDS = 3
+
+def needs_rewrite(question: str) -> bool:
+    """True when the question may depend on the conversation (cheap, no LLM)"""
+    words = re.findall(r"\w+", question.lower())
+    if len(words) < MIN_SELF_CONTAINED_WORDS:
+        return True
+    if any(word in REFERENCE_WORDS for word in words):
+        return True
+    opening = " ".join(words[:2])
+    return any(opening == start or opening.startswith(start + " ") for start in CONTINUATION_STARTS)
+
+def canonical_question(text: str) -> str:
+    """The question's words, ignoring case, spacing and punctuation"""
+    return " ".join(re.findall(r"\w+", normalize_text(text).lower()))
+
+def same_question(question: str, rewritten: str) -> bool:
+    """Whether a rewrite kept the question (ignoring case, spacing and punctuation)"""
+    return canonical_question(question) == canonical_question(rewritten)
+
+class Contextualizer:
+    """Decides when the rewrite can be skipped and caches rewrites"""
+
+    def __init__(self, cache_size: int = 1024, heuristic: bool = True):
+        self.cache_size = cache_size
+        self.heuristic = heuristic
+        self._cache: "OrderedDict[bytes, str]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.skipped = 0
+        self.cache_hits = 0
+        self.rewrites = 0
+        self.speculative_kept = 0
+        self.speculative_discarded = 0
+
+    @staticmethod
+    def _key(question: str, history: Sequence[BaseMessage]) -> bytes:
+        parts = [f"{message.type}:{normalize_text(str(message.content))}" for message in history]
+        parts.append(normalize_text(question))
+        return hashlib.sha256("\0".join(parts).encode("utf-8")).digest()
+
+    def resolve(self, question: str, history: Sequence[BaseMessage]) -> Optional[str]:
+        """The standalone question if known without the LLM, otherwise None"""
+        if self.heuristic and not needs_rewrite(question):
+            self.skipped += 1
+            return question
+        key = self._key(question, history)
+        with self._lock:
+            rewritten = self._cache.get(key)
+            if rewritten is not None:
+                self._cache.move_to_end(key)
+                self.cache_hits += 1
+        return rewritten
+
+    def remember(self, question: str, history: Sequence[BaseMessage], rewritten: str) -> None:
+        self.rewrites += 1
+        if self.cache_size <= 0:
+            return
+        with self._lock:
+            key = self._key(question, history)
+            self._cache[key] = rewritten
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "skipped": self.skipped,
+            "cache_hits": self.cache_hits,
+            "rewrites": self.rewrites,
+            "speculative_kept": self.speculative_kept,
+            "speculative_discarded": self.speculative_discarded,
+            "cache_size": len(self._cache),
+        }
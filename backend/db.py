@@ -0,0 +1,81 @@
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, Sequence
+from psycopg import AsyncConnection, Connection, connect
+from psycopg_pool import AsyncConnectionPool
+from config import get_settings
+
+settings = get_settings()
+
+# Connection pool for database (reuse connections)
+_connection_pool = None
+
+async def get_connection_pool() -> AsyncConnectionPool:
+    """Get or create connection pool"""
+    global _connection_pool
+    if _connection_pool is None:
+        _connection_pool = AsyncConnectionPool(
+            conninfo=settings.ASYNC_DATABASE_URL,
+            min_size=2,
+            max_size=settings.db_pool_max_size,
+            timeout=settings.DB_ACQUIRE_TIMEOUT,
+            max_waiting=settings.DB_MAX_WAITING,
+            open=False
+        )
+        await _connection_pool.open()
+        # Wait for pool to be ready
+        await _connection_pool.wait()
+    return _connection_pool
+
+async def close_connection_pool():
+    """Close the connection pool if it was opened"""
+    global _connection_pool
+    if _connection_pool is not None:
+        await _connection_pool.close()
+        _connection_pool = None
+
+def connect_sync() -> Connection:
+    """
+    Short-lived sync connection outside the pool, for sync callers (the pool
+    is async and bound to the server's event loop). Use as a context manager.
+    """
+    return connect(settings.ASYNC_DATABASE_URL, autocommit=True)
+
+@asynccontextmanager
+async def lease_connection(timeout: float | None = None) -> AsyncIterator[AsyncConnection]:
+    """
+    Borrow a pooled connection for a single operation.
+
+    The connection goes back to the pool when the block exits (committed on
+    success, rolled back on error). Raises psycopg_pool.PoolTimeout if none
+    is free within ``timeout`` (default DB_ACQUIRE_TIMEOUT) seconds.
+    """
+    pool = await get_connection_pool()
+    async with pool.connection(timeout=timeout) as conn:
+        yield conn
+
+def get_pool_stats() -> Dict[str, Any]:
+    """Snapshot of pool usage: connections in use, waiting clients, wait time"""
+    if _connection_pool is None:
+        return {"open": False}
+    stats = _connection_pool.get_stats()
+    size = stats.get("pool_size", 0)
+    available = stats.get("pool_available", 0)
+    requests = stats.get("requests_num", 0)
+    wait_ms = stats.get("requests_wait_ms", 0)
+    return {
+        "open": True,
+        "max_size": stats.get("pool_max", settings.db_pool_max_size),
+        "size": size,
+        "in_use": size - available,
+        "available": available,
+        "waiting": stats.get("requests_waiting", 0),
+        "requests": requests,
+        "requests_queued": stats.get("requests_queued", 0),
+        "wait_ms_total": wait_ms,
+        "wait_ms_avg": round(wait_ms / requests, 2) if requests else 0.0,
+        "acquire_timeouts": stats.get("requests_errors", 0),
+    }
+
+def to_vector_literal(embedding: Sequence[float]) -> str:
+    """Render an embedding as a pgvector text literal ('[x,y,...]')"""
+    return "[" + ",".join(repr(float(x)) for x in embedding) + "]"
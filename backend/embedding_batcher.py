@@ -0,0 +1,117 @@
+"""
+Batched, concurrent embedding client for ingestion.
+
+Texts are split into fixed-size batches that are embedded by up to
+``concurrency`` requests at once. A token bucket keeps the request rate
+under the quota and rate-limit / transient errors are retried with
+exponential backoff and jitter. The concurrency limit is shared by every
+``aembed`` call on the loop, so a caller can embed several batches of texts
+at once (ingest.py overlaps consecutive flushes) without exceeding it. The
+embed function is injected, so the batcher can be driven by a local fake
+instead of the Gemini API.
+"""
+
+import asyncio
+import random
+import time
+from typing import Awaitable, Callable, List, Optional
+
+EmbedFn = Callable[[List[str]], Awaitable[List[List[float]]]]
+
+RETRYABLE_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+RETRYABLE_MARKERS = ("429", "RESOURCE_EXHAUSTED", "rate limit", "quota", "UNAVAILABLE", "503", "timed out")
+
+def is_retryable(error: Exception) -> bool:
+    """Rate-limit and transient server errors are retried, everything else fails fast"""
+    for attribute in ("status_code", "code", "status"):
+        value = getattr(error, attribute, None)
+        if isinstance(value, int) and value in RETRYABLE_STATUS_CODES:
+            return True
+    if isinstance(error, (asyncio.TimeoutError, ConnectionError)):
+        return True
+    message = str(error).lower()
+    return any(marker.lower() in message for marker in RETRYABLE_MARKERS)
+
+class TokenBucket:
+    """Allow `rate` acquisitions per second with bursts of up to `capacity`"""
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(rate, 1.0)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    async def acquire(self, amount: float = 1.0) -> None:
+        while True:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= amount:
+                self.tokens -= amount
+                return
+            await asyncio.sleep((amount - self.tokens) / self.rate)
+
+class EmbeddingBatcher:
+    """Embed many texts in concurrent, rate-limited, retried batches"""
+
+    def __init__(
+        self,
+        embed_fn: EmbedFn,
+        batch_size: int = 32,
+        concurrency: int = 4,
+        requests_per_minute: float = 0,
+        max_retries: int = 6,
+        backoff_base: float = 1.0,
+        backoff_max: float = 60.0,
+    ):
+        self.embed_fn = embed_fn
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.bucket = TokenBucket(requests_per_minute / 60.0) if requests_per_minute > 0 else None
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.requests = 0
+        self.retries = 0
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._semaphore_loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def _limit(self) -> asyncio.Semaphore:
+        """The running loop's request limit, shared by concurrent aembed calls"""
+        loop = asyncio.get_running_loop()
+        if self._semaphore_loop is not loop:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+            self._semaphore_loop = loop
+        return self._semaphore
+
+    async def _embed_batch(self, texts: List[str], semaphore: asyncio.Semaphore) -> List[List[float]]:
+        async with semaphore:
+            for attempt in range(self.max_retries + 1):
+                if self.bucket is not None:
+                    await self.bucket.acquire()
+                self.requests += 1
+                try:
+                    vectors = await self.embed_fn(texts)
+                    if len(vectors) != len(texts):
+                        raise ValueError(f"Expected {len(texts)} embeddings, got {len(vectors)}")
+                    return vectors
+                except Exception as e:
+                    if attempt == self.max_retries or not is_retryable(e):
+                        raise
+                    self.retries += 1
+                    # Full jitter keeps concurrent workers from retrying in lockstep
+                    delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+                    print(f"  ↻ Embedding batch failed ({e}), retrying in {delay:.1f}s")
+                    await asyncio.sleep(delay)
+        raise RuntimeError("unreachable")
+
+    async def aembed(self, texts: List[str]) -> List[List[float]]:
+        """Embed texts, preserving order"""
+        semaphore = self._limit()
+        batches = [texts[i:i + self.batch_size] for i in range(0, len(texts), self.batch_size)]
+        results = await asyncio.gather(*(self._embed_batch(batch, semaphore) for batch in batches))
+        return [vector for batch_vectors in results for vector in batch_vectors]
+
+    def embed(self, texts: List[str]) -> List[List[float]]:
+        """Sync entry point for one-off scripts (a new event loop per call)"""
+        return asyncio.run(self.aembed(texts))
@@ -0,0 +1,240 @@
+"""
+Caching wrapper for embedding models.
+
+Embeddings are looked up in an in-memory LRU first, then in an optional
+persistent tier (SQLite file or Postgres table), and only the misses are
+sent to the remote model. Vectors are kept as packed float32 (4 bytes per
+dimension) in both tiers.
+
+Query and document embeddings are cached separately because Gemini embeds
+them with different task types.
+"""
+
+import asyncio
+import hashlib
+import sqlite3
+import threading
+import unicodedata
+from array import array
+from collections import OrderedDict
+from typing import Dict, List, Optional, Sequence
+import psycopg
+from langchain_core.embeddings import Embeddings
+from config import get_settings
+
+settings = get_settings()
+
+def normalize_text(text: str) -> str:
+    """NFC-normalize and collapse whitespace so trivially different inputs share a key"""
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+def pack_vector(vector: Sequence[float]) -> bytes:
+    return array("f", vector).tobytes()
+
+def unpack_vector(data: bytes) -> List[float]:
+    vector = array("f")
+    vector.frombytes(data)
+    return vector.tolist()
+
+class SQLiteEmbeddingStore:
+    """Persistent key -> float32 blob store in a local SQLite file"""
+
+    def __init__(self, path: str):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embedding_cache ("
+            "key BLOB PRIMARY KEY, embedding BLOB NOT NULL)"
+        )
+        self._conn.commit()
+
+    def mget(self, keys: Sequence[bytes]) -> Dict[bytes, bytes]:
+        if not keys:
+            return {}
+        placeholders = ",".join("?" for _ in keys)
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT key, embedding FROM embedding_cache WHERE key IN ({placeholders})",
+                list(keys),
+            ).fetchall()
+        return {bytes(key): bytes(value) for key, value in rows}
+
+    def mset(self, items: Dict[bytes, bytes]) -> None:
+        if not items:
+            return
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embedding_cache (key, embedding) VALUES (?, ?)",
+                list(items.items()),
+            )
+            self._conn.commit()
+
+class PostgresEmbeddingStore:
+    """Persistent key -> float32 blob store in the embedding_cache table"""
+
+    def __init__(self, conninfo: str):
+        self.conninfo = conninfo
+        with psycopg.connect(conninfo) as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS embedding_cache ("
+                "key BYTEA PRIMARY KEY, embedding BYTEA NOT NULL, "
+                "created_at TIMESTAMPTZ NOT NULL DEFAULT now())"
+            )
+
+    def mget(self, keys: Sequence[bytes]) -> Dict[bytes, bytes]:
+        if not keys:
+            return {}
+        with psycopg.connect(self.conninfo) as conn:
+            rows = conn.execute(
+                "SELECT key, embedding FROM embedding_cache WHERE key = ANY(%s)",
+                (list(keys),),
+            ).fetchall()
+        return {bytes(key): bytes(value) for key, value in rows}
+
+    def mset(self, items: Dict[bytes, bytes]) -> None:
+        if not items:
+            return
+        with psycopg.connect(self.conninfo) as conn:
+            with conn.cursor() as cursor:
+                cursor.executemany(
+                    "INSERT INTO embedding_cache (key, embedding) VALUES (%s, %s) "
+                    "ON CONFLICT (key) DO UPDATE SET embedding = EXCLUDED.embedding",
+                    list(items.items()),
+                )
+
+class CachedEmbeddings(Embeddings):
+    """Embeddings wrapper with an LRU and an optional persistent tier"""
+
+    def __init__(
+        self,
+        underlying: Embeddings,
+        model_name: str,
+        max_size: int = 4096,
+        store=None,
+    ):
+        self.underlying = underlying
+        self.model_name = model_name
+        self.max_size = max_size
+        self.store = store
+        self._lru: "OrderedDict[bytes, bytes]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.persistent_hits = 0
+        self.misses = 0
+
+    def _key(self, kind: str, text: str) -> bytes:
+        return hashlib.sha256(
+            f"{self.model_name}\0{kind}\0{normalize_text(text)}".encode("utf-8")
+        ).digest()
+
+    def _lru_get(self, key: bytes) -> Optional[bytes]:
+        with self._lock:
+            value = self._lru.get(key)
+            if value is not None:
+                self._lru.move_to_end(key)
+            return value
+
+    def _lru_put(self, items: Dict[bytes, bytes]) -> None:
+        with self._lock:
+            for key, value in items.items():
+                self._lru[key] = value
+                self._lru.move_to_end(key)
+            while len(self._lru) > self.max_size:
+                self._lru.popitem(last=False)
+
+    def _lookup(self, keys: List[bytes]) -> Dict[bytes, bytes]:
+        """Resolve keys from memory, then the persistent tier; misses are absent"""
+        found = {}
+        for key in keys:
+            value = self._lru_get(key)
+            if value is not None:
+                found[key] = value
+        self.hits += len(found)
+
+        pending = [key for key in dict.fromkeys(keys) if key not in found]
+        if pending and self.store is not None:
+            stored = self.store.mget(pending)
+            self.persistent_hits += len(stored)
+            self._lru_put(stored)
+            found.update(stored)
+        return found
+
+    def _remember(self, computed: Dict[bytes, bytes]) -> None:
+        self._lru_put(computed)
+        if self.store is not None:
+            self.store.mset(computed)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        keys = [self._key("document", text) for text in texts]
+        found = self._lookup(keys)
+        missing = list({key: text for key, text in zip(keys, texts) if key not in found}.items())
+        if missing:
+            self.misses += len(missing)
+            vectors = self.underlying.embed_documents([text for _, text in missing])
+            computed = {key: pack_vector(vector) for (key, _), vector in zip(missing, vectors)}
+            self._remember(computed)
+            found.update(computed)
+        return [unpack_vector(found[key]) for key in keys]
+
+    def embed_query(self, text: str) -> List[float]:
+        key = self._key("query", text)
+        found = self._lookup([key])
+        if key not in found:
+            self.misses += 1
+            found[key] = pack_vector(self.underlying.embed_query(text))
+            self._remember({key: found[key]})
+        return unpack_vector(found[key])
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        keys = [self._key("document", text) for text in texts]
+        found = await asyncio.to_thread(self._lookup, keys)
+        missing = list({key: text for key, text in zip(keys, texts) if key not in found}.items())
+        if missing:
+            self.misses += len(missing)
+            vectors = await self.underlying.aembed_documents([text for _, text in missing])
+            computed = {key: pack_vector(vector) for (key, _), vector in zip(missing, vectors)}
+            await asyncio.to_thread(self._remember, computed)
+            found.update(computed)
+        return [unpack_vector(found[key]) for key in keys]
+
+    async def aembed_query(self, text: str) -> List[float]:
+        key = self._key("query", text)
+        # Memory hits are answered inline; only the persistent tier needs a thread
+        value = self._lru_get(key)
+        if value is not None:
+            self.hits += 1
+            return unpack_vector(value)
+        found = await asyncio.to_thread(self._lookup, [key]) if self.store is not None else {}
+        if key not in found:
+            self.misses += 1
+            found[key] = pack_vector(await self.underlying.aembed_query(text))
+            await asyncio.to_thread(self._remember, {key: found[key]})
+        return unpack_vector(found[key])
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "hits": self.hits,
+            "persistent_hits": self.persistent_hits,
+            "misses": self.misses,
+            "size": len(self._lru),
+            "max_size": self.max_size,
+        }
+
+def with_embedding_cache(underlying: Embeddings, model_name: str) -> Embeddings:
+    """Wrap an embedding model with the cache tiers configured in settings"""
+    if settings.EMBEDDING_CACHE_SIZE <= 0 and settings.EMBEDDING_CACHE_BACKEND == "none":
+        return underlying
+    store = None
+    if settings.EMBEDDING_CACHE_BACKEND == "sqlite":
+        store = SQLiteEmbeddingStore(settings.EMBEDDING_CACHE_PATH)
+    elif settings.EMBEDDING_CACHE_BACKEND == "postgres":
+        store = PostgresEmbeddingStore(settings.ASYNC_DATABASE_URL)
+    elif settings.EMBEDDING_CACHE_BACKEND != "none":
+        raise ValueError(f"Unknown EMBEDDING_CACHE_BACKEND: {settings.EMBEDDING_CACHE_BACKEND}")
+    return CachedEmbeddings(
+        underlying,
+        model_name=model_name,
+        max_size=settings.EMBEDDING_CACHE_SIZE,
+        store=store,
+    )
@@ -0,0 +1,234 @@
+"""
+Deterministic local stand-ins for Gemini, used by the offline benchmarks.
+
+- ``FakeChatModel`` streams a pseudo-random answer (seeded by the prompt)
+  after a configurable first-token delay, at a configurable token rate
+- ``FakeEmbeddings`` hashes words into a fixed-size unit vector, so similar
+  texts get similar vectors and the same text always gets the same one
+- ``synthetic_chunks`` generates a thesis-like corpus of any size, and
+  ``write_synthetic_pdf`` a text PDF of any number of pages
+
+Nothing here calls the network; results depend only on the inputs and seed.
+"""
+
+import asyncio
+import hashlib
+import math
+import random
+import re
+import time
+from typing import Any, AsyncIterator, Iterator, List, Optional, Sequence
+from langchain_core.callbacks import AsyncCallbackManagerForLLMRun, CallbackManagerForLLMRun
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+# Words the synthetic corpus, questions and answers are drawn from
+VOCABULARY = (
+    "quantum", "qubit", "qubits", "circuit", "gate", "hamiltonian", "ansatz",
+    "QAOA", "VQE", "optimization", "cost", "function", "parameter", "layer",
+    "entanglement", "superposition", "measurement", "noise", "error", "mitigation",
+    "graph", "maxcut", "portfolio", "energy", "expectation", "gradient", "classical",
+    "simulation", "hardware", "fidelity", "depth", "variational", "algorithm",
+    "computação", "quântica", "otimização", "função", "custo", "circuito", "porta",
+    "emaranhamento", "superposição", "medição", "ruído", "parâmetros", "camadas",
+    "algoritmo", "energia", "valor", "esperado", "gradiente", "clássico", "resultado",
+    "experimento", "simulação", "problema", "solução", "aproximação", "tese", "capítulo",
+    "the", "of", "and", "in", "to", "is", "a", "with", "for", "this",
+    "de", "da", "do", "em", "para", "com", "que", "uma", "os", "as",
+)
+
+def _seed(*parts: str) -> int:
+    digest = hashlib.sha256("\0".join(parts).encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "little")
+
+class FakeChatModel(BaseChatModel):
+    """Chat model answering every prompt with seeded filler text at a fixed pace"""
+
+    first_token_delay: float = 0.3  # Seconds before the first token
+    tokens_per_second: float = 80.0  # Pace of the remaining tokens (0 = no delay)
+    answer_tokens: int = 120
+    rewrite_tokens: int = 12  # Length of question rewrites (contextualization prompt)
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-chat"
+
+    def _tokens(self, messages: List[BaseMessage]) -> List[str]:
+        rng = random.Random(_seed(*(str(message.content) for message in messages)))
+        rewrite = any(
+            message.type == "system" and "standalone question" in str(message.content)
+            for message in messages
+        )
+        count = self.rewrite_tokens if rewrite else self.answer_tokens
+        return [rng.choice(VOCABULARY) + " " for _ in range(count)]
+
+    def _delay(self, index: int) -> float:
+        if index == 0:
+            return self.first_token_delay
+        return 1.0 / self.tokens_per_second if self.tokens_per_second > 0 else 0.0
+
+    def _generate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        tokens = self._tokens(messages)
+        time.sleep(sum(self._delay(i) for i in range(len(tokens))))
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content="".join(tokens)))])
+
+    async def _agenerate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        tokens = self._tokens(messages)
+        await asyncio.sleep(sum(self._delay(i) for i in range(len(tokens))))
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content="".join(tokens)))])
+
+    def _stream(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> Iterator[ChatGenerationChunk]:
+        for i, token in enumerate(self._tokens(messages)):
+            time.sleep(self._delay(i))
+            if run_manager:
+                run_manager.on_llm_new_token(token)
+            yield ChatGenerationChunk(message=AIMessageChunk(content=token))
+
+    async def _astream(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> AsyncIterator[ChatGenerationChunk]:
+        for i, token in enumerate(self._tokens(messages)):
+            await asyncio.sleep(self._delay(i))
+            if run_manager:
+                await run_manager.on_llm_new_token(token)
+            yield ChatGenerationChunk(message=AIMessageChunk(content=token))
+
+class FakeEmbeddings(Embeddings):
+    """Feature-hashed bag of words, L2-normalized (deterministic, no network)"""
+
+    def __init__(self, dims: int = 768, latency: float = 0.0):
+        self.dims = dims
+        self.latency = latency  # Seconds added per embedding call
+
+    def embed(self, text: str) -> List[float]:
+        vector = [0.0] * self.dims
+        for word in re.findall(r"\w+", text.lower()):
+            digest = hashlib.blake2b(word.encode("utf-8"), digest_size=8).digest()
+            index = int.from_bytes(digest[:4], "little") % self.dims
+            vector[index] += 1.0 if digest[4] & 1 else -1.0
+        norm = math.sqrt(sum(x * x for x in vector))
+        if not norm:
+            vector[0] = norm = 1.0
+        return [x / norm for x in vector]
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        if self.latency:
+            time.sleep(self.latency)
+        return [self.embed(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return [self.embed(text) for text in texts]
+
+    async def aembed_query(self, text: str) -> List[float]:
+        return (await self.aembed_documents([text]))[0]
+
+def synthetic_text(rng: random.Random, words: int) -> str:
+    return " ".join(rng.choice(VOCABULARY) for _ in range(words)).capitalize() + "."
+
+def synthetic_chunks(
+    count: int,
+    seed: int = 0,
+    thesis_ratio: float = 0.3,
+    words: int = 160,
+    chunks_per_page: int = 3,
+    pages_per_file: int = 40,
+    id_prefix: str = "synthetic",
+) -> List[Document]:
+    """Chunks shaped like ingest.py output: thesis.pdf first, then other PDFs"""
+    rng = random.Random(seed)
+    thesis_count = int(count * thesis_ratio)
+    docs = []
+    for i in range(count):
+        is_thesis = i < thesis_count
+        position = i if is_thesis else i - thesis_count
+        page = position // chunks_per_page
+        if is_thesis:
+            source = "data/thesis.pdf"
+        else:
+            source = f"data/paper-{page // pages_per_file:04d}.pdf"
+            page %= pages_per_file
+        docs.append(Document(
+            id=f"{id_prefix}-{i}",
+            page_content=synthetic_text(rng, words),
+            metadata={"source": source, "page": page, "is_thesis": is_thesis},
+        ))
+    return docs
+
+def synthetic_questions(count: int, seed: int = 0, words: Sequence[int] = (4, 9)) -> List[str]:
+    """Questions built from the corpus vocabulary, so retrieval has matches"""
+    rng = random.Random(seed)
+    return [
+        synthetic_text(rng, rng.randint(*words))[:-1] + "?"
+        for _ in range(count)
+    ]
+
+def _pdf_string(text: str) -> bytes:
+    escaped = text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+    return b"(" + escaped.encode("latin-1", errors="replace") + b")"
+
+def write_synthetic_pdf(path: str, pages: int, seed: int = 0, words_per_page: int = 400) -> str:
+    """Write a text PDF (Helvetica, one column) that PyPDFLoader can parse"""
+    rng = random.Random(seed)
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        b"",  # Page tree, filled in once the page objects are numbered
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>",
+    ]
+    page_ids = []
+    for _ in range(pages):
+        words = synthetic_text(rng, words_per_page).split()
+        lines = [" ".join(words[i:i + 12]) for i in range(0, len(words), 12)]
+        content = b"BT /F1 10 Tf 12 TL 50 780 Td " + b" ".join(
+            _pdf_string(line) + b" Tj T*" for line in lines
+        ) + b" ET"
+        objects.append(b"<< /Length %d >>\nstream\n%s\nendstream" % (len(content), content))
+        objects.append(
+            b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+            b"/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % (len(objects))
+        )
+        page_ids.append(len(objects))
+    kids = b" ".join(b"%d 0 R" % page_id for page_id in page_ids)
+    objects[1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (kids, pages)
+
+    output = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(len(output))
+        output += b"%d 0 obj\n%s\nendobj\n" % (number, body)
+    xref = len(output)
+    output += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    output += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    output += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    with open(path, "wb") as f:
+        f.write(output)
+    return path
@@ -0,0 +1,39 @@
+"""
+gunicorn settings for serving with several worker processes (preload mode):
+
+    cd backend
+    gunicorn -c gunicorn.conf.py main:app
+
+The master imports the app (preload_app) and the modules the chain needs
+(rag_chain.preload) once, then forks the workers, so each worker starts
+with them already loaded and shares their memory with the others. Nothing
+that holds a connection or client is created before the fork: each worker
+opens its own connection pool and builds its chain in the FastAPI startup
+event, and only then reports ready on /ready.
+
+Workers: WEB_CONCURRENCY (default: one per CPU). Address: BIND (default
+0.0.0.0:8000).
+"""
+
+import gc
+import os
+
+bind = os.environ.get("BIND", "0.0.0.0:8000")
+workers = int(os.environ.get("WEB_CONCURRENCY", os.cpu_count() or 1))
+worker_class = "uvicorn.workers.UvicornWorker"
+preload_app = True
+
+def on_starting(server):
+    """Master, after the app import and before the first fork"""
+    from rag_chain import preload
+    timings = preload()
+    print(f"✓ Preloaded for {workers} workers: {timings}")
+    # Preloaded objects leave the garbage collector's generations, so collections
+    # in the workers don't write to (and copy) the pages they share with the master
+    gc.freeze()
+
+def post_fork(server, worker):
+    """Worker, right after the fork"""
+    import db
+    # Connections can't be shared across processes; the worker's startup opens its own
+    db._connection_pool = None
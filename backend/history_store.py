@@ -0,0 +1,325 @@
+"""
+Chat history backed by the shared connection pool.
+
+Every read or write leases a connection for the duration of that one
+operation and hands it back afterwards, so a history object can live as
+long as it likes without pinning a pool slot.
+
+With a window set, only the last N messages are loaded per turn (served by
+the (session_id, id) index). Older turns can optionally be folded into a
+per-session summary row that is prepended as a system message; then every
+message after the summarized range is loaded, so none falls in between.
+
+With a HistoryWriter, writes are queued and inserted in batches by a
+background task (history_writer.py); reads merge in the session's queued
+messages so they are visible right away.
+
+The sync methods (messages, add_messages, clear), used by sync chain calls,
+run the same queries on a short-lived connection outside the pool. Sync
+writes are inserted directly and don't refresh the summary; the next async
+write does.
+"""
+
+import asyncio
+import json
+from typing import Awaitable, Callable, List, Optional, Sequence, Set, Tuple
+from psycopg import sql
+from langchain_core.chat_history import BaseChatMessageHistory
+from langchain_core.messages import (
+    BaseMessage,
+    SystemMessage,
+    message_to_dict,
+    messages_from_dict,
+)
+from db import connect_sync, lease_connection
+from history_writer import HistoryWriter
+import metrics
+
+# (previous summary or None, messages to fold in) -> new summary
+Summarizer = Callable[[Optional[str], List[BaseMessage]], Awaitable[str]]
+
+# Keep references to background summary tasks and avoid refreshing one session twice
+_summary_tasks: Set[asyncio.Task] = set()
+_summarizing_sessions: Set[Tuple[str, str]] = set()
+
+class PooledChatMessageHistory(BaseChatMessageHistory):
+    """Async chat history for one session stored in the chat_history table"""
+
+    def __init__(
+        self,
+        table_name: str,
+        session_id: str,
+        window: Optional[int] = None,
+        summarizer: Optional[Summarizer] = None,
+        writer: Optional[HistoryWriter] = None,
+    ):
+        self.table_name = table_name
+        self.session_id = session_id
+        self.window = window
+        self.summarizer = summarizer
+        self.writer = writer
+
+    @property
+    def summary_table_name(self) -> str:
+        return f"{self.table_name}_summary"
+
+    @staticmethod
+    async def acreate_tables(table_name: str) -> None:
+        """Create the message table, its indexes and the summary table"""
+        statements = [
+            sql.SQL(
+                "CREATE TABLE IF NOT EXISTS {table} ("
+                "id SERIAL PRIMARY KEY, "
+                "session_id TEXT NOT NULL, "
+                "message JSONB NOT NULL)"
+            ),
+            sql.SQL(
+                "CREATE INDEX IF NOT EXISTS {session_index} ON {table} (session_id)"
+            ),
+            # Serves ORDER BY id DESC LIMIT n per session without a sort
+            sql.SQL(
+                "CREATE INDEX IF NOT EXISTS {window_index} ON {table} (session_id, id DESC)"
+            ),
+            sql.SQL(
+                "CREATE TABLE IF NOT EXISTS {summary_table} ("
+                "session_id TEXT PRIMARY KEY, "
+                "summary TEXT NOT NULL, "
+                "last_message_id INTEGER NOT NULL, "
+                "updated_at TIMESTAMPTZ NOT NULL DEFAULT now())"
+            ),
+        ]
+        identifiers = {
+            "table": sql.Identifier(table_name),
+            "summary_table": sql.Identifier(f"{table_name}_summary"),
+            "session_index": sql.Identifier(f"idx_{table_name}_session_id"),
+            "window_index": sql.Identifier(f"idx_{table_name}_session_id_id"),
+        }
+        async with lease_connection() as conn:
+            for statement in statements:
+                await conn.execute(statement.format(**identifiers))
+
+    def _load_limit(self) -> Optional[int]:
+        if self.window is not None and self.summarizer is not None:
+            # Everything after the summarized range: the summary is refreshed once a
+            # full window has fallen out of it, so up to 2 × window messages aren't
+            # in the summary yet. More only pile up while refreshes are failing.
+            return 2 * self.window
+        return self.window
+
+    def _load_query(self, last_id: int, limit: Optional[int]) -> Tuple[sql.Composed, tuple]:
+        if limit is None:
+            query = sql.SQL(
+                "SELECT message FROM {table} WHERE session_id = %s ORDER BY id"
+            ).format(table=sql.Identifier(self.table_name))
+            return query, (self.session_id,)
+        query = sql.SQL(
+            "SELECT message FROM ("
+            "SELECT id, message FROM {table} WHERE session_id = %s AND id > %s "
+            "ORDER BY id DESC LIMIT %s"
+            ") recent ORDER BY id"
+        ).format(table=sql.Identifier(self.table_name))
+        return query, (self.session_id, last_id, limit)
+
+    def _summary_query(self) -> Tuple[sql.Composed, tuple]:
+        query = sql.SQL(
+            "SELECT summary, last_message_id FROM {table} WHERE session_id = %s"
+        ).format(table=sql.Identifier(self.summary_table_name))
+        return query, (self.session_id,)
+
+    def _loaded_messages(
+        self, rows: list, pending: List[BaseMessage], limit: Optional[int], summary: Optional[str]
+    ) -> List[BaseMessage]:
+        messages = messages_from_dict([row[0] for row in rows])
+        if pending:
+            stored = {message.id for message in messages if message.id}
+            messages += [message for message in pending if message.id not in stored]
+            if limit is not None:
+                messages = messages[-limit:]
+        if summary:
+            messages.insert(
+                0, SystemMessage(content=f"Summary of the earlier conversation:\n{summary}")
+            )
+        return messages
+
+    async def aget_messages(self) -> List[BaseMessage]:
+        summarized = self.window is not None and self.summarizer is not None
+        limit = self._load_limit()
+        # Taken before the query: a queued message written meanwhile shows up in
+        # both and is dropped from this list by id below
+        pending = self.writer.pending(self.table_name, self.session_id) if self.writer else []
+        summary = None
+        with metrics.timed("history_load"):
+            async with lease_connection() as conn:
+                async with conn.cursor() as cursor:
+                    last_id = 0
+                    if summarized:
+                        summary, last_id = await self._afetch_summary(cursor)
+                    await cursor.execute(*self._load_query(last_id, limit))
+                    rows = await cursor.fetchall()
+        return self._loaded_messages(rows, pending, limit, summary)
+
+    async def ahas_messages(self) -> bool:
+        """Whether the session has any stored message (first turn check)"""
+        if self.writer is not None and self.writer.pending(self.table_name, self.session_id):
+            return True
+        query = sql.SQL(
+            "SELECT EXISTS (SELECT 1 FROM {table} WHERE session_id = %s)"
+        ).format(table=sql.Identifier(self.table_name))
+        async with lease_connection() as conn:
+            async with conn.cursor() as cursor:
+                await cursor.execute(query, (self.session_id,))
+                row = await cursor.fetchone()
+        return bool(row[0])
+
+    async def aget_page(
+        self, limit: int, before: Optional[int] = None
+    ) -> Tuple[List[Tuple[int, BaseMessage]], Optional[int]]:
+        """
+        Return up to ``limit`` messages older than message id ``before``
+        (newest page when None) in chronological order, plus the cursor for
+        the next older page or None when there is nothing left.
+        """
+        if self.writer is not None:
+            # Pages carry row ids, so queued messages are written first
+            await self.writer.wait_written(self.table_name, self.session_id)
+        query = sql.SQL(
+            "SELECT id, message FROM {table} "
+            "WHERE session_id = %s AND (%s::integer IS NULL OR id < %s) "
+            "ORDER BY id DESC LIMIT %s"
+        ).format(table=sql.Identifier(self.table_name))
+        async with lease_connection() as conn:
+            async with conn.cursor() as cursor:
+                # One extra row tells us whether an older page exists
+                await cursor.execute(query, (self.session_id, before, before, limit + 1))
+                rows = await cursor.fetchall()
+
+        has_more = len(rows) > limit
+        rows = list(reversed(rows[:limit]))
+        messages = messages_from_dict([row[1] for row in rows])
+        page = [(row[0], message) for row, message in zip(rows, messages)]
+        next_cursor = rows[0][0] if has_more and rows else None
+        return page, next_cursor
+
+    async def aadd_messages(self, messages: Sequence[BaseMessage]) -> None:
+        if not messages:
+            return
+        if self.writer is not None:
+            self.writer.enqueue(self.table_name, self.session_id, messages)
+        else:
+            await self._ainsert(messages)
+
+        if self.window is not None and self.summarizer is not None:
+            key = (self.table_name, self.session_id)
+            if key not in _summarizing_sessions:
+                _summarizing_sessions.add(key)
+                task = asyncio.create_task(self._arefresh_summary())
+                _summary_tasks.add(task)
+                task.add_done_callback(_summary_tasks.discard)
+                task.add_done_callback(lambda _: _summarizing_sessions.discard(key))
+
+    def _insert_query(self, messages: Sequence[BaseMessage]) -> Tuple[sql.Composed, list]:
+        query = sql.SQL(
+            "INSERT INTO {table} (session_id, message) VALUES (%s, %s)"
+        ).format(table=sql.Identifier(self.table_name))
+        values = [
+            (self.session_id, json.dumps(message_to_dict(message)))
+            for message in messages
+        ]
+        return query, values
+
+    async def _ainsert(self, messages: Sequence[BaseMessage]) -> None:
+        with metrics.timed("history_write"):
+            async with lease_connection() as conn:
+                async with conn.cursor() as cursor:
+                    await cursor.executemany(*self._insert_query(messages))
+
+    async def aclear(self) -> None:
+        if self.writer is not None:
+            # Otherwise queued messages would be written after the delete
+            await self.writer.wait_written(self.table_name, self.session_id)
+        async with lease_connection() as conn:
+            for table in (self.table_name, self.summary_table_name):
+                await conn.execute(*self._delete_query(table))
+
+    def _delete_query(self, table: str) -> Tuple[sql.Composed, tuple]:
+        query = sql.SQL("DELETE FROM {table} WHERE session_id = %s").format(
+            table=sql.Identifier(table)
+        )
+        return query, (self.session_id,)
+
+    async def _afetch_summary(self, cursor) -> Tuple[Optional[str], int]:
+        await cursor.execute(*self._summary_query())
+        row = await cursor.fetchone()
+        return (row[0], row[1]) if row else (None, 0)
+
+    async def _arefresh_summary(self) -> None:
+        """Fold messages that fell out of the window into the summary row"""
+        try:
+            if self.writer is not None:
+                await self.writer.wait_written(self.table_name, self.session_id)
+            async with lease_connection() as conn:
+                async with conn.cursor() as cursor:
+                    summary, last_id = await self._afetch_summary(cursor)
+                    await cursor.execute(
+                        sql.SQL(
+                            "SELECT id, message FROM {table} "
+                            "WHERE session_id = %s AND id > %s ORDER BY id"
+                        ).format(table=sql.Identifier(self.table_name)),
+                        (self.session_id, last_id),
+                    )
+                    rows = await cursor.fetchall()
+
+            stale = rows[:-self.window]
+            # Summarize in batches of a full window so long sessions cost one
+            # extra LLM call every `window` messages, not every turn
+            if len(stale) < self.window:
+                return
+
+            new_summary = await self.summarizer(
+                summary, messages_from_dict([row[1] for row in stale])
+            )
+            async with lease_connection() as conn:
+                await conn.execute(
+                    sql.SQL(
+                        "INSERT INTO {table} (session_id, summary, last_message_id) "
+                        "VALUES (%s, %s, %s) "
+                        "ON CONFLICT (session_id) DO UPDATE SET "
+                        "summary = EXCLUDED.summary, "
+                        "last_message_id = EXCLUDED.last_message_id, "
+                        "updated_at = now()"
+                    ).format(table=sql.Identifier(self.summary_table_name)),
+                    (self.session_id, new_summary, stale[-1][0]),
+                )
+        except Exception as e:
+            print(f"Warning: Could not refresh history summary for {self.session_id}: {e}")
+
+    # Sync access (e.g. get_chat_chain().invoke) can't use the async pool
+    @property
+    def messages(self) -> List[BaseMessage]:  # type: ignore[override]
+        summarized = self.window is not None and self.summarizer is not None
+        limit = self._load_limit()
+        pending = self.writer.pending(self.table_name, self.session_id) if self.writer else []
+        summary = None
+        with metrics.timed("history_load"):
+            with connect_sync() as conn, conn.cursor() as cursor:
+                last_id = 0
+                if summarized:
+                    cursor.execute(*self._summary_query())
+                    row = cursor.fetchone()
+                    if row:
+                        summary, last_id = row
+                cursor.execute(*self._load_query(last_id, limit))
+                rows = cursor.fetchall()
+        return self._loaded_messages(rows, pending, limit, summary)
+
+    def add_messages(self, messages: Sequence[BaseMessage]) -> None:
+        if not messages:
+            return
+        with metrics.timed("history_write"):
+            with connect_sync() as conn, conn.cursor() as cursor:
+                cursor.executemany(*self._insert_query(messages))
+
+    def clear(self) -> None:
+        with connect_sync() as conn:
+            for table in (self.table_name, self.summary_table_name):
+                conn.execute(*self._delete_query(table))
@@ -0,0 +1,180 @@
+"""
+Write-behind persistence for chat messages.
+
+Instead of one INSERT per message at the end of every answer, messages are
+queued in process and a background task writes them with one multi-row
+INSERT per table, when ``batch_size`` rows are waiting or ``flush_interval``
+seconds after the oldest one was queued, whichever comes first.
+main.shutdown_event flushes whatever is left.
+
+Queued messages stay visible to readers: PooledChatMessageHistory merges
+``pending`` into what it reads from Postgres. Each queued message gets an id
+(kept in the stored JSON) so a message that is written while a read is in
+progress isn't returned twice.
+"""
+
+import asyncio
+import contextvars
+import json
+import uuid
+from collections import defaultdict
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple
+from psycopg import sql
+from langchain_core.messages import BaseMessage, message_to_dict
+from db import lease_connection
+import metrics
+
+class QueuedMessage(NamedTuple):
+    seq: int
+    table_name: str
+    session_id: str
+    message: BaseMessage
+
+class HistoryWriter:
+    """Batches chat_history inserts in a background task"""
+
+    def __init__(self, batch_size: int = 256, flush_interval: float = 0.2):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval  # Seconds a message may wait before it's written
+        self._queue: List[QueuedMessage] = []
+        # Queued messages by (table, session), for reads
+        self._pending: Dict[Tuple[str, str], List[QueuedMessage]] = defaultdict(list)
+        self._seq = 0
+        self._written_seq = 0
+        self._queued = asyncio.Event()  # Something was queued
+        self._wake = asyncio.Event()  # Flush now (batch full, a reader waiting, shutdown)
+        self._written = asyncio.Event()  # Replaced after every committed batch or failure
+        self._flush_lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self._closing = False
+        self._error: Optional[Exception] = None
+        self.batches = 0
+        self.rows = 0
+        self.errors = 0
+
+    def enqueue(self, table_name: str, session_id: str, messages: Sequence[BaseMessage]) -> None:
+        """Queue messages for insertion, in order; returns immediately"""
+        for message in messages:
+            if message.id is None:
+                message = message.model_copy(update={"id": uuid.uuid4().hex})
+            self._seq += 1
+            item = QueuedMessage(self._seq, table_name, session_id, message)
+            self._queue.append(item)
+            self._pending[(table_name, session_id)].append(item)
+        if self._task is None or self._task.done():
+            # Fresh context: the writer outlives the request that started it and
+            # must not record its flushes into that request's stage timings
+            self._task = contextvars.Context().run(asyncio.create_task, self._run())
+        self._queued.set()
+        if len(self._queue) >= self.batch_size:
+            self._wake.set()
+
+    def pending(self, table_name: str, session_id: str) -> List[BaseMessage]:
+        """Messages of a session that are queued but not written yet"""
+        return [item.message for item in self._pending.get((table_name, session_id), ())]
+
+    async def wait_written(self, table_name: str, session_id: str) -> None:
+        """Flush now and wait until the session's queued messages are in Postgres"""
+        queued = self._pending.get((table_name, session_id))
+        if not queued:
+            return
+        target = queued[-1].seq
+        while self._written_seq < target:
+            if self._task is None or self._task.done():
+                # Writer stopped (shutdown): write directly
+                await self.flush()
+                continue
+            self._wake.set()
+            await self._written.wait()
+            if self._written_seq < target and self._error is not None:
+                raise self._error
+
+    def _notify_written(self) -> None:
+        self._written.set()
+        self._written = asyncio.Event()
+
+    async def _run(self) -> None:
+        while not self._closing:
+            if not self._queue:
+                await self._queued.wait()
+                self._queued.clear()
+                continue
+            # Give the batch flush_interval to fill up, unless a flush is wanted now
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            try:
+                await self.flush()
+                self._error = None
+            except Exception as e:
+                self.errors += 1
+                self._error = e
+                self._notify_written()
+                print(f"Warning: Could not write {len(self._queue)} chat messages, will retry: {e}")
+                await asyncio.sleep(self.flush_interval)
+
+    async def flush(self) -> None:
+        """Write every queued message, in batches of batch_size"""
+        async with self._flush_lock:
+            await self._flush()
+
+    async def _flush(self) -> None:
+        while self._queue:
+            batch = self._queue[:self.batch_size]
+            by_table: Dict[str, List[QueuedMessage]] = defaultdict(list)
+            for item in batch:
+                by_table[item.table_name].append(item)
+            with metrics.timed("history_flush"):
+                async with lease_connection() as conn:
+                    for table_name, items in by_table.items():
+                        query = sql.SQL("INSERT INTO {table} (session_id, message) VALUES {rows}").format(
+                            table=sql.Identifier(table_name),
+                            rows=sql.SQL(", ").join([sql.SQL("(%s, %s)")] * len(items)),
+                        )
+                        params = []
+                        for item in items:
+                            params += [item.session_id, json.dumps(message_to_dict(item.message))]
+                        await conn.execute(query, params)
+            # Committed: drop the batch from the queue and from what readers merge in
+            del self._queue[:len(batch)]
+            for item in batch:
+                key = (item.table_name, item.session_id)
+                queued = self._pending[key]
+                queued.pop(0)
+                if not queued:
+                    del self._pending[key]
+            self._written_seq = batch[-1].seq
+            self.batches += 1
+            self.rows += len(batch)
+            metrics.increment("history_rows_written", len(batch))
+            self._notify_written()
+
+    async def close(self) -> None:
+        """Stop the background task and write what is still queued"""
+        if self._task is not None:
+            # Not cancelled: a flush interrupted after its commit would be written twice
+            self._closing = True
+            self._queued.set()
+            self._wake.set()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+            self._closing = False
+        if self._queue:
+            await self.flush()
+        # Events and the lock belong to the loop that used them; start clean on the next one
+        self._queued = asyncio.Event()
+        self._wake = asyncio.Event()
+        self._written = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "queued": len(self._queue),
+            "sessions_pending": len(self._pending),
+            "batches": self.batches,
+            "rows": self.rows,
+            "avg_batch_rows": round(self.rows / self.batches, 1) if self.batches else 0.0,
+            "errors": self.errors,
+        }
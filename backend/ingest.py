@@ -1,98 +1,563 @@
 import os
 import glob
-from typing import List
+import math
+import asyncio
+import json
+import uuid
+import hashlib
+import argparse
+import time
+from collections import deque
+from contextlib import ExitStack
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Deque, Dict, Iterator, List, NamedTuple, Optional, Tuple
+import psycopg
+from psycopg.types.json import Jsonb
 from langchain_community.document_loaders import PyPDFLoader
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 from langchain_google_genai import GoogleGenerativeAIEmbeddings
 from langchain_postgres import PGVector
 from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
 from config import get_settings
+from semantic_cache import invalidate_semantic_cache
+from embedding_cache import with_embedding_cache
+from embedding_batcher import EmbeddingBatcher
+from bulk_load import BulkLoader
+from vector_index import ensure_index, ensure_partition_index, ensure_text_search_index
+from local_index import build_local_index
 
 settings = get_settings()
 
+COLLECTION_NAME = "thesis_docs"
+MANIFEST_TABLE = "ingest_manifest"
 
-def get_embeddings() -> GoogleGenerativeAIEmbeddings:
-    """Get Gemini embeddings model. Uses gemini-embedding-001 (models/embedding-001 is deprecated)."""
-    return GoogleGenerativeAIEmbeddings(
-        model="gemini-embedding-001",
-        google_api_key=settings.GOOGLE_API_KEY,
+# Namespace for deterministic chunk ids (uuid5 of file name + chunk hash)
+CHUNK_ID_NAMESPACE = uuid.UUID("6f1d3c1e-8a52-4e0b-9a57-5b0f4c1d2e77")
+
+
+def get_embeddings() -> Embeddings:
+    """Get Gemini embeddings model. Uses gemini-embedding-001 (models/embedding-001 is deprecated).
+    With a persistent EMBEDDING_CACHE_BACKEND, unchanged chunks are not re-embedded."""
+    return with_embedding_cache(
+        GoogleGenerativeAIEmbeddings(
+            model="gemini-embedding-001",
+            google_api_key=settings.GOOGLE_API_KEY,
+        ),
+        model_name="gemini-embedding-001",
     )
 
 
+def load_pdf(pdf_file: str) -> List[Document]:
+    """Load one PDF, clean its text and tag it with source metadata"""
+    loader = PyPDFLoader(pdf_file)
+    return clean_pages(pdf_file, loader.load())
+
+
+def clean_pages(pdf_file: str, docs: List[Document]) -> List[Document]:
+    """Force valid UTF-8 page text and tag the pages with source metadata"""
+    # Ensure text encoding is correct and clean up any encoding issues
+    for doc in docs:
+        # PyPDFLoader already handles encoding, but we ensure UTF-8
+        if doc.page_content:
+            # Remove any problematic characters and ensure valid UTF-8
+            try:
+                # Try to encode/decode to ensure valid UTF-8
+                doc.page_content = doc.page_content.encode('utf-8', errors='ignore').decode('utf-8')
+            except:
+                pass  # If already valid, continue
+
+        # Add metadata for thesis
+        if os.path.basename(pdf_file) == "thesis.pdf":
+            doc.metadata["source"] = "thesis"
+            doc.metadata["is_thesis"] = True
+        else:
+            # Store original filename in metadata
+            doc.metadata["source"] = os.path.basename(pdf_file)
+
+    return docs
+
+
 def load_pdfs(directory: str) -> List[Document]:
     documents = []
     pdf_files = glob.glob(os.path.join(directory, "*.pdf"))
-    
+
     for pdf_file in pdf_files:
         print(f"Loading {pdf_file}...")
         try:
-            loader = PyPDFLoader(pdf_file)
-            docs = loader.load()
-            
-            # Ensure text encoding is correct and clean up any encoding issues
-            for doc in docs:
-                # PyPDFLoader already handles encoding, but we ensure UTF-8
-                if doc.page_content:
-                    # Remove any problematic characters and ensure valid UTF-8
-                    try:
-                        # Try to encode/decode to ensure valid UTF-8
-                        doc.page_content = doc.page_content.encode('utf-8', errors='ignore').decode('utf-8')
-                    except:
-                        pass  # If already valid, continue
-                
-                # Add metadata for thesis
-                if os.path.basename(pdf_file) == "thesis.pdf":
-                    doc.metadata["source"] = "thesis"
-                    doc.metadata["is_thesis"] = True
-                else:
-                    # Store original filename in metadata
-                    doc.metadata["source"] = os.path.basename(pdf_file)
-            
+            docs = load_pdf(pdf_file)
             documents.extend(docs)
             print(f"  ✓ Loaded {len(docs)} pages from {os.path.basename(pdf_file)}")
         except Exception as e:
             print(f"  ✗ Error loading {pdf_file}: {e}")
             continue
-    
+
     return documents
 
-def ingest_documents():
+
+def get_text_splitter() -> RecursiveCharacterTextSplitter:
+    return RecursiveCharacterTextSplitter(
+        chunk_size=1000,
+        chunk_overlap=200,
+    )
+
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class ParsedFile(NamedTuple):
+    file_name: str
+    pdf_file: str
+    file_hash: str
+    pages: int
+    chunks: List[Document]
+    error: Optional[str]
+
+
+def parse_and_split(pdf_file: str, file_hash: str) -> ParsedFile:
+    """Load and split one PDF. Runs in a worker process, so errors are returned, not raised."""
+    file_name = os.path.basename(pdf_file)
+    try:
+        docs = load_pdf(pdf_file)
+        chunks = get_text_splitter().split_documents(docs)
+        return ParsedFile(file_name, pdf_file, file_hash, len(docs), chunks, None)
+    except Exception as e:
+        return ParsedFile(file_name, pdf_file, file_hash, 0, [], str(e))
+
+
+def iter_parsed_files(jobs: List[Tuple[str, str]], workers: int) -> Iterator[ParsedFile]:
+    """
+    Parse and split (pdf_file, file_hash) jobs in a process pool, yielding files
+    in submission order. At most 2 * workers files are in flight, so a slow
+    consumer (embedding) holds back parsing instead of piling up chunks.
+    """
+    if workers <= 1:
+        for pdf_file, file_hash in jobs:
+            yield parse_and_split(pdf_file, file_hash)
+        return
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        in_flight = deque()
+        pending_jobs = iter(jobs)
+        for pdf_file, file_hash in pending_jobs:
+            in_flight.append(executor.submit(parse_and_split, pdf_file, file_hash))
+            if len(in_flight) >= 2 * workers:
+                break
+        while in_flight:
+            parsed = in_flight.popleft().result()
+            next_job = next(pending_jobs, None)
+            if next_job is not None:
+                in_flight.append(executor.submit(parse_and_split, *next_job))
+            yield parsed
+
+
+def assign_chunk_ids(file_name: str, chunks: List[Document]) -> List[str]:
+    """
+    Stable id per chunk: uuid5 of the file name, a hash of the chunk's text,
+    and how many identical chunks came before it in the same file.
+    Unchanged chunks keep their id when other parts of the file change; the
+    metadata (page numbers, PDF dates) is left out so that inserting a page
+    or re-saving the PDF doesn't re-embed every chunk after it.
+    """
+    ids = []
+    seen: Dict[str, int] = {}
+    for chunk in chunks:
+        chunk_hash = hashlib.sha256(chunk.page_content.encode("utf-8")).hexdigest()
+        occurrence = seen.get(chunk_hash, 0)
+        seen[chunk_hash] = occurrence + 1
+        chunk_id = str(uuid.uuid5(CHUNK_ID_NAMESPACE, f"{file_name}\0{chunk_hash}\0{occurrence}"))
+        chunk.id = chunk_id
+        ids.append(chunk_id)
+    return ids
+
+
+def get_embedding_batcher(embeddings: Embeddings) -> EmbeddingBatcher:
+    return EmbeddingBatcher(
+        embeddings.aembed_documents,
+        batch_size=settings.EMBED_BATCH_SIZE,
+        concurrency=settings.EMBED_CONCURRENCY,
+        requests_per_minute=settings.EMBED_REQUESTS_PER_MINUTE,
+        max_retries=settings.EMBED_MAX_RETRIES,
+    )
+
+
+# (file name, file hash, chunk ids, stale chunk ids) of a fully parsed file
+FinishedFile = Tuple[str, str, List[str], List[str]]
+WriteFn = Callable[[List[Document], List[List[float]], List[FinishedFile]], None]
+
+
+def pipeline_depth(batcher: EmbeddingBatcher, ingest_batch_size: int) -> int:
+    """Flushed batches to keep in flight: enough to fill EMBED_CONCURRENCY, plus the one being written"""
+    return max(1, math.ceil(batcher.concurrency * batcher.batch_size / ingest_batch_size)) + 1
+
+
+class WritePipeline:
+    """
+    Flushed batches, written in order. Each batch starts embedding as soon as
+    it is submitted, alongside the other pending ones (the batcher caps the
+    requests in flight), while the oldest is written in a thread. Submitting
+    waits once `depth` batches are pending, which bounds the chunks in memory.
+    """
+
+    def __init__(self, batcher: EmbeddingBatcher, write: WriteFn, depth: int):
+        self.batcher = batcher
+        self.write = write
+        self.depth = depth
+        self.pending: Deque[Tuple[Optional[asyncio.Task], List[Document], List[FinishedFile]]] = deque()
+        # Time spent waiting for embeddings / writes (not hidden by the overlap)
+        self.embed_seconds = 0.0
+        self.write_seconds = 0.0
+
+    async def submit(self, chunks: List[Document], files: List[FinishedFile]) -> None:
+        embedding = None
+        if chunks:
+            embedding = asyncio.create_task(self.batcher.aembed([chunk.page_content for chunk in chunks]))
+        self.pending.append((embedding, chunks, files))
+        await self.drain(self.depth - 1)
+
+    async def drain(self, keep: int = 0) -> None:
+        """Write the oldest batches until at most `keep` are pending"""
+        while len(self.pending) > keep:
+            embedding, chunks, files = self.pending[0]
+            vectors = []
+            if embedding is not None:
+                started = time.perf_counter()
+                vectors = await embedding
+                self.embed_seconds += time.perf_counter() - started
+            started = time.perf_counter()
+            await asyncio.to_thread(self.write, chunks, vectors, files)
+            self.write_seconds += time.perf_counter() - started
+            self.pending.popleft()
+
+    def cancel(self) -> None:
+        for embedding, _, _ in self.pending:
+            if embedding is not None:
+                embedding.cancel()
+        self.pending.clear()
+
+
+def committed_chunk_ids(conn: psycopg.Connection, ids: List[str]) -> set:
+    """Chunk ids already written to the collection, e.g. by batches of a run that died halfway"""
+    if not ids:
+        return set()
+    rows = conn.execute(
+        "SELECT e.id FROM langchain_pg_embedding e "
+        "JOIN langchain_pg_collection c ON e.collection_id = c.uuid "
+        "WHERE c.name = %s AND e.id = ANY(%s)",
+        (COLLECTION_NAME, ids),
+    ).fetchall()
+    return {row[0] for row in rows}
+
+
+def refresh_metadata(conn: psycopg.Connection, chunks: List[Document]) -> int:
+    """Update the stored metadata of kept chunks (e.g. moved to another page); returns how many changed"""
+    if not chunks:
+        return 0
+    rows = conn.execute(
+        "SELECT e.id, e.cmetadata FROM langchain_pg_embedding e "
+        "JOIN langchain_pg_collection c ON e.collection_id = c.uuid "
+        "WHERE c.name = %s AND e.id = ANY(%s)",
+        (COLLECTION_NAME, [chunk.id for chunk in chunks]),
+    ).fetchall()
+    stored = {row[0]: row[1] for row in rows}
+    changed = []
+    for chunk in chunks:
+        metadata = json.loads(json.dumps(chunk.metadata, default=str))
+        if chunk.id in stored and stored[chunk.id] != metadata:
+            changed.append((Jsonb(metadata), chunk.id))
+    if changed:
+        with conn.cursor() as cursor:
+            cursor.executemany("UPDATE langchain_pg_embedding SET cmetadata = %s WHERE id = %s", changed)
+    return len(changed)
+
+
+def ensure_manifest(conn: psycopg.Connection):
+    conn.execute(f"""
+        CREATE TABLE IF NOT EXISTS {MANIFEST_TABLE} (
+            collection TEXT NOT NULL,
+            file_name TEXT NOT NULL,
+            file_hash TEXT NOT NULL,
+            chunk_ids JSONB NOT NULL,
+            updated_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+            PRIMARY KEY (collection, file_name)
+        )
+    """)
+
+
+def read_manifest(conn: psycopg.Connection) -> Dict[str, Tuple[str, List[str]]]:
+    """file name -> (file hash, chunk ids) for the collection"""
+    rows = conn.execute(
+        f"SELECT file_name, file_hash, chunk_ids FROM {MANIFEST_TABLE} WHERE collection = %s",
+        (COLLECTION_NAME,),
+    ).fetchall()
+    return {row[0]: (row[1], row[2]) for row in rows}
+
+
+def write_manifest_entry(conn: psycopg.Connection, file_name: str, file_hash: str, chunk_ids: List[str]):
+    conn.execute(
+        f"""
+        INSERT INTO {MANIFEST_TABLE} (collection, file_name, file_hash, chunk_ids)
+        VALUES (%s, %s, %s, %s)
+        ON CONFLICT (collection, file_name) DO UPDATE SET
+            file_hash = EXCLUDED.file_hash,
+            chunk_ids = EXCLUDED.chunk_ids,
+            updated_at = now()
+        """,
+        (COLLECTION_NAME, file_name, file_hash, json.dumps(chunk_ids)),
+    )
+
+
+def delete_manifest_entry(conn: psycopg.Connection, file_name: str):
+    conn.execute(
+        f"DELETE FROM {MANIFEST_TABLE} WHERE collection = %s AND file_name = %s",
+        (COLLECTION_NAME, file_name),
+    )
+
+
+def ingest_documents(mode: str = "incremental", loader_type: Optional[str] = None):
+    """
+    Index data/pdfs into the thesis_docs collection.
+
+    incremental: only files whose hash changed are parsed; new chunks are
+    embedded and upserted, chunks that disappeared are deleted.
+    full: drop the collection and re-index every file.
+
+    With the "copy" loader (INGEST_LOADER) chunks are staged with binary COPY.
+    Incremental runs merge each flushed batch into the collection; full runs
+    stage everything and swap it in with one transaction at the end, so the
+    chat keeps answering from the old chunks during the rebuild.
+    """
+    return asyncio.run(aingest_documents(mode, loader_type))
+
+
+async def aingest_documents(mode: str = "incremental", loader_type: Optional[str] = None):
+    """
+    ingest_documents on one event loop for the whole run, so the embedding
+    client keeps its session and connections and flushes can overlap
+    """
+    loader_type = loader_type or settings.INGEST_LOADER
     pdf_dir = "data/pdfs"
     if not os.path.exists(pdf_dir):
         print(f"Directory {pdf_dir} does not exist.")
         return
 
-    print("Loading documents...")
-    docs = load_pdfs(pdf_dir)
-    
-    if not docs:
+    pdf_files = sorted(glob.glob(os.path.join(pdf_dir, "*.pdf")))
+    if not pdf_files:
         print("No documents found.")
         return
 
-    print(f"Loaded {len(docs)} pages.")
-
-    text_splitter = RecursiveCharacterTextSplitter(
-        chunk_size=1000,
-        chunk_overlap=200,
-    )
-    splits = text_splitter.split_documents(docs)
-    print(f"Split into {len(splits)} chunks.")
-
     embeddings = get_embeddings()
+    batcher = get_embedding_batcher(embeddings)
 
-    # Connection string
-    connection = settings.DATABASE_URL
-    
     print("Indexing to Postgres...")
     vector_store = PGVector(
         embeddings=embeddings,
-        collection_name="thesis_docs",
-        connection=connection,
+        collection_name=COLLECTION_NAME,
+        connection=settings.DATABASE_URL,
         use_jsonb=True,
+        pre_delete_collection=(mode == "full" and loader_type != "copy"),
     )
-    
-    vector_store.add_documents(splits)
-    print("Ingestion complete!")
+
+    added = skipped = deleted = 0
+    # Wall time per stage; parsing runs in workers and embedding overlaps the writes,
+    # so "parse" and "embed" are the time spent waiting for them
+    stage_seconds = {"parse": 0.0, "embed": 0.0, "insert": 0.0}
+
+    with psycopg.connect(settings.ASYNC_DATABASE_URL, autocommit=True) as conn, ExitStack() as stack:
+        loader = stack.enter_context(BulkLoader(conn, COLLECTION_NAME)) if loader_type == "copy" else None
+        # Full rebuild through the staging table: the live collection stays untouched until the swap
+        rebuild = mode == "full" and loader is not None
+
+        ensure_manifest(conn)
+        if mode == "full" and not rebuild:
+            conn.execute(f"DELETE FROM {MANIFEST_TABLE} WHERE collection = %s", (COLLECTION_NAME,))
+        manifest = {} if rebuild else read_manifest(conn)
+
+        if not manifest and mode == "incremental":
+            existing = conn.execute(
+                "SELECT count(*) FROM langchain_pg_embedding e "
+                "JOIN langchain_pg_collection c ON e.collection_id = c.uuid WHERE c.name = %s",
+                (COLLECTION_NAME,),
+            ).fetchone()[0]
+            if existing:
+                print(f"Warning: {existing} chunks exist without an ingest manifest "
+                      f"(indexed by an older ingest). Run with --mode full once to deduplicate.")
+
+        on_disk = {os.path.basename(path): path for path in pdf_files}
+
+        # Files removed from data/pdfs: drop their chunks
+        for file_name in sorted(set(manifest) - set(on_disk)):
+            _, old_ids = manifest[file_name]
+            if old_ids:
+                vector_store.delete(ids=old_ids)
+            delete_manifest_entry(conn, file_name)
+            deleted += len(old_ids)
+            print(f"  ✗ Removed {file_name} ({len(old_ids)} chunks)")
+
+        # Only new or changed files go through the parse/split pool
+        jobs = []
+        for file_name, pdf_file in on_disk.items():
+            file_hash = file_sha256(pdf_file)
+            old_hash, old_ids = manifest.get(file_name, (None, []))
+            if old_hash == file_hash:
+                skipped += len(old_ids)
+                print(f"  = Unchanged {file_name} ({len(old_ids)} chunks)")
+            else:
+                jobs.append((pdf_file, file_hash))
+
+        # Chunks are written in INGEST_BATCH_SIZE batches. A file's manifest entry
+        # (and the deletion of its stale chunks) is committed only once all of its
+        # new chunks have been flushed, so an interrupted run never records chunks
+        # that were not written.
+        batch: List[Document] = []
+        finished_files: List[FinishedFile] = []
+
+        def write(chunks: List[Document], vectors: List[List[float]], files: List[FinishedFile]):
+            """Runs in a thread, one flushed batch at a time and in order"""
+            if chunks:
+                texts = [chunk.page_content for chunk in chunks]
+                if loader is not None:
+                    loader.copy(
+                        [chunk.id for chunk in chunks],
+                        texts,
+                        [chunk.metadata for chunk in chunks],
+                        vectors,
+                    )
+                else:
+                    vector_store.add_embeddings(
+                        texts,
+                        vectors,
+                        metadatas=[chunk.metadata for chunk in chunks],
+                        ids=[chunk.id for chunk in chunks],
+                    )
+            if rebuild:
+                # Manifest entries are written by the swap at the end
+                return
+            if loader is not None:
+                # Staged chunks, stale deletions and manifest entries commit together
+                with conn.transaction():
+                    loader.merge(delete_ids=[i for entry in files for i in entry[3]])
+                    for file_name, file_hash, ids, _ in files:
+                        write_manifest_entry(conn, file_name, file_hash, ids)
+                return
+            for file_name, file_hash, ids, stale_ids in files:
+                if stale_ids:
+                    vector_store.delete(ids=stale_ids)
+                write_manifest_entry(conn, file_name, file_hash, ids)
+
+        # The next batches embed while one is being written
+        pipeline = WritePipeline(batcher, write, pipeline_depth(batcher, settings.INGEST_BATCH_SIZE))
+
+        async def flush():
+            # A rebuild keeps its finished files for the swap
+            chunks, files = batch[:], [] if rebuild else finished_files[:]
+            batch.clear()
+            if not rebuild:
+                finished_files.clear()
+            if chunks or files:
+                await pipeline.submit(chunks, files)
+
+        workers = settings.INGEST_WORKERS or os.cpu_count() or 1
+        parsed_files = iter_parsed_files(jobs, workers)
+        try:
+            while True:
+                started = time.perf_counter()
+                parsed = await asyncio.to_thread(next, parsed_files, None)
+                stage_seconds["parse"] += time.perf_counter() - started
+                if parsed is None:
+                    break
+                if parsed.error:
+                    print(f"  ✗ Error loading {parsed.pdf_file}: {parsed.error}")
+                    continue
+
+                ids = assign_chunk_ids(parsed.file_name, parsed.chunks)
+                old_id_set = set(manifest.get(parsed.file_name, (None, []))[1])
+                stale_ids = sorted(old_id_set - set(ids))
+                # Deterministic ids make committed batches a checkpoint: chunks written
+                # before an interrupted run are not embedded again (a rebuild stages
+                # every chunk, the live ones are about to be replaced)
+                resumed = set() if rebuild else committed_chunk_ids(conn, [i for i in ids if i not in old_id_set])
+                if resumed:
+                    print(f"  ↻ {parsed.file_name}: resuming, {len(resumed)} chunks already written")
+                kept = [chunk for chunk in parsed.chunks if chunk.id in old_id_set]
+                # Same text, but possibly a new page number: metadata only, no embedding
+                relabeled = 0 if rebuild else refresh_metadata(conn, kept)
+                old_id_set |= resumed
+                new_count = 0
+                for chunk in parsed.chunks:
+                    if chunk.id in old_id_set:
+                        continue
+                    batch.append(chunk)
+                    new_count += 1
+                    if len(batch) >= settings.INGEST_BATCH_SIZE:
+                        await flush()
+                finished_files.append((parsed.file_name, parsed.file_hash, ids, stale_ids))
+                if not batch:
+                    await flush()
+
+                added += new_count
+                skipped += len(parsed.chunks) - new_count
+                deleted += len(stale_ids)
+                print(f"  ✓ {parsed.file_name}: {parsed.pages} pages, {new_count} new chunks, "
+                      f"{len(stale_ids)} removed, {relabeled} with updated metadata")
+
+            await flush()
+            await pipeline.drain()
+        finally:
+            # Embeddings still pending when the run failed
+            pipeline.cancel()
+        stage_seconds["embed"] += pipeline.embed_seconds
+        stage_seconds["insert"] += pipeline.write_seconds
+
+        if rebuild:
+            if finished_files:
+                started = time.perf_counter()
+                with conn.transaction():
+                    swapped = loader.swap()
+                    conn.execute(f"DELETE FROM {MANIFEST_TABLE} WHERE collection = %s", (COLLECTION_NAME,))
+                    for file_name, file_hash, ids, _ in finished_files:
+                        write_manifest_entry(conn, file_name, file_hash, ids)
+                stage_seconds["insert"] += time.perf_counter() - started
+                print(f"  ✓ Swapped {swapped} chunks into {COLLECTION_NAME}")
+            else:
+                print("  ✗ No file could be parsed, keeping the current collection")
+
+    if added or deleted:
+        # Cached answers may cite chunks that changed, drop them
+        invalidate_semantic_cache(settings.ASYNC_DATABASE_URL)
+    # A full rebuild gets a new collection uuid, so its partial index must be rebuilt.
+    # Building it after the load is much faster than maintaining it row by row.
+    ensure_partition_index()
+    ensure_text_search_index()
+    ensure_index()
+    if settings.VECTOR_BACKEND == "local":
+        build_local_index(COLLECTION_NAME)
+    if hasattr(embeddings, "stats"):
+        print(f"Embedding cache: {embeddings.stats()}")
+    print(f"Embedding requests: {batcher.requests} ({batcher.retries} retried)")
+    print("Stage times: " + ", ".join(f"{stage} {seconds:.1f}s" for stage, seconds in stage_seconds.items()))
+    print(f"Ingestion complete! Added: {added}, skipped: {skipped}, deleted: {deleted}")
+    return {"added": added, "skipped": skipped, "deleted": deleted}
 
 if __name__ == "__main__":
-    ingest_documents()
+    parser = argparse.ArgumentParser(description="Index data/pdfs into the vector store")
+    parser.add_argument(
+        "--mode",
+        choices=["incremental", "full"],
+        default="incremental",
+        help="incremental: only re-embed new or changed chunks (default); full: rebuild the collection",
+    )
+    parser.add_argument(
+        "--loader",
+        choices=["copy", "pgvector"],
+        default=None,
+        help="copy: binary COPY through a staging table; pgvector: PGVector.add_embeddings "
+             "(default: INGEST_LOADER)",
+    )
+    args = parser.parse_args()
+    ingest_documents(mode=args.mode, loader_type=args.loader)
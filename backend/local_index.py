@@ -0,0 +1,308 @@
+"""
+Memory-mapped local vector index (VECTOR_BACKEND=local).
+
+The collection's embeddings are exported from Postgres into a float32
+matrix saved as ``.npy`` (rows L2-normalized, so a dot product is the cosine
+similarity), with ids, chunk text and metadata in a JSON sidecar. Searches
+are one NumPy matrix-vector product plus an ``argpartition`` top-k, with a
+precomputed row mask for the thesis / non-thesis split.
+
+The matrix is opened with ``np.load(mmap_mode="r")``, so every uvicorn worker
+on the node shares one page-cached copy. Each build writes new files under a
+fresh build id and then atomically replaces the ``<collection>.current``
+pointer; readers notice the new pointer and switch on their next search.
+
+Full-text search is not available here: with this backend HYBRID_SEARCH
+has no effect and retrieval is vector-only.
+
+Usage:
+    python local_index.py build     # export thesis_docs from Postgres (ingest.py does this too)
+    python local_index.py status    # rows, dims, size and search latency
+"""
+
+import argparse
+import json
+import os
+import threading
+import time
+import uuid
+from typing import Any, Dict, List, NamedTuple, Optional, Sequence, Tuple
+import numpy as np
+import psycopg
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from pgvector.psycopg import register_vector
+from config import get_settings
+import metrics
+
+settings = get_settings()
+
+COLLECTION_NAME = "thesis_docs"
+
+# Rows fetched per round trip while exporting
+EXPORT_BATCH_SIZE = 2000
+
+def _paths(directory: str, collection_name: str, build_id: str) -> Tuple[str, str]:
+    base = os.path.join(directory, f"{collection_name}.{build_id}")
+    return base + ".npy", base + ".docs.json"
+
+def _pointer_path(directory: str, collection_name: str) -> str:
+    return os.path.join(directory, f"{collection_name}.current")
+
+def top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    """Positions of the k highest scores, best first"""
+    if k <= 0 or not len(scores):
+        return np.empty(0, dtype=np.int64)
+    if k >= len(scores):
+        return np.argsort(-scores, kind="stable")
+    candidates = np.argpartition(-scores, k - 1)[:k]
+    return candidates[np.argsort(-scores[candidates], kind="stable")]
+
+def build_local_index(
+    collection_name: str = COLLECTION_NAME, directory: Optional[str] = None
+) -> Optional[str]:
+    """
+    Export a PGVector collection to a new build and point the collection at
+    it. Returns the build id, or None if the collection is empty.
+    """
+    directory = directory or settings.LOCAL_INDEX_DIR
+    os.makedirs(directory, exist_ok=True)
+    started = time.perf_counter()
+
+    with psycopg.connect(settings.ASYNC_DATABASE_URL) as conn:
+        # Count and rows come from one snapshot, even if an ingest commits meanwhile
+        conn.isolation_level = psycopg.IsolationLevel.REPEATABLE_READ
+        register_vector(conn)
+        row = conn.execute(
+            "SELECT count(*), max(vector_dims(e.embedding)) FROM langchain_pg_embedding e "
+            "JOIN langchain_pg_collection c ON e.collection_id = c.uuid WHERE c.name = %s",
+            (collection_name,),
+        ).fetchone()
+        rows, dims = row[0], row[1]
+        if not rows:
+            print(f"Collection {collection_name} is empty, no local index built.")
+            return None
+
+        build_id = time.strftime("%Y%m%d%H%M%S") + "-" + uuid.uuid4().hex[:6]
+        matrix_path, docs_path = _paths(directory, collection_name, build_id)
+        matrix = np.lib.format.open_memmap(matrix_path, mode="w+", dtype=np.float32, shape=(rows, dims))
+        ids: List[str] = []
+        texts: List[str] = []
+        metadatas: List[Dict[str, Any]] = []
+
+        with conn.cursor(name="local_index_export") as cursor:
+            cursor.itersize = EXPORT_BATCH_SIZE
+            cursor.execute(
+                "SELECT e.id, e.document, e.cmetadata, e.embedding FROM langchain_pg_embedding e "
+                "JOIN langchain_pg_collection c ON e.collection_id = c.uuid WHERE c.name = %s "
+                "ORDER BY e.id",
+                (collection_name,),
+            )
+            for position, (chunk_id, text, metadata, embedding) in enumerate(cursor):
+                vector = np.asarray(embedding, dtype=np.float32)
+                norm = np.linalg.norm(vector)
+                matrix[position] = vector / norm if norm else vector
+                ids.append(chunk_id)
+                texts.append(text or "")
+                metadatas.append(metadata or {})
+
+    matrix.flush()
+    del matrix
+    with open(docs_path, "w", encoding="utf-8") as f:
+        json.dump({"ids": ids, "texts": texts, "metadatas": metadatas}, f, ensure_ascii=False, separators=(",", ":"))
+
+    # Switch readers to the new build, then drop older ones (open mmaps stay valid)
+    pointer = _pointer_path(directory, collection_name)
+    with open(pointer + ".tmp", "w") as f:
+        f.write(build_id)
+    os.replace(pointer + ".tmp", pointer)
+    for name in os.listdir(directory):
+        if (
+            name.startswith(f"{collection_name}.")
+            and name.endswith((".npy", ".docs.json"))
+            and not name.startswith(f"{collection_name}.{build_id}.")
+        ):
+            os.remove(os.path.join(directory, name))
+
+    size_mb = os.path.getsize(matrix_path) / (1 << 20)
+    print(f"✓ Local index {collection_name}.{build_id}: {len(ids)} rows, {dims} dims, "
+          f"{size_mb:.1f}MB in {time.perf_counter() - started:.1f}s")
+    return build_id
+
+class LocalBuild(NamedTuple):
+    """One loaded build; replaced as a whole when a new build is published"""
+    build_id: str
+    matrix: np.ndarray
+    ids: List[str]
+    texts: List[str]
+    metadatas: List[Dict[str, Any]]
+    positions: Dict[str, int]
+    thesis_rows: np.ndarray
+    other_rows: np.ndarray
+
+    def documents(self, rows: Sequence[int]) -> List[Document]:
+        return [
+            Document(id=self.ids[row], page_content=self.texts[row], metadata=self.metadatas[row])
+            for row in rows
+        ]
+
+def load_build(directory: str, collection_name: str, build_id: str) -> LocalBuild:
+    matrix_path, docs_path = _paths(directory, collection_name, build_id)
+    matrix = np.load(matrix_path, mmap_mode="r")
+    with open(docs_path, encoding="utf-8") as f:
+        docs = json.load(f)
+    is_thesis = np.array([bool(metadata.get("is_thesis")) for metadata in docs["metadatas"]], dtype=bool)
+    return LocalBuild(
+        build_id=build_id,
+        matrix=matrix,
+        ids=docs["ids"],
+        texts=docs["texts"],
+        metadatas=docs["metadatas"],
+        positions={chunk_id: row for row, chunk_id in enumerate(docs["ids"])},
+        thesis_rows=np.flatnonzero(is_thesis),
+        other_rows=np.flatnonzero(~is_thesis),
+    )
+
+class LocalVectorIndex:
+    """Same search interface as AsyncVectorSearch, served from the memory-mapped build"""
+
+    def __init__(
+        self,
+        embeddings: Embeddings,
+        collection_name: str = COLLECTION_NAME,
+        directory: Optional[str] = None,
+    ):
+        self.embeddings = embeddings
+        self.collection_name = collection_name
+        self.directory = directory or settings.LOCAL_INDEX_DIR
+        self._lock = threading.Lock()
+        self._build: Optional[LocalBuild] = None
+        self._pointer_mtime: Optional[int] = None
+
+    def current(self) -> LocalBuild:
+        """The published build, reloaded when the pointer file changes"""
+        pointer = _pointer_path(self.directory, self.collection_name)
+        try:
+            mtime = os.stat(pointer).st_mtime_ns
+        except FileNotFoundError:
+            raise FileNotFoundError(
+                f"No local index for {self.collection_name} in {self.directory}; "
+                f"run ingest.py or `python local_index.py build`"
+            )
+        build = self._build
+        if build is not None and mtime == self._pointer_mtime:
+            return build
+        with self._lock:
+            if self._build is None or mtime != self._pointer_mtime:
+                with open(pointer) as f:
+                    build_id = f.read().strip()
+                self._build = load_build(self.directory, self.collection_name, build_id)
+                self._pointer_mtime = mtime
+            return self._build
+
+    @staticmethod
+    def _scores(build: LocalBuild, embedding: Sequence[float]) -> np.ndarray:
+        query = np.asarray(embedding, dtype=np.float32)
+        if query.shape[0] != build.matrix.shape[1]:
+            raise ValueError(
+                f"Query has {query.shape[0]} dims, the local index {build.matrix.shape[1]}; rebuild it"
+            )
+        norm = np.linalg.norm(query)
+        return build.matrix @ (query / norm if norm else query)
+
+    def search_by_vector(
+        self, embedding: Sequence[float], k: int = 4, filter: Optional[Dict[str, Any]] = None
+    ) -> List[Document]:
+        with metrics.timed("vector_query"):
+            build = self.current()
+            scores = self._scores(build, embedding)
+            if filter:
+                rows = np.array([
+                    row for row, metadata in enumerate(build.metadatas)
+                    if all(metadata.get(key) == value for key, value in filter.items())
+                ], dtype=np.int64)
+                best = rows[top_k(scores[rows], k)] if len(rows) else rows
+            else:
+                best = top_k(scores, k)
+            return build.documents(best)
+
+    def search_partitioned(
+        self, embedding: Sequence[float], thesis_k: int, other_k: int
+    ) -> Tuple[List[Document], List[Document]]:
+        """Best thesis and non-thesis chunks from one matrix-vector product"""
+        with metrics.timed("vector_query"):
+            build = self.current()
+            scores = self._scores(build, embedding)
+            thesis = build.thesis_rows[top_k(scores[build.thesis_rows], thesis_k)]
+            other = build.other_rows[top_k(scores[build.other_rows], other_k)]
+            return build.documents(thesis), build.documents(other)
+
+    def similarity_search(self, query: str, k: int = 4, filter: Optional[Dict[str, Any]] = None) -> List[Document]:
+        """Sync search (PGVector-compatible, used by the sync chain path)"""
+        with metrics.timed("embedding"):
+            embedding = self.embeddings.embed_query(query)
+        return self.search_by_vector(embedding, k=k, filter=filter)
+
+    async def asimilarity_search(
+        self, query: str, k: int = 4, filter: Optional[Dict[str, Any]] = None
+    ) -> List[Document]:
+        with metrics.timed("embedding"):
+            embedding = await self.embeddings.aembed_query(query)
+        return self.search_by_vector(embedding, k=k, filter=filter)
+
+    async def asimilarity_search_by_vector(
+        self, embedding: Sequence[float], k: int = 4, filter: Optional[Dict[str, Any]] = None
+    ) -> List[Document]:
+        return self.search_by_vector(embedding, k=k, filter=filter)
+
+    async def asimilarity_search_partitioned(
+        self, query: str, thesis_k: int, other_k: int
+    ) -> Tuple[List[Document], List[Document]]:
+        with metrics.timed("embedding"):
+            embedding = await self.embeddings.aembed_query(query)
+        return self.search_partitioned(embedding, thesis_k, other_k)
+
+    async def aget_by_ids(self, ids: Sequence[str]) -> List[Document]:
+        build = self.current()
+        return build.documents([build.positions[chunk_id] for chunk_id in ids if chunk_id in build.positions])
+
+    async def atext_search(self, query: str, k: int = 4) -> List[Document]:
+        # No full-text index in the local backend
+        return []
+
+    async def atext_search_partitioned(
+        self, query: str, thesis_k: int, other_k: int
+    ) -> Tuple[List[Document], List[Document]]:
+        return [], []
+
+    def stats(self) -> Dict[str, Any]:
+        build = self.current()
+        return {
+            "build": build.build_id,
+            "rows": int(build.matrix.shape[0]),
+            "dims": int(build.matrix.shape[1]),
+            "thesis_rows": int(len(build.thesis_rows)),
+            "matrix_mb": round(build.matrix.nbytes / (1 << 20), 2),
+        }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Manage the memory-mapped local vector index")
+    parser.add_argument("command", choices=["build", "status"])
+    parser.add_argument("--queries", type=int, default=200)
+    args = parser.parse_args()
+
+    if args.command == "build":
+        build_local_index()
+    else:
+        index = LocalVectorIndex(embeddings=None)
+        print(index.stats())
+        rng = np.random.default_rng(0)
+        latencies = []
+        for _ in range(args.queries):
+            query = rng.standard_normal(index.current().matrix.shape[1]).astype(np.float32)
+            start = time.perf_counter()
+            index.search_partitioned(query, settings.RETRIEVAL_TOP_K, settings.RETRIEVAL_TOP_K)
+            latencies.append((time.perf_counter() - start) * 1000)
+        latencies.sort()
+        print(f"Partitioned search over {args.queries} random queries: "
+              f"p50 {latencies[len(latencies) // 2]:.3f}ms  p95 {latencies[int(len(latencies) * 0.95)]:.3f}ms")
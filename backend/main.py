@@ -1,54 +1,117 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
-from typing import AsyncIterable
-from fastapi.responses import StreamingResponse
+from typing import AsyncIterator, Literal
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 import asyncio
 import json
-from rag_chain import get_rag_chain, get_session_history
-from langchain_core.runnables.history import RunnableWithMessageHistory
-import psycopg
+import os
+from contextlib import aclosing
+import time
+import uuid
+from rag_chain import get_chat_chain, get_rag_chain, get_session_history, warm_up
+from contextualizer import canonical_question
+from single_flight import SingleFlight
+from admission import AdmissionController, Reservation, Slot
+from streaming import (
+    Event, MEDIA_TYPES, chunk_text, coalesce_tokens, describe_sources,
+    encode_events, negotiate_format,
+)
 from config import get_settings
+import metrics
 
 settings = get_settings()
 
 app = FastAPI(title="Thesis Chatbot API")
 
+# Request header that enables a per-request stage trace
+TRACE_HEADER = "X-Trace"
+
+# Background ANN index build started at startup (VECTOR_INDEX_ON_STARTUP)
+_index_task = None
+
+# Set once the startup warm-up has finished (or was skipped), cleared at shutdown
+_ready = False
+
+# This worker's startup timings, reported by /ready
+_startup_timings = {}
+
+# In-flight first-turn generations, shared by identical questions
+_single_flight = SingleFlight()
+
+# Limits concurrent answers; the rest queue per session or get a 429
+_admission = AdmissionController(
+    settings.CHAT_MAX_CONCURRENT,
+    settings.CHAT_MAX_QUEUE,
+    settings.CHAT_SHED_CONTEXTUALIZE_QUEUE,
+)
+
 @app.on_event("startup")
 async def startup_event():
     """Initialize database and connection pool on startup"""
+    # Runs in each worker: with several workers (gunicorn.conf.py) every
+    # process opens its own pool here, after the fork
+    global _ready, _startup_timings
+    started = time.perf_counter()
+    # Any failure keeps the worker unready (503 on /ready, with the errors)
+    errors = []
     try:
-        from rag_chain import get_connection_pool
+        from history_store import PooledChatMessageHistory
+        
+        # Create tables using pooled connection (opens the pool on first use)
+        await PooledChatMessageHistory.acreate_tables("chat_history")
         
-        # Initialize connection pool
-        pool = await get_connection_pool()
+        if settings.SEMANTIC_CACHE_ENABLED:
+            from semantic_cache import SemanticCache
+            await SemanticCache.acreate_table()
         
-        # Create tables using pooled connection
-        async with pool.connection() as conn:
-            async with conn.cursor() as cursor:
-                await cursor.execute("""
-                    CREATE TABLE IF NOT EXISTS chat_history (
-                        id SERIAL PRIMARY KEY,
-                        session_id TEXT NOT NULL,
-                        message JSONB NOT NULL
-                    );
-                    CREATE INDEX IF NOT EXISTS idx_chat_history_session_id ON chat_history(session_id);
-                """)
-                await conn.commit()
+        if settings.VECTOR_INDEX_ON_STARTUP and settings.VECTOR_INDEX_TYPE != "none":
+            # Building can take minutes on large corpora, don't hold up startup
+            from vector_index import ensure_index
+            global _index_task
+            _index_task = asyncio.create_task(asyncio.to_thread(ensure_index))
         
         print("✓ Database initialized with connection pool")
-        print(f"✓ Pool size: {settings.DB_POOL_SIZE}, Max overflow: {settings.DB_MAX_OVERFLOW}")
+        print(f"✓ Pool size: {settings.DB_POOL_SIZE} + {settings.DB_MAX_OVERFLOW} overflow, Acquire timeout: {settings.DB_ACQUIRE_TIMEOUT}s")
     except Exception as e:
         print(f"Warning: Could not initialize database: {e}")
+        errors.append(f"database: {e}")
+    
+    timings = {}
+    if settings.WARMUP_ON_STARTUP:
+        try:
+            timings = await warm_up()
+            print(f"✓ Warm-up complete: {timings}")
+        except Exception as e:
+            print(f"Warning: Warm-up failed: {e}")
+            errors.append(f"warm-up: {e}")
+    
+    from db import get_pool_stats
+    if not get_pool_stats()["open"] and not errors:
+        errors.append("database: connection pool not open")
+    _startup_timings = {"startup_ms": round((time.perf_counter() - started) * 1000, 1), "warm_up": timings}
+    if errors:
+        _startup_timings["errors"] = errors
+        print(f"✗ Not ready, /ready returns 503: {'; '.join(errors)}")
+        return
+    _ready = True
+    print("✓ Ready to serve requests")
 
 @app.on_event("shutdown")
 async def shutdown_event():
-    """Close connection pool on shutdown"""
+    """Write queued chat messages, then close the connection pool"""
+    global _ready
+    # Stop receiving traffic from load balancers while draining
+    _ready = False
     try:
-        from rag_chain import _connection_pool
-        if _connection_pool:
-            await _connection_pool.close()
-            print("✓ Connection pool closed")
+        from rag_chain import get_history_writer
+        await get_history_writer().close()
+    except Exception as e:
+        print(f"Warning: Could not write queued chat messages: {e}")
+    try:
+        from db import close_connection_pool
+        await close_connection_pool()
+        print("✓ Connection pool closed")
     except Exception as e:
         print(f"Warning: Error closing connection pool: {e}")
 
@@ -64,66 +127,336 @@ app.add_middleware(
 class ChatRequest(BaseModel):
     message: str
     session_id: str
+    # "text" (default), "sse" or "ndjson"; falls back to the Accept header
+    format: Literal["text", "sse", "ndjson"] | None = None
 
-async def generate_chat_response(message: str, session_id: str) -> AsyncIterable[str]:
-    """Optimized streaming response generator"""
-    from langchain_core.messages import HumanMessage
-    from langchain_core.runnables.history import RunnableWithMessageHistory
+async def generate_chat_events(
+    message: str, session_id: str, trace_id: str | None = None, slot: Slot | None = None
+) -> AsyncIterator[Event]:
+    """
+    Answer a message as a stream of (event, data): "sources" once retrieval
+    is done, "token" for each model chunk and a final "stats" with timings.
+    With an admission slot, timings start at the request's arrival.
+    """
+    from langchain_core.messages import HumanMessage, AIMessage
+    from rag_chain import get_embeddings, get_semantic_cache, get_async_vector_search
     
-    rag_chain = get_rag_chain(session_id)
+    started = slot.arrived if slot is not None else time.perf_counter()
+    # Stages record here (and in the /metrics histograms) through metrics.observe
+    timings = metrics.start_request()
+    if slot is not None:
+        metrics.observe("queue_wait", slot.wait_seconds)
     
-    # Get the history object (cached connection pool)
-    history = await get_session_history(session_id)
+    def finish(cache_hit: bool, coalesced: bool = False) -> Event:
+        metrics.observe_since("total", started)
+        stats = {**timings, "cache_hit": cache_hit, "coalesced": coalesced}
+        if trace_id is not None:
+            metrics.record_trace(trace_id, {"session_id": session_id, "message": message[:200], **stats})
+            print(f"trace {trace_id}: {stats}")
+        return "stats", stats
     
-    # Factory function that returns the history object
-    def get_history(session_id: str):
-        return history
+    # First-turn answers don't depend on history: they can be cached and shared
+    cache = get_semantic_cache() if settings.SEMANTIC_CACHE_ENABLED else None
+    history = get_session_history(session_id)
+    first_turn = False
+    if cache is not None or settings.SINGLE_FLIGHT_ENABLED:
+        try:
+            first_turn = not await history.ahas_messages()
+        except Exception as e:
+            print(f"Warning: Could not check chat history: {e}")
     
-    chain_with_history = RunnableWithMessageHistory(
-        rag_chain,
-        get_history,
-        input_messages_key="input",
-        history_messages_key="chat_history",
-    )
+    query_embedding = None
+    if cache is not None and first_turn:
+        try:
+            with metrics.timed("semantic_cache_lookup"):
+                query_embedding = await get_embeddings().aembed_query(message)
+                cached = await cache.alookup(query_embedding)
+            metrics.increment("semantic_cache_lookups", result="hit" if cached else "miss")
+            if cached is not None:
+                await history.aadd_messages([
+                    HumanMessage(content=message),
+                    AIMessage(content=cached.answer),
+                ])
+                yield "sources", describe_sources(
+                    await get_async_vector_search().aget_by_ids(cached.source_ids)
+                )
+                metrics.observe_since("first_token", started)
+                for content in cached.iter_chunks(settings.SEMANTIC_CACHE_CHUNK_SIZE):
+                    yield "token", content
+                    await asyncio.sleep(0)
+                yield finish(cache_hit=True)
+                return
+        except Exception as e:
+            print(f"Warning: Semantic cache lookup failed: {e}")
+            query_embedding = None
+    
+    coalesce = settings.SINGLE_FLIGHT_ENABLED and first_turn
+    if coalesce:
+        # Concurrent identical questions share one upstream generation; every
+        # subscriber writes its own session's history below
+        flight, leader = _single_flight.join(
+            canonical_question(message),
+            lambda: generate_answer(HumanMessage(content=message)),
+        )
+        metrics.increment("single_flight", role="leader" if leader else "follower")
+        upstream = _single_flight.subscribe(flight)
+    else:
+        leader = True
+        upstream = generate_answer(
+            HumanMessage(content=message),
+            session_id,
+            shed_contextualize=slot is not None and slot.shed_contextualize,
+        )
+    
+    retrieved_docs = []
+    answer_parts = []
+    # Closed right away if the client leaves, so the generation is cancelled
+    async with aclosing(upstream):
+        async for event, data in upstream:
+            if event == "sources":
+                retrieved_docs = data
+                yield "sources", describe_sources(data)
+                continue
+            if not answer_parts:
+                metrics.observe_since("first_token", started)
+            answer_parts.append(data)
+            yield event, data
+    
+    if coalesce and answer_parts:
+        try:
+            await history.aadd_messages([
+                HumanMessage(content=message),
+                AIMessage(content="".join(answer_parts)),
+            ])
+        except Exception as e:
+            print(f"Warning: Could not save chat history: {e}")
     
-    # Stream with optimized chunk extraction
-    async for chunk in chain_with_history.astream(
-        {"input": HumanMessage(content=message)},
-        config={"configurable": {"session_id": session_id}}
-    ):
-        # Simplified content extraction for faster processing
-        if hasattr(chunk, 'content') and chunk.content:
-            content = chunk.content
-            # Handle list content
-            if isinstance(content, list):
-                content = "".join(str(item) for item in content)
-            elif not isinstance(content, str):
-                content = str(content)
-            
-            # Yield immediately for lower latency
-            if content:
-                yield content
+    # A shared answer is stored once, by the first subscriber to finish it
+    # (the leader's client may have left while followers kept the flight going)
+    if query_embedding is not None and answer_parts and (not coalesce or flight.claim()):
+        try:
+            await cache.astore(
+                query_embedding,
+                message,
+                "".join(answer_parts),
+                [doc.id for doc in retrieved_docs if doc.id],
+            )
+        except Exception as e:
+            print(f"Warning: Could not store answer in semantic cache: {e}")
+    
+    yield finish(cache_hit=False, coalesced=coalesce and not leader)
+
+async def generate_answer(
+    question, session_id: str | None = None, shed_contextualize: bool = False
+) -> AsyncIterator[Event]:
+    """
+    Run the RAG chain: ("sources", docs) once retrieval is done, then ("token", text).
+    With a session the chain reads and saves its history; without one it answers
+    a first-turn question and saving is left to the caller. shed_contextualize
+    retrieves on the raw question instead of rewriting follow-ups (overload).
+    """
+    if session_id is not None:
+        # Built once per process; history leases a pooled connection per read/write
+        chain = get_chat_chain()
+        inputs = {"input": question}
+    else:
+        chain = get_rag_chain()
+        inputs = {"input": question, "chat_history": []}
+    
+    # The chain runs in a task so the sources event can go out as soon as
+    # retrieval finishes, while the model is still producing its first token
+    events: asyncio.Queue = asyncio.Queue()
+    
+    async def run_chain():
+        try:
+            async for chunk in chain.astream(
+                inputs,
+                config={"configurable": {
+                    "session_id": session_id,
+                    "shed_contextualize": shed_contextualize,
+                    "on_sources": lambda docs: events.put_nowait(("sources", docs)),
+                }},
+            ):
+                content = chunk_text(chunk)
+                if content:
+                    events.put_nowait(("token", content))
+            events.put_nowait(None)
+        except Exception as e:
+            events.put_nowait(e)
+    
+    task = asyncio.create_task(run_chain())
+    generation_started = time.perf_counter()
+    generated = False
+    try:
+        while True:
+            item = await events.get()
+            if item is None:
+                break
+            if isinstance(item, Exception):
+                raise item
+            if item[0] == "sources":
+                generation_started = time.perf_counter()
+            elif not generated:
+                # Model time to first token, after retrieval and reranking
+                metrics.observe_since("llm_first_token", generation_started)
+                generated = True
+            yield item
+    finally:
+        if not task.done():
+            task.cancel()
+    if generated:
+        metrics.observe_since("generation", generation_started)
+
+def reserve_chat(session_id: str) -> Reservation:
+    """Admission for a /chat request as it arrives: a slot or queue position, else 429"""
+    reservation = _admission.try_admit(session_id)
+    if reservation is None:
+        # Queue full: reject now rather than make every stream slower
+        retry_after = _admission.reject()
+        metrics.increment("chat_rejected")
+        raise HTTPException(
+            status_code=429,
+            detail="Too many requests in progress, try again shortly",
+            headers={"Retry-After": str(retry_after)},
+        )
+    return reservation
+
+async def admitted_chat_events(
+    message: str, reservation: Reservation, trace_id: str | None = None
+) -> AsyncIterator[Event]:
+    """generate_chat_events once the reservation's slot is granted"""
+    async with _admission.slot(reservation) as slot:
+        async for event in generate_chat_events(message, reservation.session_id, trace_id, slot):
+            yield event
+
+class AdmittedStreamingResponse(StreamingResponse):
+    """Releases the admission reservation when the response ends, even if the stream never started"""
+
+    def __init__(self, content: AsyncIterator[str], reservation: Reservation, **kwargs):
+        super().__init__(content, **kwargs)
+        self.reservation = reservation
+
+    async def __call__(self, scope, receive, send) -> None:
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            self.reservation.release()
+
+async def track_stream(chunks: AsyncIterator[str]) -> AsyncIterator[str]:
+    """Count the response as an in-flight stream until it ends or the client leaves"""
+    with metrics.in_flight_stream():
+        async for chunk in chunks:
+            yield chunk
 
 @app.post("/chat")
-async def chat_endpoint(request: ChatRequest):
-    return StreamingResponse(
-        generate_chat_response(request.message, request.session_id),
-        media_type="text/plain"
+async def chat_endpoint(request: ChatRequest, http_request: Request):
+    stream_format = request.format or negotiate_format(http_request.headers.get("accept", ""))
+    metrics.increment("chat_requests", format=stream_format)
+    
+    # Reserved before the response is built, so concurrent arrivals count at once
+    reservation = reserve_chat(request.session_id)
+    
+    # Opt-in per-request trace: stage timings are logged and kept under /debug/traces/{id}
+    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    trace_id = None
+    if http_request.headers.get(TRACE_HEADER, "").lower() in ("1", "true", "yes"):
+        trace_id = uuid.uuid4().hex
+        headers["X-Trace-Id"] = trace_id
+    
+    events = admitted_chat_events(request.message, reservation, trace_id)
+    if stream_format != "text":
+        events = coalesce_tokens(
+            events,
+            max_chars=settings.STREAM_COALESCE_CHARS,
+            max_delay=settings.STREAM_COALESCE_MS / 1000,
+        )
+    return AdmittedStreamingResponse(
+        track_stream(encode_events(events, stream_format)),
+        reservation,
+        media_type=MEDIA_TYPES[stream_format],
+        # Keep proxies from buffering the event stream
+        headers=headers,
     )
 
+@app.get("/metrics")
+def metrics_endpoint():
+    """Prometheus metrics: stage latency quantiles, pool, caches, in-flight streams"""
+    from db import get_pool_stats
+    from rag_chain import get_embeddings, get_contextualizer, get_history_writer, get_reranker
+    
+    gauges = {}
+    for name, value in get_pool_stats().items():
+        if isinstance(value, (int, float)):
+            gauges[f"db_pool_{name}"] = (f"Connection pool {name.replace('_', ' ')}", float(value))
+    embeddings = get_embeddings()
+    if hasattr(embeddings, "stats"):
+        stats = embeddings.stats()
+        lookups = stats["hits"] + stats["persistent_hits"] + stats["misses"]
+        gauges["embedding_cache_hit_ratio"] = (
+            "Embedding cache hits (memory or persistent) over lookups",
+            (stats["hits"] + stats["persistent_hits"]) / lookups if lookups else 0.0,
+        )
+        gauges["embedding_cache_size"] = ("Embeddings held in memory", stats["size"])
+    rewrites = get_contextualizer().stats()
+    resolved = rewrites["skipped"] + rewrites["cache_hits"]
+    gauges["rewrite_skip_ratio"] = (
+        "Follow-up questions answered without the rewrite LLM call",
+        resolved / (resolved + rewrites["rewrites"]) if resolved + rewrites["rewrites"] else 0.0,
+    )
+    rerank = get_reranker().stats()
+    gauges["rerank_context_tokens_avg"] = ("Average estimated context tokens after packing", rerank["avg_tokens_out"])
+    gauges["chat_active"] = ("Answers being generated", _admission.active)
+    gauges["chat_queued"] = ("Requests waiting for a generation slot", _admission.queued)
+    gauges["history_write_queue"] = ("Chat messages waiting to be written", get_history_writer().stats()["queued"])
+    return PlainTextResponse(
+        metrics.render_prometheus(gauges),
+        media_type="text/plain; version=0.0.4",
+    )
+
+@app.get("/debug/traces/{trace_id}")
+def get_trace(trace_id: str):
+    """Stage timings of a request sent with the X-Trace header"""
+    trace = metrics.get_trace(trace_id)
+    if trace is None:
+        raise HTTPException(status_code=404, detail="Unknown trace id")
+    return trace
+
+@app.get("/debug/latency")
+def latency():
+    """p50/p95/p99 per stage, as JSON"""
+    return metrics.latency_snapshot()
+
 @app.get("/health")
 def health_check():
+    """Liveness: the process is up and serving HTTP"""
     return {"status": "ok"}
 
+@app.get("/ready")
+def readiness_check():
+    """
+    Readiness: 200 once this worker's startup (pool, warm-up) has succeeded,
+    503 before that, if it failed (errors in the body) and after shutdown has begun
+    """
+    from db import get_pool_stats
+    body = {
+        "status": "ready" if _ready else "unavailable",
+        "pid": os.getpid(),
+        "pool_open": get_pool_stats()["open"],
+        **_startup_timings,
+    }
+    if not _ready:
+        return JSONResponse(body, status_code=503)
+    return body
+
 @app.get("/debug/check-docs")
 async def check_documents():
     """Debug endpoint to check if documents are in the vector store"""
-    from rag_chain import get_vector_store
+    from rag_chain import get_async_vector_search
     
-    vector_store = get_vector_store()
+    vector_search = get_async_vector_search()
     # Try to retrieve some documents
     try:
-        test_docs = vector_store.similarity_search("quantum computing", k=1)
+        test_docs = await vector_search.asimilarity_search("quantum computing", k=1)
         return {
             "status": "ok",
             "documents_found": len(test_docs) > 0,
@@ -135,23 +468,61 @@ async def check_documents():
             "error": str(e)
         }
 
+@app.get("/debug/pool-stats")
+def pool_stats():
+    """Connection pool usage: in-use, waiting and wait time"""
+    from db import get_pool_stats
+    return get_pool_stats()
+
+@app.get("/debug/cache-stats")
+def cache_stats():
+    """Embedding cache, question-rewrite and single-flight counters"""
+    from rag_chain import get_embeddings, get_contextualizer
+    embeddings = get_embeddings()
+    return {
+        "embeddings": embeddings.stats() if hasattr(embeddings, "stats") else None,
+        "rewrites": get_contextualizer().stats(),
+        "single_flight": _single_flight.stats(),
+    }
+
+@app.get("/debug/admission-stats")
+def admission_stats():
+    """Generation slots in use, queue depth, rejections and shed rewrites"""
+    return _admission.stats()
+
+@app.get("/debug/rerank-stats")
+def rerank_stats():
+    """Reranking stage latency and prompt tokens before/after packing"""
+    from rag_chain import get_reranker
+    return get_reranker().stats()
+
 @app.get("/chat/history/{session_id}")
-async def get_chat_history(session_id: str):
-    """Get chat history for a session"""
+async def get_chat_history(
+    session_id: str,
+    limit: int | None = Query(None, ge=1, le=500),
+    before: int | None = None,
+):
+    """
+    Get chat history for a session, newest page first.
+    Pass the returned next_cursor as ``before`` to load older messages.
+    """
     try:
-        history = await get_session_history(session_id)
-        messages = await history.aget_messages()
+        history = get_session_history(session_id)
+        page, next_cursor = await history.aget_page(
+            limit or settings.HISTORY_PAGE_SIZE, before
+        )
         
         # Convert messages to simple format
         history_list = []
-        for msg in messages:
+        for message_id, msg in page:
             if hasattr(msg, 'content'):
                 role = 'user' if msg.__class__.__name__ == 'HumanMessage' else 'assistant'
                 history_list.append({
+                    "id": message_id,
                     "role": role,
                     "content": msg.content
                 })
         
-        return {"messages": history_list}
+        return {"messages": history_list, "next_cursor": next_cursor}
     except Exception as e:
-        return {"messages": [], "error": str(e)}
+        return {"messages": [], "next_cursor": None, "error": str(e)}
@@ -0,0 +1,172 @@
+"""
+Per-stage latency metrics and Prometheus text exposition.
+
+Stages (history load, contextualization, embedding, pgvector, first token,
+...) report their duration with ``observe``. Each stage keeps a sliding
+window of recent samples for p50/p95/p99, exposed as a Prometheus summary
+on /metrics, plus running totals.
+
+The durations of the current request are also collected in a per-request
+dict (a ContextVar set by ``start_request``), which feeds the stats event
+and trace logs. Tasks and executor threads started by the chain inherit the
+context, so they record into the same dict.
+"""
+
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+QUANTILES = (0.5, 0.95, 0.99)
+
+# Samples kept per stage for quantiles
+WINDOW_SIZE = 2048
+
+# Traces of requests sent with the trace header, for /debug/traces
+MAX_TRACES = 200
+
+_request_timings: ContextVar[Optional[Dict[str, float]]] = ContextVar("request_timings", default=None)
+
+class LatencySummary:
+    """Sliding-window quantiles plus running count and sum (seconds)"""
+
+    def __init__(self, window: int = WINDOW_SIZE):
+        self.samples: deque = deque(maxlen=window)
+        self.count = 0
+        self.total = 0.0
+
+    def observe(self, seconds: float) -> None:
+        self.samples.append(seconds)
+        self.count += 1
+        self.total += seconds
+
+    def quantiles(self) -> Dict[float, float]:
+        ordered = sorted(self.samples)
+        if not ordered:
+            return {q: 0.0 for q in QUANTILES}
+        return {q: ordered[min(int(q * len(ordered)), len(ordered) - 1)] for q in QUANTILES}
+
+_lock = threading.Lock()
+_stages: Dict[str, LatencySummary] = {}
+_counters: Dict[Tuple[str, Tuple[Tuple[str, str], ...]], float] = {}
+_in_flight = 0
+_traces: "OrderedDict[str, Dict]" = OrderedDict()
+
+def observe(stage: str, seconds: float) -> None:
+    """Record a stage duration globally and for the current request"""
+    with _lock:
+        _stages.setdefault(stage, LatencySummary()).observe(seconds)
+    timings = _request_timings.get()
+    if timings is not None:
+        timings[f"{stage}_ms"] = round(seconds * 1000, 1)
+
+def observe_since(stage: str, started: float) -> None:
+    """observe() with the time elapsed since a time.perf_counter() value"""
+    observe(stage, time.perf_counter() - started)
+
+@contextmanager
+def timed(stage: str) -> Iterator[None]:
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_since(stage, started)
+
+def start_request() -> Dict[str, float]:
+    """Begin collecting this request's stage timings (returns the live dict)"""
+    timings: Dict[str, float] = {}
+    _request_timings.set(timings)
+    return timings
+
+def increment(name: str, amount: float = 1.0, **labels: str) -> None:
+    key = (name, tuple(sorted(labels.items())))
+    with _lock:
+        _counters[key] = _counters.get(key, 0.0) + amount
+
+@contextmanager
+def in_flight_stream() -> Iterator[None]:
+    """Count a response stream as in flight while the block runs"""
+    global _in_flight
+    with _lock:
+        _in_flight += 1
+    try:
+        yield
+    finally:
+        with _lock:
+            _in_flight -= 1
+
+def record_trace(trace_id: str, trace: Dict) -> None:
+    with _lock:
+        _traces[trace_id] = trace
+        while len(_traces) > MAX_TRACES:
+            _traces.popitem(last=False)
+
+def get_trace(trace_id: str) -> Optional[Dict]:
+    return _traces.get(trace_id)
+
+def reset() -> None:
+    """Forget all samples, counters and traces (used between benchmark scenarios)"""
+    with _lock:
+        _stages.clear()
+        _counters.clear()
+        _traces.clear()
+
+def latency_snapshot() -> Dict[str, Dict[str, float]]:
+    """p50/p95/p99 (ms) and count per stage"""
+    with _lock:
+        stages = {stage: (summary.quantiles(), summary.count) for stage, summary in _stages.items()}
+    return {
+        stage: {
+            **{f"p{int(q * 100)}_ms": round(value * 1000, 1) for q, value in quantiles.items()},
+            "count": count,
+        }
+        for stage, (quantiles, count) in sorted(stages.items())
+    }
+
+def _format_labels(labels: Iterable[Tuple[str, str]]) -> str:
+    pairs = [f'{key}="{str(value)}"' for key, value in labels]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _family(name: str, kind: str, description: str, samples: List[Tuple[str, Iterable, float]]) -> List[str]:
+    lines = [f"# HELP {name} {description}", f"# TYPE {name} {kind}"]
+    for suffix, labels, value in samples:
+        lines.append(f"{name}{suffix}{_format_labels(labels)} {value}")
+    return lines
+
+def render_prometheus(gauges: Dict[str, Tuple[str, float]]) -> str:
+    """
+    Prometheus text format: stage summaries, counters, the in-flight stream
+    gauge and caller-supplied gauges ({name: (help, value)}).
+    """
+    with _lock:
+        stages = {stage: (summary.quantiles(), summary.count, summary.total) for stage, summary in _stages.items()}
+        counters = dict(_counters)
+        in_flight = _in_flight
+
+    lines: List[str] = []
+    samples = []
+    for stage, (quantiles, count, total) in sorted(stages.items()):
+        for q, value in quantiles.items():
+            samples.append(("", (("stage", stage), ("quantile", str(q))), round(value, 6)))
+        samples.append(("_sum", (("stage", stage),), round(total, 6)))
+        samples.append(("_count", (("stage", stage),), count))
+    lines += _family(
+        "thesis_chatbot_stage_duration_seconds", "summary",
+        "Latency per pipeline stage (quantiles over the last samples)", samples,
+    )
+
+    by_name: Dict[str, List] = {}
+    for (name, labels), value in sorted(counters.items()):
+        by_name.setdefault(name, []).append(("", labels, value))
+    for name, counter_samples in by_name.items():
+        lines += _family(f"thesis_chatbot_{name}_total", "counter", name.replace("_", " "), counter_samples)
+
+    lines += _family(
+        "thesis_chatbot_streams_in_flight", "gauge", "Chat responses currently streaming",
+        [("", (), in_flight)],
+    )
+    for name, (description, value) in gauges.items():
+        lines += _family(f"thesis_chatbot_{name}", "gauge", description, [("", (), value)])
+    return "\n".join(lines) + "\n"
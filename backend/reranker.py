@@ -0,0 +1,211 @@
+"""
+Reranking and context packing between retrieval and the QA prompt.
+
+Retrieved chunks are rescored against the question, chunks repeating text
+already kept (the splitter's 200-character overlap, or near-identical
+chunks) are trimmed or dropped, and the best chunks are packed into
+CONTEXT_TOKEN_BUDGET so the prompt, and Gemini's time to first token, stay
+small.
+
+Scorers are pluggable: a BM25 scorer over the candidates runs anywhere, and
+a CPU cross-encoder is used when sentence-transformers is installed.
+"""
+
+import math
+import re
+import threading
+import time
+from collections import Counter
+from typing import Dict, List, Optional, Sequence
+from langchain_core.documents import Document
+from config import get_settings
+
+settings = get_settings()
+
+# Rough characters per Gemini token for Portuguese/English prose
+CHARS_PER_TOKEN = 4
+
+# Shortest shared prefix/suffix treated as splitter overlap
+MIN_OVERLAP_CHARS = 40
+
+def estimate_tokens(text: str) -> int:
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+def tokenize(text: str) -> List[str]:
+    return re.findall(r"\w+", text.lower())
+
+class LexicalScorer:
+    """BM25 over the candidate set; cheap, but a weak signal on its own"""
+
+    # Scores are fused with the retrieval order instead of replacing it
+    standalone = False
+
+    def __init__(self, k1: float = 1.2, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+
+    def score(self, query: str, docs: Sequence[Document]) -> List[float]:
+        doc_terms = [Counter(tokenize(doc.page_content)) for doc in docs]
+        lengths = [sum(terms.values()) for terms in doc_terms]
+        avg_length = (sum(lengths) / len(lengths)) if lengths else 0.0
+        query_terms = set(tokenize(query))
+        scores = []
+        for terms, length in zip(doc_terms, lengths):
+            total = 0.0
+            for term in query_terms:
+                frequency = terms.get(term, 0)
+                if not frequency:
+                    continue
+                containing = sum(1 for other in doc_terms if term in other)
+                idf = math.log(1 + (len(docs) - containing + 0.5) / (containing + 0.5))
+                norm = self.k1 * (1 - self.b + self.b * length / (avg_length or 1))
+                total += idf * frequency * (self.k1 + 1) / (frequency + norm)
+            scores.append(total)
+        return scores
+
+class CrossEncoderScorer:
+    """sentence-transformers CrossEncoder on CPU (optional dependency)"""
+
+    standalone = True
+
+    def __init__(self, model_name: str):
+        from sentence_transformers import CrossEncoder
+        self.model = CrossEncoder(model_name, device="cpu")
+        # predict() is not safe to call from several threads at once
+        self._lock = threading.Lock()
+
+    def score(self, query: str, docs: Sequence[Document]) -> List[float]:
+        with self._lock:
+            scores = self.model.predict([(query, doc.page_content) for doc in docs])
+        return [float(score) for score in scores]
+
+def get_scorer(name: str, model_name: str):
+    """Build the scorer selected by RERANKER; None disables rescoring"""
+    if name == "none":
+        return None
+    if name == "lexical":
+        return LexicalScorer()
+    if name == "cross-encoder":
+        try:
+            return CrossEncoderScorer(model_name)
+        except ImportError:
+            print("Warning: sentence-transformers is not installed, using the lexical reranker")
+            return LexicalScorer()
+    raise ValueError(f"Unknown RERANKER: {name}")
+
+def overlap_length(previous: str, text: str, max_overlap: int) -> int:
+    """Length of the longest suffix of `previous` that `text` starts with"""
+    for size in range(min(len(previous), len(text), max_overlap), MIN_OVERLAP_CHARS - 1, -1):
+        if previous.endswith(text[:size]):
+            return size
+    return 0
+
+def shingles(text: str, size: int = 3) -> set:
+    words = tokenize(text)
+    return {tuple(words[i:i + size]) for i in range(max(len(words) - size + 1, 1))}
+
+class Reranker:
+    """Score, deduplicate and pack retrieved chunks into a token budget"""
+
+    def __init__(
+        self,
+        scorer=None,
+        token_budget: int = 2000,
+        duplicate_threshold: float = 0.8,
+        max_overlap: int = 200,
+    ):
+        self.scorer = scorer
+        self.token_budget = token_budget
+        self.duplicate_threshold = duplicate_threshold
+        self.max_overlap = max_overlap
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.tokens_in = 0
+        self.tokens_out = 0
+        self.dropped = 0
+
+    def rank(self, query: str, docs: List[Document]) -> List[Document]:
+        """Order docs by the scorer (fused with retrieval order for weak scorers)"""
+        if self.scorer is None or len(docs) < 2:
+            return list(docs)
+        scores = self.scorer.score(query, docs)
+        by_score = sorted(range(len(docs)), key=lambda i: scores[i], reverse=True)
+        if self.scorer.standalone:
+            return [docs[i] for i in by_score]
+        fused: Dict[int, float] = {}
+        for ranking in (range(len(docs)), by_score):
+            for rank, i in enumerate(ranking, 1):
+                fused[i] = fused.get(i, 0.0) + 1.0 / (60 + rank)
+        return [docs[i] for i in sorted(fused, key=fused.get, reverse=True)]
+
+    def deduplicate(self, docs: List[Document]) -> List[Document]:
+        """Drop near-identical chunks and trim text repeated from a kept neighbour"""
+        kept: List[Document] = []
+        kept_shingles: List[set] = []
+        for doc in docs:
+            doc_shingles = shingles(doc.page_content)
+            if any(
+                len(doc_shingles & other) / max(len(doc_shingles | other), 1) >= self.duplicate_threshold
+                for other in kept_shingles
+            ):
+                continue
+            text = doc.page_content
+            for other in kept:
+                if other.metadata.get("source") != doc.metadata.get("source"):
+                    continue
+                # Chunk continuing a kept one: drop the repeated prefix
+                text = text[overlap_length(other.page_content, text, self.max_overlap):]
+                # Chunk preceding a kept one: drop the repeated suffix
+                text = text[:len(text) - overlap_length(text, other.page_content, self.max_overlap)]
+            if text.strip():
+                kept.append(doc if text == doc.page_content else Document(
+                    id=doc.id, page_content=text, metadata=doc.metadata
+                ))
+                kept_shingles.append(doc_shingles)
+        return kept
+
+    def pack(self, docs: List[Document]) -> List[Document]:
+        """Best chunks that fit in the token budget (always at least one)"""
+        packed, used = [], 0
+        for doc in docs:
+            tokens = estimate_tokens(doc.page_content)
+            if packed and self.token_budget > 0 and used + tokens > self.token_budget:
+                continue
+            packed.append(doc)
+            used += tokens
+        return packed
+
+    def __call__(self, query: str, docs: List[Document]) -> List[Document]:
+        start = time.perf_counter()
+        packed = self.pack(self.deduplicate(self.rank(query, docs)))
+        elapsed = (time.perf_counter() - start) * 1000
+        with self._lock:
+            self.calls += 1
+            self.total_ms += elapsed
+            self.max_ms = max(self.max_ms, elapsed)
+            self.tokens_in += sum(estimate_tokens(doc.page_content) for doc in docs)
+            self.tokens_out += sum(estimate_tokens(doc.page_content) for doc in packed)
+            self.dropped += len(docs) - len(packed)
+        return packed
+
+    def stats(self) -> Dict[str, float]:
+        calls = self.calls or 1
+        return {
+            "scorer": type(self.scorer).__name__ if self.scorer else None,
+            "calls": self.calls,
+            "avg_ms": round(self.total_ms / calls, 3),
+            "max_ms": round(self.max_ms, 3),
+            "avg_tokens_in": round(self.tokens_in / calls, 1),
+            "avg_tokens_out": round(self.tokens_out / calls, 1),
+            "chunks_dropped": self.dropped,
+        }
+
+def build_reranker(scorer_name: Optional[str] = None) -> Reranker:
+    """Reranker configured from settings"""
+    return Reranker(
+        scorer=get_scorer(scorer_name or settings.RERANKER, settings.RERANKER_MODEL),
+        token_budget=settings.CONTEXT_TOKEN_BUDGET,
+        duplicate_threshold=settings.RERANK_DUPLICATE_THRESHOLD,
+    )
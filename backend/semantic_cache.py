@@ -0,0 +1,128 @@
+"""
+Semantic answer cache stored in pgvector.
+
+First-turn questions are looked up by embedding similarity; a close enough
+match within the TTL replays the stored answer instead of running
+retrieval and generation. Entries are evicted least-recently-hit first once
+the table grows past max_entries, and the whole table is cleared whenever
+ingest.py changes the corpus.
+
+The table is kept small by eviction, so lookups are an exact scan rather
+than an ANN index.
+"""
+
+from dataclasses import dataclass, field
+from typing import Iterator, List, Optional, Sequence
+import psycopg
+from psycopg import sql
+from psycopg.types.json import Jsonb
+from db import lease_connection, to_vector_literal
+
+@dataclass
+class CachedAnswer:
+    question: str
+    answer: str
+    similarity: float
+    source_ids: List[str] = field(default_factory=list)
+
+    def iter_chunks(self, chunk_size: int) -> Iterator[str]:
+        """Split the stored answer into stream-sized pieces"""
+        for start in range(0, len(self.answer), chunk_size):
+            yield self.answer[start:start + chunk_size]
+
+class SemanticCache:
+    """Similarity-keyed (question embedding -> answer) cache with TTL and LRU eviction"""
+
+    def __init__(
+        self,
+        table_name: str = "semantic_cache",
+        threshold: float = 0.95,
+        ttl_seconds: int = 86400,
+        max_entries: int = 1000,
+    ):
+        self.table_name = table_name
+        self.threshold = threshold
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+
+    @staticmethod
+    async def acreate_table(table_name: str = "semantic_cache") -> None:
+        async with lease_connection() as conn:
+            await conn.execute("CREATE EXTENSION IF NOT EXISTS vector")
+            await conn.execute(
+                sql.SQL(
+                    "CREATE TABLE IF NOT EXISTS {table} ("
+                    "id SERIAL PRIMARY KEY, "
+                    "embedding vector NOT NULL, "
+                    "question TEXT NOT NULL, "
+                    "answer TEXT NOT NULL, "
+                    "source_ids JSONB NOT NULL DEFAULT '[]', "
+                    "hits INTEGER NOT NULL DEFAULT 0, "
+                    "created_at TIMESTAMPTZ NOT NULL DEFAULT now(), "
+                    "last_hit_at TIMESTAMPTZ NOT NULL DEFAULT now())"
+                ).format(table=sql.Identifier(table_name))
+            )
+
+    async def alookup(self, embedding: Sequence[float]) -> Optional[CachedAnswer]:
+        """Return the closest fresh answer above the similarity threshold and mark it used"""
+        query = sql.SQL(
+            "SELECT id, question, answer, source_ids, 1 - (embedding <=> %(embedding)s::vector) "
+            "FROM {table} "
+            "WHERE created_at > now() - make_interval(secs => %(ttl)s) "
+            "ORDER BY embedding <=> %(embedding)s::vector "
+            "LIMIT 1"
+        ).format(table=sql.Identifier(self.table_name))
+        params = {"embedding": to_vector_literal(embedding), "ttl": self.ttl_seconds}
+        async with lease_connection() as conn:
+            async with conn.cursor() as cursor:
+                await cursor.execute(query, params)
+                row = await cursor.fetchone()
+                if row is None or row[4] < self.threshold:
+                    return None
+                await cursor.execute(
+                    sql.SQL(
+                        "UPDATE {table} SET hits = hits + 1, last_hit_at = now() WHERE id = %s"
+                    ).format(table=sql.Identifier(self.table_name)),
+                    (row[0],),
+                )
+        return CachedAnswer(
+            question=row[1], answer=row[2], source_ids=row[3], similarity=row[4]
+        )
+
+    async def astore(
+        self,
+        embedding: Sequence[float],
+        question: str,
+        answer: str,
+        source_ids: Sequence[str],
+    ) -> None:
+        """Insert an answer, then drop expired rows and the least recently hit overflow"""
+        table = sql.Identifier(self.table_name)
+        async with lease_connection() as conn:
+            await conn.execute(
+                sql.SQL(
+                    "INSERT INTO {table} (embedding, question, answer, source_ids) "
+                    "VALUES (%s::vector, %s, %s, %s)"
+                ).format(table=table),
+                (to_vector_literal(embedding), question, answer, Jsonb(list(source_ids))),
+            )
+            await conn.execute(
+                sql.SQL(
+                    "DELETE FROM {table} WHERE created_at <= now() - make_interval(secs => %s) "
+                    "OR id IN (SELECT id FROM {table} ORDER BY last_hit_at DESC OFFSET %s)"
+                ).format(table=table),
+                (self.ttl_seconds, self.max_entries),
+            )
+
+    async def aclear(self) -> None:
+        async with lease_connection() as conn:
+            await conn.execute(
+                sql.SQL("TRUNCATE {table}").format(table=sql.Identifier(self.table_name))
+            )
+
+def invalidate_semantic_cache(conninfo: str, table_name: str = "semantic_cache") -> None:
+    """Drop every cached answer (sync; used by ingest.py after the corpus changes)"""
+    with psycopg.connect(conninfo) as conn:
+        exists = conn.execute("SELECT to_regclass(%s)", (table_name,)).fetchone()[0]
+        if exists:
+            conn.execute(sql.SQL("TRUNCATE {table}").format(table=sql.Identifier(table_name)))
@@ -0,0 +1,128 @@
+"""
+Single-flight coalescing of identical in-flight questions.
+
+When many sessions ask the same first-turn question at once, only the first
+request (the leader) runs retrieval and generation. Requests with the same
+key arriving while it runs (followers) subscribe to its event stream: they
+get the events produced so far, then follow live. The upstream keeps running
+as long as one subscriber is left, and is cancelled when the last one leaves.
+
+Flights are keyed by the normalized question and forgotten once finished;
+later repeats are served by the semantic cache instead. Storing the answer
+there is claimed by whichever subscriber finishes first, so it doesn't
+depend on the leader's client staying connected.
+"""
+
+import asyncio
+from typing import AsyncIterator, Callable, Dict, List, Optional, Tuple
+from streaming import Event
+
+class Flight:
+    """One upstream generation and the events it has produced so far"""
+
+    def __init__(self, key: str):
+        self.key = key
+        self.events: List[Event] = []
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self.subscribers = 0
+        self.claimed = False
+        self.task: Optional[asyncio.Task] = None
+        self._changed = asyncio.Event()
+
+    def _notify(self) -> None:
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    def publish(self, event: Event) -> None:
+        self.events.append(event)
+        self._notify()
+
+    def finish(self, error: Optional[BaseException] = None) -> None:
+        self.done = True
+        self.error = error
+        self._notify()
+
+    def claim(self) -> bool:
+        """True for the first caller only: who acts once on the shared result"""
+        if self.claimed:
+            return False
+        self.claimed = True
+        return True
+
+    async def replay(self) -> AsyncIterator[Event]:
+        """Every event from the start, then live ones until the flight ends"""
+        position = 0
+        while True:
+            while position < len(self.events):
+                yield self.events[position]
+                position += 1
+            if self.done:
+                if self.error is not None:
+                    raise self.error
+                return
+            await self._changed.wait()
+
+class SingleFlight:
+    """Registry of in-flight generations by key"""
+
+    def __init__(self):
+        self._flights: Dict[str, Flight] = {}
+        self.leaders = 0
+        self.followers = 0
+        self.cancelled = 0
+
+    def join(self, key: str, produce: Callable[[], AsyncIterator[Event]]) -> Tuple[Flight, bool]:
+        """The running flight for `key`, or a new one running `produce()`; True if new"""
+        flight = self._flights.get(key)
+        leader = flight is None
+        if not leader:
+            self.followers += 1
+        else:
+            flight = Flight(key)
+            self._flights[key] = flight
+            # Runs in a copy of the leader's context, so stage timings land in its stats
+            flight.task = asyncio.create_task(self._run(flight, produce))
+            self.leaders += 1
+        # Counted here, not when iteration starts, so the flight can't be cancelled in between
+        flight.subscribers += 1
+        return flight, leader
+
+    async def _run(self, flight: Flight, produce: Callable[[], AsyncIterator[Event]]) -> None:
+        try:
+            async for event in produce():
+                flight.publish(event)
+        except asyncio.CancelledError:
+            flight.finish(asyncio.CancelledError())
+            raise
+        except Exception as e:
+            flight.finish(e)
+        else:
+            flight.finish()
+        finally:
+            self._forget(flight)
+
+    def _forget(self, flight: Flight) -> None:
+        if self._flights.get(flight.key) is flight:
+            del self._flights[flight.key]
+
+    async def subscribe(self, flight: Flight) -> AsyncIterator[Event]:
+        """Stream a joined flight's events; the last subscriber to leave cancels it"""
+        try:
+            async for event in flight.replay():
+                yield event
+        finally:
+            flight.subscribers -= 1
+            if flight.subscribers == 0 and not flight.done:
+                self._forget(flight)
+                flight.task.cancel()
+                self.cancelled += 1
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "in_flight": len(self._flights),
+            "subscribers": sum(flight.subscribers for flight in self._flights.values()),
+            "leaders": self.leaders,
+            "followers": self.followers,
+            "cancelled": self.cancelled,
+        }
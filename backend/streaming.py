@@ -0,0 +1,134 @@
+"""
+Wire formats for /chat.
+
+generate_chat_events in main.py yields (event, data) tuples:
+
+- ``sources``: retrieved chunks (id, source file, page), sent before generation
+- ``token``: answer text
+- ``stats``: per-stage timings, sent last
+
+``text`` streams only the token text (the original protocol), ``sse`` and
+``ndjson`` carry every event, with tokens coalesced into small batches.
+"""
+
+import asyncio
+import json
+import time
+from typing import Any, AsyncIterable, AsyncIterator, Dict, List, Tuple
+from langchain_core.documents import Document
+
+Event = Tuple[str, Any]
+
+MEDIA_TYPES = {
+    "text": "text/plain",
+    "sse": "text/event-stream",
+    "ndjson": "application/x-ndjson",
+}
+
+def negotiate_format(accept: str) -> str:
+    """Stream format from the Accept header when the request doesn't name one"""
+    if "text/event-stream" in accept:
+        return "sse"
+    if "application/x-ndjson" in accept:
+        return "ndjson"
+    return "text"
+
+def chunk_text(chunk: Any) -> str:
+    """Text of a streamed model chunk (content may be a list of parts)"""
+    content = getattr(chunk, "content", None)
+    if not content:
+        return ""
+    if isinstance(content, str):
+        return content
+    if isinstance(content, list):
+        return "".join(
+            part.get("text", "") if isinstance(part, dict) else str(part) for part in content
+        )
+    return str(content)
+
+def describe_sources(docs: List[Document]) -> List[Dict[str, Any]]:
+    """Chunk ids with their file and 1-based page number for the sources event"""
+    sources = []
+    for doc in docs:
+        page = doc.metadata.get("page")
+        sources.append({
+            "id": doc.id,
+            "source": doc.metadata.get("source"),
+            "page": page + 1 if isinstance(page, int) else page,
+            "is_thesis": bool(doc.metadata.get("is_thesis")),
+        })
+    return sources
+
+async def coalesce_tokens(
+    events: AsyncIterable[Event], max_chars: int = 64, max_delay: float = 0.05
+) -> AsyncIterator[Event]:
+    """
+    Merge consecutive token events until max_chars have accumulated or the
+    oldest pending token is max_delay seconds old; any other event flushes the
+    pending text first. The delay runs on a timer, so a partial batch still goes
+    out when the source stalls (e.g. the model pauses mid-answer).
+    """
+    # The source runs in a task feeding a queue: timing out a queue read is
+    # harmless, while cancelling the source's own __anext__ would abort it
+    queue: asyncio.Queue = asyncio.Queue()
+    
+    async def pump():
+        try:
+            async for item in events:
+                queue.put_nowait(item)
+            queue.put_nowait(None)
+        except Exception as e:
+            queue.put_nowait(e)
+    
+    task = asyncio.create_task(pump())
+    buffer: List[str] = []
+    size = 0
+    deadline = 0.0
+    try:
+        while True:
+            if buffer:
+                try:
+                    item = await asyncio.wait_for(queue.get(), max(deadline - time.monotonic(), 0))
+                except asyncio.TimeoutError:
+                    yield "token", "".join(buffer)
+                    buffer, size = [], 0
+                    continue
+            else:
+                item = await queue.get()
+            if item is None:
+                break
+            if isinstance(item, Exception):
+                raise item
+            event, data = item
+            if event != "token":
+                if buffer:
+                    yield "token", "".join(buffer)
+                    buffer, size = [], 0
+                yield event, data
+                continue
+            if not buffer:
+                deadline = time.monotonic() + max_delay
+            buffer.append(data)
+            size += len(data)
+            if size >= max_chars or time.monotonic() >= deadline:
+                yield "token", "".join(buffer)
+                buffer, size = [], 0
+        if buffer:
+            yield "token", "".join(buffer)
+    finally:
+        if not task.done():
+            task.cancel()
+
+async def encode_events(events: AsyncIterable[Event], stream_format: str) -> AsyncIterator[str]:
+    """Serialize events for the requested stream format"""
+    if stream_format == "text":
+        async for event, data in events:
+            if event == "token":
+                yield data
+        return
+
+    async for event, data in events:
+        if stream_format == "sse":
+            yield f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+        else:
+            yield json.dumps({"event": event, "data": data}, ensure_ascii=False) + "\n"
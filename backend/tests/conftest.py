@@ -0,0 +1,36 @@
+"""
+Shared fixtures. Tests import the backend modules directly (run from
+backend/: ``python -m pytest tests``); the ones marked with the ``postgres``
+fixture need the docker-compose database and are skipped without it.
+"""
+
+import asyncio
+import os
+import sys
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import db
+from config import get_settings
+
+@pytest.fixture(scope="session")
+def postgres():
+    """Skip the test when the configured Postgres isn't reachable"""
+    import psycopg
+    try:
+        psycopg.connect(get_settings().ASYNC_DATABASE_URL, connect_timeout=2).close()
+    except psycopg.OperationalError as e:
+        pytest.skip(f"Postgres not available: {e}")
+
+@pytest.fixture
+def run():
+    """Run a coroutine on a fresh event loop, closing the pool opened on it"""
+    def run_coroutine(coro):
+        async def wrapper():
+            try:
+                return await coro
+            finally:
+                await db.close_connection_pool()
+        return asyncio.run(wrapper())
+    return run_coroutine
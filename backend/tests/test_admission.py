@@ -0,0 +1,47 @@
+import asyncio
+import httpx
+import main
+from admission import AdmissionController
+
+async def slow_events(message, session_id, trace_id=None, slot=None):
+    await asyncio.sleep(0.05)
+    yield "token", "answer"
+
+async def burst(count):
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        responses = await asyncio.gather(*(
+            client.post("/chat", json={"message": "hi", "session_id": f"s{i}"})
+            for i in range(count)
+        ))
+    return [response.status_code for response in responses]
+
+def test_burst_beyond_queue_gets_429(monkeypatch, run):
+    admission = AdmissionController(max_concurrent=2, max_queue=3)
+    monkeypatch.setattr(main, "_admission", admission)
+    monkeypatch.setattr(main, "generate_chat_events", slow_events)
+    statuses = run(burst(10))
+    # 2 running + 3 queued; the rest arrive while those are still reserved
+    assert statuses.count(200) == 5
+    assert statuses.count(429) == 5
+    assert (admission.active, admission.queued, admission.rejected) == (0, 0, 5)
+
+def test_released_when_client_leaves_while_queued(run):
+    admission = AdmissionController(max_concurrent=1, max_queue=1)
+
+    async def scenario():
+        running = admission.try_admit("a")
+        queued = admission.try_admit("b")
+        assert admission.try_admit("c") is None
+
+        async def wait_for_turn():
+            async with admission.slot(queued):
+                pass
+        waiting = asyncio.create_task(wait_for_turn())
+        await asyncio.sleep(0)
+        waiting.cancel()
+        await asyncio.gather(waiting, return_exceptions=True)
+        running.release()
+        return admission.active, admission.queued
+
+    assert run(scenario()) == (0, 0)
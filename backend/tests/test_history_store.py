@@ -0,0 +1,54 @@
+import asyncio
+import uuid
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
+import history_store
+from history_store import PooledChatMessageHistory
+
+async def fake_summarizer(summary, messages):
+    folded = " ".join(message.content for message in messages)
+    return f"{summary} {folded}" if summary else folded
+
+async def add_and_refresh(history, message):
+    await history.aadd_messages([message])
+    await asyncio.gather(*history_store._summary_tasks)
+
+def test_messages_after_summarized_range_reach_the_prompt(postgres, run):
+    async def scenario():
+        await PooledChatMessageHistory.acreate_tables("chat_history")
+        history = PooledChatMessageHistory(
+            "chat_history", f"test-{uuid.uuid4().hex}", window=2, summarizer=fake_summarizer
+        )
+        try:
+            for i in range(1, 8):
+                message_type = HumanMessage if i % 2 else AIMessage
+                await add_and_refresh(history, message_type(content=f"m{i}"))
+            return await history.aget_messages()
+        finally:
+            await history.aclear()
+
+    messages = run(scenario())
+    # Refreshes fold two messages at a time, so the summary covers m1..m4;
+    # m5 is outside the window but not summarized yet, so it must still be sent
+    assert isinstance(messages[0], SystemMessage)
+    assert messages[0].content.endswith("m1 m2 m3 m4")
+    assert [message.content for message in messages[1:]] == ["m5", "m6", "m7"]
+
+def test_sync_methods_match_async(postgres, run):
+    session_id = f"test-{uuid.uuid4().hex}"
+    history = PooledChatMessageHistory("chat_history", session_id, window=2, summarizer=fake_summarizer)
+
+    async def summarized():
+        await PooledChatMessageHistory.acreate_tables("chat_history")
+        for i in range(1, 6):
+            await add_and_refresh(history, HumanMessage(content=f"m{i}"))
+        return await history.aget_messages()
+
+    expected = run(summarized())
+    try:
+        # Sync chain calls read and write through the same table and summary
+        assert [message.content for message in history.messages] == [message.content for message in expected]
+        history.add_messages([AIMessage(content="m6")])
+        assert [message.content for message in history.messages][-2:] == ["m5", "m6"]
+    finally:
+        history.clear()
+    assert history.messages == []
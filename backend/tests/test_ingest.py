@@ -0,0 +1,66 @@
+import asyncio
+import time
+from langchain_core.documents import Document
+from embedding_batcher import EmbeddingBatcher
+from ingest import WritePipeline, assign_chunk_ids, pipeline_depth
+
+def chunks(texts, **metadata):
+    return [
+        Document(page_content=text, metadata={"source": "paper.pdf", "page": page, **metadata})
+        for page, text in enumerate(texts)
+    ]
+
+def test_chunk_ids_ignore_page_and_pdf_metadata():
+    before = assign_chunk_ids("paper.pdf", chunks(["intro", "method", "results"], moddate="2024"))
+    # A page inserted in front shifts every page number; the PDF was re-saved too
+    after = assign_chunk_ids("paper.pdf", chunks(["new page", "intro", "method", "results"], moddate="2025"))
+    assert after[1:] == before
+
+def test_chunk_ids_change_with_text_and_file():
+    ids = assign_chunk_ids("paper.pdf", chunks(["intro", "method"]))
+    edited = assign_chunk_ids("paper.pdf", chunks(["intro", "method v2"]))
+    assert edited[0] == ids[0] and edited[1] != ids[1]
+    assert assign_chunk_ids("other.pdf", chunks(["intro", "method"])) != ids
+
+def test_repeated_chunks_get_distinct_ids():
+    ids = assign_chunk_ids("paper.pdf", chunks(["same", "same"]))
+    assert len(set(ids)) == 2
+
+class SlowEmbedder:
+    """Fake embed_fn that records how many requests were in flight at once"""
+
+    def __init__(self, seconds):
+        self.seconds = seconds
+        self.in_flight = self.peak = 0
+
+    async def __call__(self, texts):
+        self.in_flight += 1
+        self.peak = max(self.peak, self.in_flight)
+        await asyncio.sleep(self.seconds)
+        self.in_flight -= 1
+        return [[float(len(text))] for text in texts]
+
+def test_flushes_overlap_up_to_concurrency(run):
+    embedder = SlowEmbedder(0.05)
+    # Each flush is a single request: only overlapping flushes can fill the 4 slots
+    batcher = EmbeddingBatcher(embedder, batch_size=8, concurrency=4)
+    written, peaks_during_writes = [], []
+
+    def write(chunks, vectors, files):
+        peaks_during_writes.append(embedder.in_flight)
+        time.sleep(0.02)
+        written.append(([chunk.page_content for chunk in chunks], vectors, files))
+
+    async def ingest():
+        pipeline = WritePipeline(batcher, write, pipeline_depth(batcher, ingest_batch_size=8))
+        for flush in range(10):
+            texts = [f"chunk {flush}-{i}" for i in range(8)]
+            await pipeline.submit([Document(page_content=text) for text in texts], [(f"f{flush}", "", [], [])])
+        await pipeline.drain()
+
+    run(ingest())
+    assert embedder.peak == 4
+    # Later batches were still embedding while earlier ones were written
+    assert max(peaks_during_writes) > 0
+    assert [files[0][0] for _, _, files in written] == [f"f{flush}" for flush in range(10)]
+    assert all(vectors == [[float(len(text))] for text in texts] for texts, vectors, _ in written)
@@ -0,0 +1,75 @@
+import asyncio
+import pytest
+import main
+import rag_chain
+
+class FakeHistory:
+    async def ahas_messages(self):
+        return False
+
+    async def aadd_messages(self, messages):
+        pass
+
+class FakeEmbeddings:
+    async def aembed_query(self, text):
+        return [1.0, 0.0]
+
+class FakeCache:
+    def __init__(self):
+        self.stored = []
+
+    async def alookup(self, embedding):
+        return None
+
+    async def astore(self, embedding, question, answer, source_ids):
+        self.stored.append(answer)
+
+async def slow_answer(message):
+    yield "sources", []
+    for word in ("one ", "two ", "three"):
+        await asyncio.sleep(0.02)
+        yield "token", word
+
+@pytest.fixture
+def cache(monkeypatch):
+    cache = FakeCache()
+    monkeypatch.setattr(main.settings, "SEMANTIC_CACHE_ENABLED", True)
+    monkeypatch.setattr(main.settings, "SINGLE_FLIGHT_ENABLED", True)
+    monkeypatch.setattr(main, "_single_flight", main.SingleFlight())
+    monkeypatch.setattr(main, "get_session_history", lambda session_id: FakeHistory())
+    monkeypatch.setattr(main, "generate_answer", slow_answer)
+    monkeypatch.setattr(rag_chain, "get_semantic_cache", lambda: cache)
+    monkeypatch.setattr(rag_chain, "get_embeddings", lambda: FakeEmbeddings())
+    return cache
+
+def test_follower_caches_answer_when_leader_leaves(cache, run):
+    async def leader():
+        events = main.generate_chat_events("What is QAOA?", "leader")
+        # The client disconnects after the first token
+        async for event, _ in events:
+            if event == "token":
+                break
+        await events.aclose()
+
+    async def follower():
+        await asyncio.sleep(0.01)
+        return [event async for event in main.generate_chat_events("what is qaoa", "follower")]
+
+    async def both():
+        _, events = await asyncio.gather(leader(), follower())
+        return events
+
+    events = run(both())
+    assert "".join(data for event, data in events if event == "token") == "one two three"
+    assert events[-1][1]["coalesced"] is True
+    assert cache.stored == ["one two three"]
+
+def test_shared_answer_cached_once(cache, run):
+    async def ask(session_id):
+        return [event async for event in main.generate_chat_events("What is QAOA?", session_id)]
+
+    async def burst():
+        return await asyncio.gather(*(ask(f"s{i}") for i in range(3)))
+
+    run(burst())
+    assert cache.stored == ["one two three"]
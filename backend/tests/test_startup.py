@@ -0,0 +1,42 @@
+import json
+import main
+
+def ready_status():
+    response = main.readiness_check()
+    if isinstance(response, dict):
+        return 200, response
+    return response.status_code, json.loads(response.body)
+
+def prepare(monkeypatch, warm_up):
+    monkeypatch.setattr(main, "_ready", False)
+    monkeypatch.setattr(main, "_startup_timings", {})
+    monkeypatch.setattr(main.settings, "WARMUP_ON_STARTUP", True)
+    monkeypatch.setattr(main.settings, "VECTOR_INDEX_ON_STARTUP", False)
+    monkeypatch.setattr(main, "warm_up", warm_up)
+
+def test_not_ready_when_warm_up_fails(monkeypatch, run):
+    async def failing_warm_up():
+        raise RuntimeError("embedding quota exceeded")
+    prepare(monkeypatch, failing_warm_up)
+
+    async def start():
+        await main.startup_event()
+        return ready_status()
+
+    status, body = run(start())
+    assert status == 503
+    assert body["status"] == "unavailable"
+    assert "warm-up: embedding quota exceeded" in body["errors"]
+
+def test_ready_after_pool_and_warm_up(monkeypatch, run, postgres):
+    async def warm_up():
+        return {"total_ms": 1.0}
+    prepare(monkeypatch, warm_up)
+
+    async def start():
+        await main.startup_event()
+        return ready_status()
+
+    status, body = run(start())
+    assert status == 200
+    assert body["pool_open"] is True and "errors" not in body
@@ -0,0 +1,42 @@
+import asyncio
+import time
+import pytest
+from streaming import coalesce_tokens
+
+async def slow_source(pause):
+    yield "sources", []
+    yield "token", "Hel"
+    yield "token", "lo"
+    # The model stalls mid-answer
+    await asyncio.sleep(pause)
+    yield "token", " world"
+    yield "stats", {}
+
+async def collect(events):
+    started = time.monotonic()
+    return [(event, data, time.monotonic() - started) async for event, data in events]
+
+def test_partial_batch_flushes_when_source_stalls(run):
+    received = run(collect(coalesce_tokens(slow_source(0.5), max_chars=64, max_delay=0.05)))
+    assert [(event, data) for event, data, _ in received] == [
+        ("sources", []), ("token", "Hello"), ("token", " world"), ("stats", {}),
+    ]
+    # "Hello" goes out on the timer, not when " world" arrives
+    assert received[1][2] < 0.3
+
+def test_batches_split_at_max_chars(run):
+    async def tokens():
+        for _ in range(10):
+            yield "token", "abcd"
+    received = run(collect(coalesce_tokens(tokens(), max_chars=16, max_delay=10)))
+    assert [data for _, data, _ in received] == ["abcd" * 4, "abcd" * 4, "abcd" * 2]
+
+def test_source_errors_propagate(run):
+    async def failing():
+        yield "token", "partial"
+        raise RuntimeError("model failed")
+    async def consume():
+        async for _ in coalesce_tokens(failing()):
+            pass
+    with pytest.raises(RuntimeError, match="model failed"):
+        run(consume())
@@ -0,0 +1,86 @@
+import uuid
+from contextlib import asynccontextmanager
+import psycopg
+import pytest
+import db
+import vector_index
+import vector_search
+from config import get_settings
+from vector_search import AsyncVectorSearch
+
+COLLECTION = "test_vector_search"
+
+def load_collection(texts):
+    """(Re)create the collection under a new uuid, as a full rebuild does"""
+    collection_id = uuid.uuid4()
+    with psycopg.connect(get_settings().ASYNC_DATABASE_URL) as conn:
+        conn.execute("DELETE FROM langchain_pg_collection WHERE name = %s", (COLLECTION,))
+        conn.execute(
+            "INSERT INTO langchain_pg_collection (uuid, name, cmetadata) VALUES (%s, %s, '{}')",
+            (collection_id, COLLECTION),
+        )
+        for i, text in enumerate(texts):
+            conn.execute(
+                "INSERT INTO langchain_pg_embedding (id, collection_id, embedding, document, cmetadata) "
+                "VALUES (%s, %s, %s::vector, %s, %s)",
+                (f"{collection_id}-{i}", collection_id, f"[{i + 1},1,0]", text, '{"is_thesis": true}'),
+            )
+
+@pytest.fixture
+def search(postgres, monkeypatch):
+    search = AsyncVectorSearch(embeddings=None, collection_name=COLLECTION)
+    search.index_type, search.quantization = "hnsw", "none"
+    search.leases = 0
+
+    @asynccontextmanager
+    async def counted_lease(*args, **kwargs):
+        search.leases += 1
+        async with db.lease_connection(*args, **kwargs) as conn:
+            yield conn
+    monkeypatch.setattr(vector_search, "lease_connection", counted_lease)
+    yield search
+    with psycopg.connect(get_settings().ASYNC_DATABASE_URL) as conn:
+        conn.execute("DELETE FROM langchain_pg_collection WHERE name = %s", (COLLECTION,))
+
+def test_empty_result_is_not_retried(search, run):
+    load_collection(["a", "b"])
+
+    async def scenario():
+        await search.asimilarity_search_by_vector([1, 1, 0], k=2)
+        search.leases = 0
+        # Nothing matches the filter: one lease, and the cached collection is kept
+        docs = await search.asimilarity_search_by_vector([1, 1, 0], k=2, filter={"is_thesis": False})
+        return docs, search.leases, search._collection
+
+    docs, leases, collection = run(scenario())
+    assert docs == [] and leases == 1 and collection is not None
+
+def test_rebuilt_collection_is_re_resolved(search, run):
+    load_collection(["old"])
+
+    async def search_once():
+        return [doc.page_content for doc in await search.asimilarity_search_by_vector([1, 1, 0], k=2)]
+
+    assert run(search_once()) == ["old"]
+    load_collection(["new"])
+    assert run(search_once()) == ["new"]
+
+def test_invalid_index_is_rebuilt(search):
+    load_collection(["a", "b"])
+    name = vector_index.index_name(COLLECTION, "hnsw")
+    with psycopg.connect(get_settings().ASYNC_DATABASE_URL, autocommit=True) as conn:
+        collection_id = conn.execute(
+            "SELECT uuid FROM langchain_pg_collection WHERE name = %s", (COLLECTION,)
+        ).fetchone()[0]
+        # A concurrent build that fails halfway leaves the index behind, marked invalid
+        with pytest.raises(psycopg.errors.UniqueViolation):
+            conn.execute(
+                f'CREATE UNIQUE INDEX CONCURRENTLY "{name}" ON langchain_pg_embedding (collection_id) '
+                f"WHERE collection_id = '{collection_id}'"
+            )
+        assert vector_index.list_indexes(conn, COLLECTION) == []
+
+        assert vector_index.create_index("hnsw", collection_name=COLLECTION, quantization="none") == name
+        indexes = dict(vector_index.list_indexes(conn, COLLECTION))
+        assert "USING hnsw" in indexes[name]
+        conn.execute(f'DROP INDEX IF EXISTS "{name}"')
@@ -0,0 +1,542 @@
+"""
+ANN index management for the PGVector collection.
+
+PGVector stores embeddings in an untyped ``vector`` column, which pgvector
+cannot index, so the index is built on a typed cast of the column and is
+partial on the collection's uuid:
+
+    CREATE INDEX ... USING hnsw ((embedding::vector(N)) vector_cosine_ops)
+        WHERE collection_id = '<uuid>'
+
+Above 2000 dimensions (gemini-embedding-001 returns 3072) pgvector can only
+index ``halfvec``, so the cast switches to ``halfvec(N)`` (pgvector >= 0.7).
+Searches must use the same expression to hit the index; see
+vector_search.AsyncVectorSearch.
+
+With VECTOR_QUANTIZATION set, the index holds a compact form of the
+embedding instead (the table keeps the full vectors):
+
+- ``halfvec``: 16-bit floats, half the size (pgvector >= 0.7)
+- ``binary``: one sign bit per dimension, 1/32 of the size, hamming
+  distance (pgvector >= 0.7)
+- ``truncate``: the first VECTOR_TRUNCATE_DIMS dimensions (gemini-embedding-001
+  is trained so that prefixes remain usable embeddings)
+
+Searches take VECTOR_RESCORE_CANDIDATES candidates from the compact index
+and rescore them with the exact distance on the full vectors. Each layout has
+its own index name, so a new one can be built next to the current one before
+switching; ``python vector_index.py quantization`` compares their size and recall.
+
+Quota-aware retrieval filters on whether a chunk comes from the thesis, so
+that expression gets its own btree index (ensure_partition_index). Hybrid
+retrieval adds a generated ``tsvector`` column over the chunk text with a
+GIN index (ensure_text_search_index).
+
+Usage:
+    python vector_index.py status
+    python vector_index.py create [--method hnsw|ivfflat] [--m 16] [--ef-construction 64] [--lists N]
+    python vector_index.py drop [--method hnsw|ivfflat]
+    python vector_index.py report [--queries 50] [--k 20]
+    python vector_index.py quantization [--queries 50] [--k 20] [--candidates 20,50,100,200]
+"""
+
+import argparse
+import json
+import math
+import statistics
+import time
+from typing import Dict, List, Optional, Sequence, Tuple
+import psycopg
+from config import get_settings
+
+settings = get_settings()
+
+COLLECTION_NAME = "thesis_docs"
+
+# pgvector cannot index `vector` columns with more dimensions than this
+MAX_VECTOR_INDEX_DIMS = 2000
+
+# Compact index layouts (VECTOR_QUANTIZATION) and the pgvector version they need
+QUANTIZATIONS = ("none", "halfvec", "binary", "truncate")
+MIN_PGVECTOR_VERSION = {"halfvec": (0, 7, 0), "binary": (0, 7, 0)}
+MAX_HNSW_EF_SEARCH = 1000  # pgvector's upper bound for hnsw.ef_search
+
+# Thesis / non-thesis partition key; chunks of other PDFs have no is_thesis key
+THESIS_PARTITION_EXPRESSION = "COALESCE((e.cmetadata->>'is_thesis')::boolean, false)"
+PARTITION_INDEX_NAME = "ix_cmetadata_is_thesis"
+
+# Full-text search over the chunk text; the thesis is in Portuguese, most papers in English
+TEXT_SEARCH_COLUMN = "document_tsv"
+TEXT_SEARCH_CONFIGS = ("portuguese", "english")
+TEXT_SEARCH_INDEX_NAME = "ix_langchain_pg_embedding_document_tsv"
+
+def text_search_vector(column: str = "document") -> str:
+    return " || ".join(
+        f"to_tsvector('{config}', coalesce({column}, ''))" for config in TEXT_SEARCH_CONFIGS
+    )
+
+def text_search_query(param: str) -> str:
+    """
+    tsquery ORing the words in a text[] parameter under every config. Words
+    that are stopwords in any config are dropped first, otherwise Portuguese
+    stopwords like "que" would match as English terms.
+    """
+    kept = " AND ".join(f"length(to_tsvector('{config}', w)) > 0" for config in TEXT_SEARCH_CONFIGS)
+    query = " || ".join(f"to_tsquery('{config}', t.terms)" for config in TEXT_SEARCH_CONFIGS)
+    return (
+        f"(SELECT {query} FROM (SELECT string_agg(w, ' | ') AS terms "
+        f"FROM unnest({param}::text[]) AS w WHERE {kept}) t)"
+    )
+
+def vector_type(dims: int) -> str:
+    """Type used for the indexed expression: vector, or halfvec above 2000 dims"""
+    return "vector" if dims <= MAX_VECTOR_INDEX_DIMS else "halfvec"
+
+def truncate_dims(dims: int) -> int:
+    return min(settings.VECTOR_TRUNCATE_DIMS, dims)
+
+def compact_value(value: str, dims: int, quantization: str) -> str:
+    """The indexed form of a vector expression (a column or a ::vector parameter)"""
+    if quantization == "halfvec":
+        return f"({value}::halfvec({dims}))"
+    if quantization == "binary":
+        return f"(binary_quantize({value})::bit({dims}))"
+    if quantization == "truncate":
+        size = truncate_dims(dims)
+        return f"((({value})::real[])[1:{size}]::vector({size}))"
+    return f"({value}::{vector_type(dims)}({dims}))"
+
+def operator_class(dims: int, quantization: str) -> str:
+    if quantization == "halfvec":
+        return "halfvec_cosine_ops"
+    if quantization == "binary":
+        return "bit_hamming_ops"
+    if quantization == "truncate":
+        return "vector_cosine_ops"
+    return f"{vector_type(dims)}_cosine_ops"
+
+def index_distance(
+    dims: int,
+    quantization: str = "none",
+    column: str = "e.embedding",
+    operand: str = "%(embedding)s",
+) -> str:
+    """Distance between a column and the query operand, in the form the index holds"""
+    operator = "<~>" if quantization == "binary" else "<=>"
+    return (
+        f"{compact_value(column, dims, quantization)} {operator} "
+        f"{compact_value(f'{operand}::vector', dims, quantization)}"
+    )
+
+def rescore_query(candidates: str, operand: str = "%(embedding)s") -> str:
+    """Order the rows of a candidate query by exact cosine distance on the full vectors"""
+    return (
+        f"SELECT c.*, r.embedding <=> {operand}::vector AS exact_distance "
+        f"FROM ({candidates}) c JOIN langchain_pg_embedding r ON r.id = c.id "
+        f"ORDER BY exact_distance"
+    )
+
+def index_name(collection_name: str, method: str, quantization: str = "none") -> str:
+    if quantization == "none":
+        return f"ix_{collection_name}_embedding_{method}"
+    return f"ix_{collection_name}_embedding_{method}_{quantization}"
+
+def pgvector_version(conn: psycopg.Connection) -> Tuple[int, ...]:
+    row = conn.execute("SELECT extversion FROM pg_extension WHERE extname = 'vector'").fetchone()
+    return tuple(int(part) for part in row[0].split(".")) if row else ()
+
+def check_quantization(conn: psycopg.Connection, quantization: str) -> None:
+    """Raise if the server's pgvector can't build this layout"""
+    if quantization not in QUANTIZATIONS:
+        raise ValueError(f"Unknown quantization: {quantization} (expected one of {', '.join(QUANTIZATIONS)})")
+    required = MIN_PGVECTOR_VERSION.get(quantization)
+    version = pgvector_version(conn)
+    if required and version < required:
+        raise RuntimeError(
+            f"VECTOR_QUANTIZATION={quantization} needs pgvector >= {'.'.join(map(str, required))}, "
+            f"the server has {'.'.join(map(str, version)) or 'none'}"
+        )
+
+def search_settings(method: str, candidates: int = 0) -> List[Tuple[str, str]]:
+    """
+    Per-query GUCs for the configured index type (applied with SET LOCAL).
+    HNSW returns at most ef_search rows, so it is raised to `candidates`.
+    """
+    if method == "hnsw":
+        ef_search = min(max(settings.HNSW_EF_SEARCH, candidates), MAX_HNSW_EF_SEARCH)
+        gucs = [("hnsw.ef_search", str(ef_search))]
+        if settings.HNSW_ITERATIVE_SCAN:
+            # Keeps filtered searches from coming back short (pgvector >= 0.8)
+            gucs.append(("hnsw.iterative_scan", settings.HNSW_ITERATIVE_SCAN))
+        return gucs
+    if method == "ivfflat":
+        return [("ivfflat.probes", str(settings.IVFFLAT_PROBES))]
+    return []
+
+def get_collection_info(conn: psycopg.Connection, collection_name: str = COLLECTION_NAME) -> Optional[Dict]:
+    """uuid, embedding dimensions and row count of a collection (None if it doesn't exist)"""
+    row = conn.execute(
+        "SELECT c.uuid, "
+        "(SELECT vector_dims(e.embedding) FROM langchain_pg_embedding e "
+        " WHERE e.collection_id = c.uuid LIMIT 1), "
+        "(SELECT count(*) FROM langchain_pg_embedding e WHERE e.collection_id = c.uuid) "
+        "FROM langchain_pg_collection c WHERE c.name = %s",
+        (collection_name,),
+    ).fetchone()
+    if row is None:
+        return None
+    return {"uuid": str(row[0]), "dims": row[1], "rows": row[2]}
+
+def list_indexes(conn: psycopg.Connection, collection_name: str = COLLECTION_NAME) -> List[Tuple[str, str]]:
+    """The collection's valid ANN indexes (name, definition); invalid ones are never used by queries"""
+    rows = conn.execute(
+        "SELECT c.relname, pg_get_indexdef(i.indexrelid) FROM pg_index i "
+        "JOIN pg_class c ON c.oid = i.indexrelid "
+        "WHERE i.indrelid = 'langchain_pg_embedding'::regclass AND i.indisvalid AND c.relname LIKE %s",
+        (f"ix_{collection_name}_embedding_%",),
+    ).fetchall()
+    return [(row[0], row[1]) for row in rows]
+
+def drop_invalid_index(conn: psycopg.Connection, name: str) -> bool:
+    """
+    Drop `name` if an interrupted CREATE INDEX CONCURRENTLY left it invalid:
+    the planner ignores it, but IF NOT EXISTS and name checks see it as built
+    """
+    row = conn.execute(
+        "SELECT i.indisvalid FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid WHERE c.relname = %s",
+        (name,),
+    ).fetchone()
+    if row is None or row[0]:
+        return False
+    print(f"Dropping {name}: an interrupted build left it invalid")
+    conn.execute(f'DROP INDEX CONCURRENTLY IF EXISTS "{name}"')
+    return True
+
+def default_lists(rows: int) -> int:
+    """pgvector guidance: rows / 1000 up to 1M rows, sqrt(rows) beyond"""
+    if rows <= 1_000_000:
+        return max(rows // 1000, 1)
+    return int(math.sqrt(rows))
+
+def create_index(
+    method: str = "hnsw",
+    m: Optional[int] = None,
+    ef_construction: Optional[int] = None,
+    lists: Optional[int] = None,
+    collection_name: str = COLLECTION_NAME,
+    quantization: Optional[str] = None,
+) -> Optional[str]:
+    """
+    Build (or rebuild) the ANN index for the collection without blocking
+    writers (CREATE INDEX CONCURRENTLY). An existing index of the same name
+    that targets another collection uuid, e.g. after `ingest.py --mode full`,
+    or that an interrupted build left invalid, is dropped first. Returns the index name, or None if there is nothing to index.
+    """
+    quantization = quantization or settings.VECTOR_QUANTIZATION
+    with psycopg.connect(settings.ASYNC_DATABASE_URL, autocommit=True) as conn:
+        check_quantization(conn, quantization)
+        info = get_collection_info(conn, collection_name)
+        if info is None or not info["dims"]:
+            print(f"Collection {collection_name} is empty, nothing to index.")
+            return None
+
+        name = index_name(collection_name, method, quantization)
+        drop_invalid_index(conn, name)
+        for existing_name, definition in list_indexes(conn, collection_name):
+            if existing_name == name:
+                if info["uuid"] in definition:
+                    print(f"✓ Index {name} already exists")
+                    return name
+                print(f"Dropping {name}: it targets a previous collection")
+                conn.execute(f'DROP INDEX CONCURRENTLY IF EXISTS "{name}"')
+
+        dims = info["dims"]
+        if method == "hnsw":
+            options = (
+                f"m = {int(m or settings.HNSW_M)}, "
+                f"ef_construction = {int(ef_construction or settings.HNSW_EF_CONSTRUCTION)}"
+            )
+        elif method == "ivfflat":
+            options = f"lists = {int(lists or settings.IVFFLAT_LISTS or default_lists(info['rows']))}"
+        else:
+            raise ValueError(f"Unknown index method: {method}")
+
+        expression = compact_value("embedding", dims, quantization)
+        print(f"Building {method} index {name} on {info['rows']} rows ({dims} dims, {expression})...")
+        start = time.perf_counter()
+        conn.execute(
+            f'CREATE INDEX CONCURRENTLY "{name}" ON langchain_pg_embedding '
+            f"USING {method} ({expression} {operator_class(dims, quantization)}) "
+            f"WITH ({options}) "
+            f"WHERE collection_id = '{info['uuid']}'"
+        )
+        print(f"✓ Index {name} built in {time.perf_counter() - start:.1f}s")
+        return name
+
+def drop_index(method: str = "hnsw", collection_name: str = COLLECTION_NAME, quantization: str = "none"):
+    name = index_name(collection_name, method, quantization)
+    with psycopg.connect(settings.ASYNC_DATABASE_URL, autocommit=True) as conn:
+        conn.execute(f'DROP INDEX CONCURRENTLY IF EXISTS "{name}"')
+    print(f"✓ Dropped {name}")
+
+def ensure_partition_index():
+    """Index the is_thesis partition key used by quota-aware retrieval"""
+    expression = THESIS_PARTITION_EXPRESSION.replace("e.cmetadata", "cmetadata")
+    with psycopg.connect(settings.ASYNC_DATABASE_URL, autocommit=True) as conn:
+        drop_invalid_index(conn, PARTITION_INDEX_NAME)
+        conn.execute(
+            f'CREATE INDEX CONCURRENTLY IF NOT EXISTS "{PARTITION_INDEX_NAME}" '
+            f"ON langchain_pg_embedding (collection_id, ({expression}))"
+        )
+
+def ensure_text_search_index():
+    """
+    Add the generated tsvector column and its GIN index. Adding the column
+    rewrites the table once; later calls are no-ops.
+    """
+    with psycopg.connect(settings.ASYNC_DATABASE_URL, autocommit=True) as conn:
+        conn.execute(
+            f"ALTER TABLE langchain_pg_embedding ADD COLUMN IF NOT EXISTS {TEXT_SEARCH_COLUMN} "
+            f"tsvector GENERATED ALWAYS AS ({text_search_vector()}) STORED"
+        )
+        drop_invalid_index(conn, TEXT_SEARCH_INDEX_NAME)
+        conn.execute(
+            f'CREATE INDEX CONCURRENTLY IF NOT EXISTS "{TEXT_SEARCH_INDEX_NAME}" '
+            f"ON langchain_pg_embedding USING gin ({TEXT_SEARCH_COLUMN})"
+        )
+
+def ensure_index() -> Optional[str]:
+    """Create the index selected by VECTOR_INDEX_TYPE if it is missing"""
+    if settings.VECTOR_INDEX_TYPE == "none":
+        return None
+    return create_index(settings.VECTOR_INDEX_TYPE)
+
+def _timed_search(conn: psycopg.Connection, sql: str, params: dict, gucs: List[Tuple[str, str]]) -> Tuple[List[str], float]:
+    with conn.transaction():
+        for name, value in gucs:
+            conn.execute("SELECT set_config(%s, %s, true)", (name, value))
+        start = time.perf_counter()
+        rows = conn.execute(sql, params).fetchall()
+        elapsed = (time.perf_counter() - start) * 1000
+    return [row[0] for row in rows], elapsed
+
+def recall_report(
+    method: str = "hnsw", queries: int = 50, k: int = 20, collection_name: str = COLLECTION_NAME
+) -> Dict:
+    """
+    Compare indexed search against exact search using stored chunk embeddings
+    as queries: recall@k and p50/p95 latency for a sweep of ef_search/probes.
+    """
+    # autocommit: each search runs in its own transaction so SET LOCAL doesn't leak
+    with psycopg.connect(settings.ASYNC_DATABASE_URL, autocommit=True) as conn:
+        info = get_collection_info(conn, collection_name)
+        if info is None or not info["dims"]:
+            print(f"Collection {collection_name} is empty.")
+            return {}
+        dims = info["dims"]
+        sample = conn.execute(
+            "SELECT embedding::text FROM langchain_pg_embedding WHERE collection_id = %s "
+            "ORDER BY random() LIMIT %s",
+            (info["uuid"], queries),
+        ).fetchall()
+        probe_vectors = [row[0] for row in sample]
+
+        exact_sql = (
+            "SELECT e.id FROM langchain_pg_embedding e WHERE e.collection_id = %(collection_id)s "
+            "ORDER BY e.embedding <=> %(embedding)s::vector LIMIT %(k)s"
+        )
+        indexed_sql = (
+            "SELECT e.id FROM langchain_pg_embedding e WHERE e.collection_id = %(collection_id)s "
+            f"ORDER BY {index_distance(dims)} LIMIT %(k)s"
+        )
+
+        truth = []
+        exact_latencies = []
+        for vector in probe_vectors:
+            params = {"collection_id": info["uuid"], "embedding": vector, "k": k}
+            # Disabling index scans guarantees the brute-force ground truth
+            ids, elapsed = _timed_search(conn, exact_sql, params, [("enable_indexscan", "off")])
+            truth.append(set(ids))
+            exact_latencies.append(elapsed)
+
+        sweep_name = "hnsw.ef_search" if method == "hnsw" else "ivfflat.probes"
+        sweep_values = [k, 2 * k, 4 * k, 8 * k] if method == "hnsw" else [1, 5, 10, 20, 50]
+        results = {
+            "rows": info["rows"],
+            "dims": dims,
+            "k": k,
+            "queries": len(probe_vectors),
+            "exact": _latency_summary(exact_latencies),
+            "indexed": [],
+        }
+        for value in sweep_values:
+            recalls, latencies = [], []
+            for vector, expected in zip(probe_vectors, truth):
+                params = {"collection_id": info["uuid"], "embedding": vector, "k": k}
+                ids, elapsed = _timed_search(conn, indexed_sql, params, [(sweep_name, str(value))])
+                recalls.append(len(expected & set(ids)) / max(len(expected), 1))
+                latencies.append(elapsed)
+            results["indexed"].append({
+                sweep_name: value,
+                "recall": round(statistics.mean(recalls), 4),
+                **_latency_summary(latencies),
+            })
+
+    print(f"\nRecall vs latency: {results['rows']} rows, {dims} dims, k={k}, {len(probe_vectors)} queries")
+    print(f"  exact:                     p50 {results['exact']['p50_ms']:.2f}ms  p95 {results['exact']['p95_ms']:.2f}ms")
+    for row in results["indexed"]:
+        print(f"  {sweep_name}={row[sweep_name]:<5} recall {row['recall']:.3f}  "
+              f"p50 {row['p50_ms']:.2f}ms  p95 {row['p95_ms']:.2f}ms")
+    return results
+
+def quantization_report(
+    method: str = "hnsw",
+    queries: int = 50,
+    k: int = 20,
+    candidates: Sequence[int] = (20, 50, 100, 200),
+    collection_name: str = COLLECTION_NAME,
+) -> Dict:
+    """
+    Size and recall of every index layout the server supports, against exact
+    search on the full vectors: bytes per vector, index size (when the layout's
+    index exists) and recall@k / latency after rescoring n candidates. Layouts
+    without an index are measured with a scan, so their recall holds but their
+    latency doesn't.
+    """
+    with psycopg.connect(settings.ASYNC_DATABASE_URL, autocommit=True) as conn:
+        info = get_collection_info(conn, collection_name)
+        if info is None or not info["dims"]:
+            print(f"Collection {collection_name} is empty.")
+            return {}
+        dims = info["dims"]
+        version = pgvector_version(conn)
+        layouts = [
+            quantization for quantization in QUANTIZATIONS
+            if version >= MIN_PGVECTOR_VERSION.get(quantization, ())
+            # Full-precision layout above 2000 dims is halfvec already
+            and (quantization != "none" or dims <= MAX_VECTOR_INDEX_DIMS)
+        ]
+        skipped = sorted(set(QUANTIZATIONS) - set(layouts))
+        sample = conn.execute(
+            "SELECT embedding::text FROM langchain_pg_embedding WHERE collection_id = %s "
+            "ORDER BY random() LIMIT %s",
+            (info["uuid"], queries),
+        ).fetchall()
+        probe_vectors = [row[0] for row in sample]
+
+        exact_sql = (
+            "SELECT e.id FROM langchain_pg_embedding e WHERE e.collection_id = %(collection_id)s "
+            "ORDER BY e.embedding <=> %(embedding)s::vector LIMIT %(k)s"
+        )
+        truth = []
+        for vector in probe_vectors:
+            params = {"collection_id": info["uuid"], "embedding": vector, "k": k}
+            ids, _ = _timed_search(conn, exact_sql, params, [("enable_indexscan", "off")])
+            truth.append(set(ids))
+
+        existing = dict(list_indexes(conn, collection_name))
+        results = {
+            "rows": info["rows"],
+            "dims": dims,
+            "k": k,
+            "queries": len(probe_vectors),
+            "pgvector": ".".join(map(str, version)),
+            "shared_buffers": conn.execute("SHOW shared_buffers").fetchone()[0],
+            "unsupported": skipped,
+            "layouts": {},
+        }
+        for quantization in layouts:
+            name = index_name(collection_name, method, quantization)
+            indexed = name in existing and info["uuid"] in existing[name]
+            bytes_per_vector = conn.execute(
+                f"SELECT avg(pg_column_size({compact_value('e.embedding', dims, quantization)})) "
+                "FROM langchain_pg_embedding e WHERE e.collection_id = %s",
+                (info["uuid"],),
+            ).fetchone()[0]
+            layout = {
+                "bytes_per_vector": round(float(bytes_per_vector), 1),
+                "vectors_mb": round(float(bytes_per_vector) * info["rows"] / (1 << 20), 2),
+                "index": name if indexed else None,
+                "index_mb": (
+                    round(conn.execute("SELECT pg_relation_size(%s::regclass)", (name,)).fetchone()[0] / (1 << 20), 2)
+                    if indexed else None
+                ),
+                "rescored": [],
+            }
+            candidate_sql = rescore_query(
+                "SELECT e.id FROM langchain_pg_embedding e WHERE e.collection_id = %(collection_id)s "
+                f"ORDER BY {index_distance(dims, quantization)} LIMIT %(candidates)s"
+            ) + " LIMIT %(k)s"
+            for count in candidates:
+                recalls, latencies = [], []
+                gucs = search_settings(method, count) if indexed else [("enable_indexscan", "off")]
+                for vector, expected in zip(probe_vectors, truth):
+                    params = {"collection_id": info["uuid"], "embedding": vector, "k": k, "candidates": max(count, k)}
+                    ids, elapsed = _timed_search(conn, candidate_sql, params, gucs)
+                    recalls.append(len(expected & set(ids)) / max(len(expected), 1))
+                    latencies.append(elapsed)
+                layout["rescored"].append({
+                    "candidates": max(count, k),
+                    "recall": round(statistics.mean(recalls), 4),
+                    **_latency_summary(latencies),
+                })
+            results["layouts"][quantization] = layout
+
+    print(f"\nIndex layouts: {results['rows']} rows, {dims} dims, k={k}, {len(probe_vectors)} queries, "
+          f"pgvector {results['pgvector']}, shared_buffers {results['shared_buffers']}")
+    for quantization, layout in results["layouts"].items():
+        index = f"index {layout['index_mb']}MB" if layout["index"] else "no index (scan)"
+        print(f"  {quantization:<9} {layout['bytes_per_vector']:>8.1f} B/vector  "
+              f"{layout['vectors_mb']:>8.2f}MB vectors  {index}")
+        for row in layout["rescored"]:
+            print(f"    rescore {row['candidates']:<5} recall {row['recall']:.3f}  "
+                  f"p50 {row['p50_ms']:.2f}ms  p95 {row['p95_ms']:.2f}ms")
+    if skipped:
+        print(f"  (needs pgvector >= 0.7: {', '.join(skipped)})")
+    return results
+
+def _latency_summary(latencies: List[float]) -> Dict[str, float]:
+    ordered = sorted(latencies)
+    return {
+        "p50_ms": round(statistics.median(ordered), 3),
+        "p95_ms": round(ordered[min(int(len(ordered) * 0.95), len(ordered) - 1)], 3),
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Manage the ANN index of the thesis_docs collection")
+    parser.add_argument("command", choices=["status", "create", "drop", "report", "quantization"])
+    parser.add_argument("--method", choices=["hnsw", "ivfflat"],
+                        default=settings.VECTOR_INDEX_TYPE if settings.VECTOR_INDEX_TYPE != "none" else "hnsw")
+    parser.add_argument("--m", type=int, default=None)
+    parser.add_argument("--ef-construction", type=int, default=None)
+    parser.add_argument("--lists", type=int, default=None)
+    parser.add_argument("--quantization", choices=QUANTIZATIONS, default=settings.VECTOR_QUANTIZATION,
+                        help="Index layout to create or drop")
+    parser.add_argument("--candidates", type=lambda value: [int(n) for n in value.split(",")],
+                        default=[20, 50, 100, 200], help="Rescored candidate counts (quantization report)")
+    parser.add_argument("--output", help="Write the quantization report as JSON")
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--k", type=int, default=settings.VECTOR_SEARCH_K)
+    args = parser.parse_args()
+
+    if args.command == "status":
+        with psycopg.connect(settings.ASYNC_DATABASE_URL) as conn:
+            print(get_collection_info(conn))
+            for name, definition in list_indexes(conn):
+                print(f"  {name}: {definition}")
+    elif args.command == "create":
+        ensure_partition_index()
+        ensure_text_search_index()
+        create_index(args.method, m=args.m, ef_construction=args.ef_construction, lists=args.lists,
+                     quantization=args.quantization)
+    elif args.command == "drop":
+        drop_index(args.method, quantization=args.quantization)
+    elif args.command == "report":
+        recall_report(args.method, queries=args.queries, k=args.k)
+    elif args.command == "quantization":
+        report = quantization_report(args.method, queries=args.queries, k=args.k, candidates=args.candidates)
+        if args.output:
+            with open(args.output, "w") as f:
+                json.dump(report, f, indent=2)
+                f.write("\n")
+            print(f"✓ Report written to {args.output}")
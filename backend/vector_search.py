@@ -0,0 +1,305 @@
+"""
+Async similarity search over the PGVector tables.
+
+PGVector's sync methods run through a psycopg2 SQLAlchemy engine and block
+the event loop while the query runs. This module queries the same
+``langchain_pg_embedding`` / ``langchain_pg_collection`` tables through the
+shared psycopg AsyncConnectionPool so retrieval can be awaited.
+
+With VECTOR_INDEX_TYPE set, queries use the typed, per-collection expression
+that vector_index.py indexes, and apply hnsw.ef_search / ivfflat.probes
+with SET LOCAL for the query's transaction. With VECTOR_QUANTIZATION set,
+each branch of the query takes VECTOR_RESCORE_CANDIDATES rows from the
+compact index, and the rows are reordered by exact distance before the
+per-branch limits are applied.
+
+Hybrid retrieval pairs the dense search with full-text search over the
+generated ``document_tsv`` column and merges both rankings with
+reciprocal-rank fusion.
+"""
+
+import json
+import re
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+import psycopg
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from config import get_settings
+from db import lease_connection, to_vector_literal
+import vector_index
+import metrics
+
+settings = get_settings()
+
+# Builds a query from (collection predicate, distance expression)
+QueryBuilder = Callable[[str, str], str]
+
+# Words kept from a question for the lexical query
+MAX_TEXT_SEARCH_TERMS = 32
+
+# Query parameters holding a LIMIT, widened to the candidate count when rescoring
+LIMIT_PARAMS = ("k", "thesis_k", "other_k")
+
+def text_search_terms(query: str) -> List[str]:
+    """
+    Distinct words of the question, ORed into the tsquery: ranking favours
+    chunks matching more (and rarer) terms without requiring all of them.
+    """
+    return list(dict.fromkeys(re.findall(r"\w+", query.lower())))[:MAX_TEXT_SEARCH_TERMS]
+
+def reciprocal_rank_fusion(rankings: Sequence[List[Document]], k: int = 60) -> List[Document]:
+    """Merge ranked lists by summing 1 / (k + rank) per document id"""
+    scores: Dict[str, float] = {}
+    documents: Dict[str, Document] = {}
+    for ranking in rankings:
+        for rank, doc in enumerate(ranking, 1):
+            scores[doc.id] = scores.get(doc.id, 0.0) + 1.0 / (k + rank)
+            documents.setdefault(doc.id, doc)
+    return [documents[doc_id] for doc_id in sorted(scores, key=scores.get, reverse=True)]
+
+class AsyncVectorSearch:
+    """Cosine similarity search against one PGVector collection"""
+
+    def __init__(self, embeddings: Embeddings, collection_name: str = "thesis_docs"):
+        self.embeddings = embeddings
+        self.collection_name = collection_name
+        self.index_type = settings.VECTOR_INDEX_TYPE
+        self.quantization = settings.VECTOR_QUANTIZATION if self.index_type != "none" else "none"
+        # (collection uuid, dims) resolved on first indexed search
+        self._collection: Optional[tuple] = None
+
+    async def asimilarity_search(
+        self, query: str, k: int = 4, filter: Optional[Dict[str, Any]] = None
+    ) -> List[Document]:
+        """Embed the query and return the k closest documents"""
+        with metrics.timed("embedding"):
+            embedding = await self.embeddings.aembed_query(query)
+        return await self.asimilarity_search_by_vector(embedding, k=k, filter=filter)
+
+    async def asimilarity_search_by_vector(
+        self,
+        embedding: Sequence[float],
+        k: int = 4,
+        filter: Optional[Dict[str, Any]] = None,
+    ) -> List[Document]:
+        """Return the k closest documents to an already computed embedding"""
+        # cmetadata @> filter uses the ix_cmetadata_gin index PGVector creates
+        def build(collection_predicate: str, distance: str) -> str:
+            return f"""
+                SELECT e.id, e.document, e.cmetadata
+                FROM langchain_pg_embedding e
+                WHERE {collection_predicate}
+                  AND (%(filter)s::jsonb IS NULL OR e.cmetadata @> %(filter)s::jsonb)
+                ORDER BY {distance}
+                LIMIT %(k)s
+            """
+
+        rows = await self._arun(build, {
+            "filter": json.dumps(filter) if filter else None,
+            "embedding": to_vector_literal(embedding),
+            "k": k,
+        })
+        return self._to_documents(rows[:k])
+
+    async def asimilarity_search_partitioned(
+        self, query: str, thesis_k: int, other_k: int
+    ) -> Tuple[List[Document], List[Document]]:
+        """
+        Closest thesis chunks and closest non-thesis chunks, each with its own
+        limit, in one UNION ALL query. Both branches filter on the indexed
+        is_thesis expression (vector_index.ensure_partition_index).
+        """
+        with metrics.timed("embedding"):
+            embedding = await self.embeddings.aembed_query(query)
+        partition = vector_index.THESIS_PARTITION_EXPRESSION
+
+        def build(collection_predicate: str, distance: str) -> str:
+            return f"""
+                (SELECT e.id, e.document, e.cmetadata, true
+                 FROM langchain_pg_embedding e
+                 WHERE {collection_predicate} AND {partition} = true
+                 ORDER BY {distance}
+                 LIMIT %(thesis_k)s)
+                UNION ALL
+                (SELECT e.id, e.document, e.cmetadata, false
+                 FROM langchain_pg_embedding e
+                 WHERE {collection_predicate} AND {partition} = false
+                 ORDER BY {distance}
+                 LIMIT %(other_k)s)
+            """
+
+        rows = await self._arun(build, {
+            "embedding": to_vector_literal(embedding),
+            "thesis_k": thesis_k,
+            "other_k": other_k,
+        })
+        thesis_docs = self._to_documents([row for row in rows if row[3]][:thesis_k])
+        other_docs = self._to_documents([row for row in rows if not row[3]][:other_k])
+        return thesis_docs, other_docs
+
+    async def aget_by_ids(self, ids: Sequence[str]) -> List[Document]:
+        """Chunks by id, in the given order (missing ids are skipped)"""
+        if not ids:
+            return []
+        async with lease_connection() as conn:
+            async with conn.cursor() as cursor:
+                await cursor.execute(
+                    "SELECT id, document, cmetadata FROM langchain_pg_embedding WHERE id = ANY(%s)",
+                    (list(ids),),
+                )
+                rows = {row[0]: row for row in await cursor.fetchall()}
+        return self._to_documents([rows[doc_id] for doc_id in ids if doc_id in rows])
+
+    async def atext_search(self, query: str, k: int = 4) -> List[Document]:
+        """Chunks ranked by full-text match (ts_rank_cd) against the question's words"""
+        def build(source: str, match: str) -> str:
+            return f"""
+                SELECT e.id, e.document, e.cmetadata
+                FROM {source}
+                WHERE {match}
+                ORDER BY ts_rank_cd(e.{vector_index.TEXT_SEARCH_COLUMN}, q.query) DESC
+                LIMIT %(k)s
+            """
+
+        rows = await self._atext_run(build, query, {"k": k})
+        return self._to_documents(rows)
+
+    async def atext_search_partitioned(
+        self, query: str, thesis_k: int, other_k: int
+    ) -> Tuple[List[Document], List[Document]]:
+        """Full-text counterpart of asimilarity_search_partitioned"""
+        partition = vector_index.THESIS_PARTITION_EXPRESSION
+        rank = f"ts_rank_cd(e.{vector_index.TEXT_SEARCH_COLUMN}, q.query) DESC"
+
+        def build(source: str, match: str) -> str:
+            return f"""
+                (SELECT e.id, e.document, e.cmetadata, true
+                 FROM {source}
+                 WHERE {match} AND {partition} = true
+                 ORDER BY {rank}
+                 LIMIT %(thesis_k)s)
+                UNION ALL
+                (SELECT e.id, e.document, e.cmetadata, false
+                 FROM {source}
+                 WHERE {match} AND {partition} = false
+                 ORDER BY {rank}
+                 LIMIT %(other_k)s)
+            """
+
+        rows = await self._atext_run(build, query, {"thesis_k": thesis_k, "other_k": other_k})
+        thesis_docs = self._to_documents([row for row in rows if row[3]])
+        other_docs = self._to_documents([row for row in rows if not row[3]])
+        return thesis_docs, other_docs
+
+    async def _atext_run(
+        self, build: Callable[[str, str], str], query: str, params: Dict[str, Any]
+    ) -> list:
+        terms = text_search_terms(query)
+        if not terms:
+            return []
+        # The tsquery is computed once and joined to the table as a one-row relation
+        source = (
+            "langchain_pg_embedding e, "
+            f"(SELECT {vector_index.text_search_query('%(terms)s')} AS query) q"
+        )
+        match = (
+            "e.collection_id = (SELECT uuid FROM langchain_pg_collection WHERE name = %(collection)s) "
+            f"AND e.{vector_index.TEXT_SEARCH_COLUMN} @@ q.query"
+        )
+        try:
+            with metrics.timed("text_query"):
+                async with lease_connection() as conn:
+                    async with conn.cursor() as cursor:
+                        await cursor.execute(build(source, match), {
+                            **params, "terms": terms, "collection": self.collection_name
+                        })
+                        return await cursor.fetchall()
+        except psycopg.errors.UndefinedColumn:
+            print("⚠ document_tsv column missing, run ingest.py to enable lexical search")
+            return []
+
+    async def _arun(self, build: QueryBuilder, params: Dict[str, Any]) -> list:
+        """Run a query in its exact or indexed form, depending on VECTOR_INDEX_TYPE"""
+        with metrics.timed("vector_query"):
+            return await self._arun_query(build, params)
+
+    async def _arun_query(self, build: QueryBuilder, params: Dict[str, Any]) -> list:
+        if self.index_type == "none":
+            predicate = (
+                "e.collection_id = (SELECT uuid FROM langchain_pg_collection "
+                "WHERE name = %(collection)s)"
+            )
+            query = build(predicate, "e.embedding <=> %(embedding)s::vector")
+            async with lease_connection() as conn:
+                async with conn.cursor() as cursor:
+                    await cursor.execute(query, {**params, "collection": self.collection_name})
+                    return await cursor.fetchall()
+
+        return await self._aindexed(build, params)
+
+    async def _aresolve_collection(self, cursor) -> Optional[tuple]:
+        if self._collection is None:
+            await cursor.execute(
+                "SELECT c.uuid, (SELECT vector_dims(e.embedding) FROM langchain_pg_embedding e "
+                "WHERE e.collection_id = c.uuid LIMIT 1) "
+                "FROM langchain_pg_collection c WHERE c.name = %s",
+                (self.collection_name,),
+            )
+            row = await cursor.fetchone()
+            if row is not None and row[1]:
+                self._collection = (row[0], row[1])
+        return self._collection
+
+    async def _aindexed(self, build: QueryBuilder, params: Dict[str, Any]) -> list:
+        async with lease_connection() as conn:
+            async with conn.cursor() as cursor:
+                collection = await self._aresolve_collection(cursor)
+                if collection is None:
+                    return []
+                rows = await self._aquery_indexed(cursor, build, params, collection)
+                if rows:
+                    return rows
+                # Empty is usually a legitimate answer (e.g. a filter nothing
+                # matches); re-resolve only if a rebuild replaced the collection
+                await cursor.execute(
+                    "SELECT EXISTS (SELECT 1 FROM langchain_pg_collection WHERE uuid = %s AND name = %s)",
+                    (collection[0], self.collection_name),
+                )
+                if (await cursor.fetchone())[0]:
+                    return rows
+                self._collection = None
+                collection = await self._aresolve_collection(cursor)
+                if collection is None:
+                    return []
+                return await self._aquery_indexed(cursor, build, params, collection)
+
+    async def _aquery_indexed(
+        self, cursor, build: QueryBuilder, params: Dict[str, Any], collection: tuple
+    ) -> list:
+        collection_id, dims = collection
+        # Same expression and partial predicate as the index (vector_index.py)
+        query = build(
+            "e.collection_id = %(collection_id)s",
+            vector_index.index_distance(dims, self.quantization),
+        )
+        candidates = 0
+        if self.quantization != "none":
+            # Callers cut the exactly ordered rows back to their limits
+            candidates = settings.VECTOR_RESCORE_CANDIDATES
+            query = vector_index.rescore_query(query)
+            params = {
+                name: max(value, candidates) if name in LIMIT_PARAMS else value
+                for name, value in params.items()
+            }
+        # The lease is one transaction, so these only apply to this query
+        for name, value in vector_index.search_settings(self.index_type, candidates):
+            await cursor.execute("SELECT set_config(%s, %s, true)", (name, value))
+        await cursor.execute(query, {**params, "collection_id": collection_id})
+        return await cursor.fetchall()
+
+    @staticmethod
+    def _to_documents(rows) -> List[Document]:
+        return [
+            Document(id=row[0], page_content=row[1] or "", metadata=row[2] or {})
+            for row in rows
+        ]